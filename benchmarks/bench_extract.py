@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Benchmark of the archive extraction paths on large synthetic archives.
+
+For every archive (gz and xz compressed, see :func:`fake_github.make_archive`), the following extraction paths are
+timed, each into a fresh directory:
+
+- `tar`: the `tar -xf` command, which aptator used to run through sudo;
+- `sequential`: `tarfile.extractall` with the rename/data filter (`extract_archive(..., workers=1)`);
+- `parallel-N`: the parallel extraction engine with N writer threads (see
+  :class:`aptator.actions.extract.ParallelExtractor`).
+
+The extracted trees of all paths are compared with each other (names, sizes and permissions).
+
+Usage:
+    python benchmarks/bench_extract.py [--files 20000] [--file-size 2048] [--workers 4 8 16] [--fsync] [--json FILE]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fake_github import make_archive
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from aptator.actions.extract import extract_archive  # noqa: E402
+
+
+def tree(directory: Path) -> dict:
+    """Return the (size, mode) of every file below `directory`, keyed by the relative path."""
+    return {
+        str(path.relative_to(directory)): (path.lstat().st_size if path.is_file() else 0, path.lstat().st_mode)
+        for path in directory.rglob("*")
+    }
+
+
+def extract_with_tar(archive: Path, extract_to: Path, fsync: bool) -> None:
+    extract_to.mkdir()
+    tar = shutil.which("tar")
+    subprocess.run([tar, "-xf", str(archive), "-C", str(extract_to), "--strip-components=1"], check=True)
+    if fsync:
+        os.sync()
+
+
+def extract_in_process(workers: int):
+    def extract(archive: Path, extract_to: Path, fsync: bool) -> None:
+        with archive.open("rb") as f:
+            extract_archive(f, extract_to, workers=workers, fsync=fsync)
+
+    return extract
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20000, metavar="N", help="number of files per archive")
+    parser.add_argument("--file-size", type=int, default=2048, metavar="BYTES", help="size of the archived files")
+    parser.add_argument("--workers", type=int, nargs="+", default=[4, 8, 16], metavar="N")
+    parser.add_argument("--fsync", action="store_true", help="flush the extracted files to disk")
+    parser.add_argument("--json", metavar="FILE", help="write the results as JSON to FILE")
+    args = parser.parse_args()
+
+    paths = {"tar": extract_with_tar, "sequential": extract_in_process(1)}
+    paths.update({f"parallel-{workers}": extract_in_process(workers) for workers in args.workers})
+
+    print(f"{'archive':>8} {'path':>12} {'wall_s':>8} {'files/s':>9}")
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="aptator-bench-") as tmp:
+        directory = Path(tmp)
+        for compression in ("gz", "xz"):
+            archive = make_archive(directory / f"app.tar.{compression}", args.files, args.file_size, compression)
+            reference = None
+            for name, extract in paths.items():
+                extract_to = directory / f"{compression}-{name}"
+                started = time.perf_counter()
+                extract(archive, extract_to, args.fsync)
+                wall = time.perf_counter() - started
+                results.setdefault(compression, {})[name] = {"wall_s": wall, "files_per_s": args.files / wall}
+                print(f"{compression:>8} {name:>12} {wall:8.2f} {args.files / wall:9.0f}")
+
+                extracted = tree(extract_to)
+                if reference is None:
+                    reference = extracted
+                elif extracted != reference:
+                    sys.exit(f"The tree extracted by {name} differs from the one extracted by tar.")
+                shutil.rmtree(extract_to)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
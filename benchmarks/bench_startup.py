@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Startup time budget of the aptator CLI.
+
+Every command is run several times in a fresh environment without a configuration file (unless one is passed with
+`--config`). The runs of all commands are interleaved, and every run of a command is compared with the runs of the same
+round of
+
+- the bare interpreter (`over_ms`),
+- a script that imports the standard library modules every CLI run needs: argparse (with the modules it loads to
+  format help), pathlib and tomllib (`own_ms`).
+
+Both are the median of these per-round differences, which cancels out most of the load of the machine. The best wall
+time and the modules with the highest cumulative import time (`python -X importtime`) are listed for every command.
+
+The script exits with status 1 if the `own_ms` of a command exceeds the budget: the cost of the standard library
+modules varies with the speed and load of the machine by more than the budget, whereas an import of a heavy module
+(e.g., `urllib.request` and `ssl`) into the startup path exceeds it anyway. Commands over the budget are measured again
+(up to `--attempts` times) before they are reported.
+
+- `import`: `import aptator`, which must not require a configuration file;
+- `help`: `aptator --help`;
+- `noop`: a run with a configuration that does not contain any package.
+
+The CLI is started like the `aptator` console script (i.e. without the `runpy` machinery of `python -m`).
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 20] [--attempts 3] [--budget-ms 15] [--json FILE]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# what the generated `aptator` console script does
+CLI = "import sys; from aptator.cli import main; sys.argv[0] = 'aptator'; sys.exit(main())"
+# the standard library modules imported by every CLI run (argparse loads shutil and locale to format help)
+STDLIB = "import argparse, locale, pathlib, shutil, tomllib"
+COMMANDS = {
+    "import": ["-c", "import aptator"],
+    "help": ["-c", CLI, "--help"],
+    "noop": ["-c", CLI, "--no-cache", "--config", "{config}"],
+}
+
+
+def _env(directory: Path) -> dict:
+    env = dict(
+        os.environ,
+        HOME=str(directory / "home"),
+        XDG_CONFIG_HOME=str(directory / "config"),
+        XDG_CACHE_HOME=str(directory / "cache"),
+        PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT / "src"), os.environ.get("PYTHONPATH")])),
+    )
+    env.pop("GITHUB_TOKEN", None)
+    return env
+
+
+def wall_times(cmds: dict[str, list[str]], env: dict, runs: int) -> dict[str, list[float]]:
+    """Return the wall times in seconds of `runs` executions of every command (the runs of the commands alternate)."""
+    times = {name: [] for name in cmds}
+    for _ in range(runs):
+        for name, cmd in cmds.items():
+            started = time.perf_counter()
+            subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            times[name].append(time.perf_counter() - started)
+    return times
+
+
+def paired_ms(times: list[float], reference: list[float]) -> float:
+    """Return the median difference in milliseconds between the runs of a command and the same rounds of a reference."""
+    return statistics.median(t - r for t, r in zip(times, reference, strict=True)) * 1000
+
+
+def imported_modules(cmd: list[str], env: dict) -> list[tuple[str, int, int]]:
+    """Return the (module, nesting level, cumulative import time in microseconds) of every import of `cmd`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", *cmd[1:]], env=env, capture_output=True, text=True, check=True
+    )
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        # nested imports are indented by two spaces per level
+        modules.append((name.strip(), (len(name) - len(name.lstrip()) - 1) // 2, int(cumulative)))
+    return modules
+
+
+def slowest_imports(modules, baseline: set[str], count: int = 5) -> list[tuple[str, int]]:
+    """Return the slowest imports of the first two nesting levels that are not part of the interpreter startup."""
+    imports = [(name, cumulative) for name, level, cumulative in modules if level <= 1 and name not in baseline]
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20, metavar="N", help="runs per command (the best one counts)")
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=15,
+        metavar="MS",
+        help="maximum startup time of every command on top of the standard library modules it needs (default: 15)",
+    )
+    parser.add_argument(
+        "--attempts", type=int, default=3, metavar="N", help="measurements of commands over the budget (default: 3)"
+    )
+    parser.add_argument("--json", metavar="FILE", help="write the results as JSON to FILE")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="aptator-bench-") as tmp:
+        directory = Path(tmp)
+        config = directory / "empty.toml"
+        config.write_text("packages = []\n")
+        env = _env(directory)
+
+        cmds = {"python": [sys.executable, "-c", "pass"], "stdlib": [sys.executable, "-c", STDLIB]}
+        for name, cmd_args in COMMANDS.items():
+            cmds[name] = [sys.executable, *(arg.format(config=config) for arg in cmd_args)]
+        times = wall_times(cmds, env, args.runs)
+        own = {name: paired_ms(times[name], times["stdlib"]) for name in cmds}
+        for _ in range(args.attempts - 1):
+            slow = [name for name in COMMANDS if own[name] > args.budget_ms]
+            if not slow:
+                break
+            again = wall_times({name: cmds[name] for name in ["stdlib", *slow]}, env, args.runs)
+            own.update({name: min(own[name], paired_ms(again[name], again["stdlib"])) for name in slow})
+
+        baseline = {name for name, _, _ in imported_modules(cmds["python"], env)}
+        print(f"{'command':>8} {'wall_ms':>8} {'over_ms':>8} {'own_ms':>8}  slowest imports (cumulative ms)")
+        results = {}
+        exceeded = []
+        for name, cmd in cmds.items():
+            wall = min(times[name]) * 1000
+            over = paired_ms(times[name], times["python"])
+            imports = slowest_imports(imported_modules(cmd, env), baseline) if name in COMMANDS else []
+            results[name] = {"wall_ms": wall, "over_ms": over, "own_ms": own[name], "imports": dict(imports)}
+            if name in COMMANDS and own[name] > args.budget_ms:
+                exceeded.append(name)
+            slowest = ", ".join(f"{module} {us / 1000:.1f}" for module, us in imports)
+            print(f"{name:>8} {wall:8.1f} {over:8.1f} {own[name]:8.1f}  {slowest}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2) + "\n")
+    if exceeded:
+        print(f"Startup budget of {args.budget_ms:g} ms exceeded by: {', '.join(exceeded)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
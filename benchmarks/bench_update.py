@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark of aptator runs against a local fake GitHub server.
+
+For every package count, aptator is run twice in a fresh environment (HOME, XDG directories and configuration):
+
+- `cold`: all packages are outdated, i.e. every asset is downloaded, verified and installed;
+- `warm`: all packages are up to date, i.e. only the (conditional) API lookups are performed.
+
+sudo is replaced by a stub that records its invocations, skips dpkg and runs the privileged helper without
+privileges. The wall time, the peak RSS, the bytes read and written (including all subprocesses) and the number of
+subprocess invocations of every run are reported.
+
+Usage:
+    python benchmarks/bench_update.py [--packages 1 50 500] [--deb-size BYTES] [--archive-files N] [--json FILE]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fake_github import FakeGitHub, Fixtures
+
+ROOT = Path(__file__).resolve().parent.parent
+SUDO_STUB = """#!/bin/sh
+echo "$*" >> "$BENCH_SUBPROCESS_LOG"
+case "$1" in
+  */dpkg) exit 0 ;;
+esac
+# the privileged helper runs in isolated mode (python -I), which would ignore the PYTHONPATH of the source tree
+if [ "$2" = "-I" ]; then
+  python="$1"
+  shift 2
+  exec "$python" "$@"
+fi
+exec "$@"
+"""
+
+
+def _proc_io() -> dict:
+    """Return the I/O counters of this process, which include the counters of its terminated subprocesses."""
+    try:
+        lines = Path("/proc/self/io").read_text().splitlines()
+    except OSError:
+        return {}
+    return {key: int(value) for key, value in (line.split(": ") for line in lines)}
+
+
+def child(stats_file: str, args: list[str]) -> None:
+    """Run aptator in this process and write its I/O counters to `stats_file`."""
+    from aptator.cli import main
+
+    sys.argv = ["aptator", *args]
+    try:
+        main()
+    finally:
+        Path(stats_file).write_text(json.dumps(_proc_io()))
+
+
+def write_config(directory: Path, fake: FakeGitHub) -> None:
+    lines = [
+        "[paths]",
+        f'sudo = "{directory / "sudo"}"',
+        "[github]",
+        f'api_url = "{fake.base_url}"',
+        "[download]",
+        f'mirror = "{fake.base_url}/download"',
+    ]
+    for pkg in fake.packages(directory / "opt"):
+        lines.append("[[packages]]")
+        for key, value in pkg.items():
+            lines.append(f"{key} = {json.dumps(value) if not isinstance(value, dict) else _inline_table(value)}")
+    config = directory / "config" / "aptator" / "aptator.toml"
+    config.parent.mkdir(parents=True)
+    config.write_text("\n".join(lines) + "\n")
+
+
+def _inline_table(table: dict) -> str:
+    return "{ " + ", ".join(f"{key} = {json.dumps(value)}" for key, value in table.items()) + " }"
+
+
+def run_aptator(directory: Path, args: list[str]) -> dict:
+    """Run aptator in a subprocess and measure it."""
+    env = dict(
+        os.environ,
+        HOME=str(directory / "home"),
+        XDG_CONFIG_HOME=str(directory / "config"),
+        XDG_CACHE_HOME=str(directory / "cache"),
+        PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT / "src"), os.environ.get("PYTHONPATH")])),
+        BENCH_SUBPROCESS_LOG=str(directory / "subprocesses.log"),
+    )
+    env.pop("GITHUB_TOKEN", None)
+    log = directory / "subprocesses.log"
+    log.unlink(missing_ok=True)
+    stats_file = directory / "io.json"
+    stats_file.unlink(missing_ok=True)
+
+    started = time.perf_counter()
+    with (directory / "output.log").open("a") as output:
+        proc = subprocess.Popen(
+            [sys.executable, __file__, "--child", str(stats_file), "--", *args], env=env, stdout=output, stderr=output
+        )
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - started
+
+    io_stats = json.loads(stats_file.read_text()) if stats_file.exists() else {}
+    invocations = log.read_text().splitlines() if log.exists() else []
+    return {
+        "exit_code": proc.returncode,
+        "wall_s": wall,
+        "cpu_s": rusage.ru_utime + rusage.ru_stime,
+        # ru_maxrss is reported in KiB on Linux
+        "peak_rss_mib": rusage.ru_maxrss / 1024,
+        "bytes_read": io_stats.get("rchar"),
+        "bytes_written": io_stats.get("wchar"),
+        "disk_bytes_written": io_stats.get("write_bytes"),
+        "subprocesses": len(invocations),
+        "dpkg_calls": sum(1 for line in invocations if line.split(" ", 1)[0].endswith("dpkg")),
+    }
+
+
+def benchmark(count: int, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="aptator-bench-") as tmp:
+        directory = Path(tmp)
+        fixtures = Fixtures(directory / "fixtures", args.deb_size, args.archive_files, args.archive_file_size)
+        fake = FakeGitHub(fixtures, count)
+        server = fake.start()
+        try:
+            (directory / "sudo").write_text(SUDO_STUB)
+            (directory / "sudo").chmod(0o755)
+            (directory / "opt").mkdir()
+            write_config(directory, fake)
+
+            results = {}
+            for phase in ("cold", "warm"):
+                requests = fake.requests
+                results[phase] = run_aptator(directory, args.aptator_args)
+                results[phase]["http_requests"] = fake.requests - requests
+                if results[phase]["exit_code"]:
+                    print((directory / "output.log").read_text()[-4000:], file=sys.stderr)
+            return results
+        finally:
+            server.shutdown()
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[4:])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--packages", type=int, nargs="+", default=[1, 50, 500], metavar="N")
+    parser.add_argument("--deb-size", type=int, default=256 * 1024, metavar="BYTES", help="size of the .deb blobs")
+    parser.add_argument("--archive-files", type=int, default=200, metavar="N", help="number of files per archive")
+    parser.add_argument("--archive-file-size", type=int, default=4096, metavar="BYTES", help="size of archived files")
+    parser.add_argument("--json", metavar="FILE", help="write the results as JSON to FILE")
+    parser.add_argument(
+        "aptator_args", nargs="*", metavar="-- ARGS", help="additional arguments for aptator (e.g., -- --jobs 16)"
+    )
+    args = parser.parse_args()
+
+    columns = [
+        ("packages", 8, "{}"),
+        ("run", 4, "{}"),
+        ("wall_s", 8, "{:.2f}"),
+        ("cpu_s", 7, "{:.2f}"),
+        ("peak_rss_mib", 12, "{:.1f}"),
+        ("bytes_read", 12, "{}"),
+        ("bytes_written", 13, "{}"),
+        ("subprocesses", 12, "{}"),
+        ("dpkg_calls", 10, "{}"),
+        ("http_requests", 13, "{}"),
+    ]
+    print(" ".join(name.rjust(width) for name, width, _ in columns))
+    results = {}
+    for count in args.packages:
+        results[count] = benchmark(count, args)
+        for phase, result in results[count].items():
+            row = {"packages": count, "run": phase, **result}
+            print(" ".join(fmt.format(row[name]).rjust(width) for name, width, fmt in columns))
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""A local HTTP server that emulates the GitHub endpoints used by aptator, and synthetic release assets.
+
+The server implements the endpoints of :mod:`aptator.source.github`:
+
+- `/repos/<owner>/<repo>/releases/latest` and `/repos/<owner>/<repo>/releases` (paginated),
+- `/repos/<owner>/<repo>/tags`,
+- `/graphql`: the batched lookups of :mod:`aptator.source.graphql` (only with an `Authorization` header),
+- `/assets/<repo>/<filename>`: the release assets,
+- `/download/api.github.com/repos/<owner>/<repo>/tarball/refs/tags/<tag>`: the tag tarballs. As on GitHub, tags refer
+  to tarballs on api.github.com, which are downloaded through the `[download] mirror` set to `<base_url>/download`.
+
+API responses carry an ETag and answer conditional requests with `304 Not Modified`. Every package gets its own
+.deb-like blob (a shared random blob followed by the package name, so that digests differ without generating a blob
+per package); archives are shared but downloaded from package-specific URLs.
+"""
+
+import hashlib
+import io
+import json
+import random
+import re
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+OWNER = "bench"
+VERSION = "1.0.0"
+CHUNK_SIZE = 256 * 1024
+
+
+def random_bytes(rng: random.Random, size: int) -> bytes:
+    """Return partially compressible pseudo-random data (random bytes interleaved with runs of zeros)."""
+    data = bytearray()
+    while len(data) < size:
+        data += rng.randbytes(min(512, size - len(data)))
+        data += bytes(min(512, max(0, size - len(data))))
+    return bytes(data)
+
+
+def make_deb(path: Path, size: int, seed: int = 0) -> Path:
+    """Write a .deb-like blob of `size` bytes (an `ar` header followed by pseudo-random data)."""
+    header = b"!<arch>\ndebian-binary   0           0     0     100644  4         `\n2.0\n"
+    rng = random.Random(seed)  # noqa: S311 (reproducible fixtures, not used for cryptography)
+    path.write_bytes(header + random_bytes(rng, max(0, size - len(header))))
+    return path
+
+
+def make_archive(path: Path, files: int, file_size: int, compression: str = "gz", seed: int = 0) -> Path:
+    """Write a tar archive with a root directory `app/` that contains `files` files in subdirectories of 100 files.
+
+    Args:
+        path: The archive to write.
+        files: Number of regular files.
+        file_size: Size of every file in bytes.
+        compression: "gz", "xz", "bz2" or "" (uncompressed).
+        seed: Seed of the pseudo-random file contents.
+    """
+    rng = random.Random(seed)  # noqa: S311 (reproducible fixtures, not used for cryptography)
+    with tarfile.open(path, f"w:{compression}" if compression else "w") as tar:
+        directories = set()
+        for i in range(files):
+            directory = f"app/dir{i // 100:04d}"
+            if directory not in directories:
+                directories.add(directory)
+                info = tarfile.TarInfo(directory)
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+            data = random_bytes(rng, file_size)
+            info = tarfile.TarInfo(f"{directory}/file{i:06d}.bin")
+            info.size = len(data)
+            info.mode = 0o755 if i % 10 == 0 else 0o644
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+class Fixtures:
+    """The synthetic assets shared by all packages.
+
+    Args:
+        directory: Directory in which the assets are created.
+        deb_size: Size of the .deb blobs in bytes.
+        archive_files: Number of files in the archives.
+        archive_file_size: Size of the files in the archives in bytes.
+    """
+
+    def __init__(self, directory: Path, deb_size=256 * 1024, archive_files=200, archive_file_size=4096):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.deb = make_deb(directory / "blob.deb", deb_size)
+        self.archives = {
+            compression: make_archive(
+                directory / f"app.tar.{compression}", archive_files, archive_file_size, compression
+            )
+            for compression in ("gz", "xz")
+        }
+        self.deb_hash = hashlib.sha256(self.deb.read_bytes())
+
+    @staticmethod
+    def deb_suffix(repo: str) -> bytes:
+        return f"\n{repo}\n".encode()
+
+    def deb_digest(self, repo: str) -> str:
+        """Return the digest of the blob of `repo` (the shared blob followed by the name of the repository)."""
+        digest = self.deb_hash.copy()
+        digest.update(self.deb_suffix(repo))
+        return f"sha256:{digest.hexdigest()}"
+
+
+class FakeGitHub:
+    """Releases, tags and assets of `count` synthetic packages.
+
+    Packages cycle through the kinds `deb` (.deb assets installed with dpkg, 60%), `gz` and `xz` (extract-and-link
+    actions, 20% each); every fifth archive package is resolved from its latest tag.
+    """
+
+    def __init__(self, fixtures: Fixtures, count: int):
+        self.fixtures = fixtures
+        self.count = count
+        self.base_url = None
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def kind(i: int) -> str:
+        return ("deb", "deb", "deb", "gz", "xz")[i % 5]
+
+    def repo(self, i: int) -> str:
+        return f"pkg{i:04d}"
+
+    def packages(self, opt_dir: Path) -> list[dict]:
+        """Return the package configurations for aptator."""
+        packages = []
+        for i in range(self.count):
+            repo, kind = self.repo(i), self.kind(i)
+            pkg = {"name": repo, "repo": f"{OWNER}/{repo}"}
+            if kind == "deb":
+                pkg.update(asset_pattern=r"_amd64\.deb$", asset_version_pattern="_(.*)_amd64")
+                pkg["action"] = {"type": "deb-install"}
+            else:
+                pkg.update(asset_pattern=rf"\.tar\.{kind}$", asset_version_pattern=rf"-(.*)\.tar\.{kind}$")
+                if i % 25 in (3, 4):
+                    # resolved from the latest tag (e.g., "v1.0.0") instead of a release
+                    pkg.update(use_tag=True, asset_version_pattern="v(.*)")
+                pkg["action"] = {"type": "extract-and-link", "extract_to": str(opt_dir), "link_to": str(opt_dir / repo)}
+            packages.append(pkg)
+        return packages
+
+    def release(self, repo: str) -> dict | None:
+        i = int(repo.removeprefix("pkg"))
+        kind = self.kind(i)
+        if kind == "deb":
+            name = f"{repo}_{VERSION}_amd64.deb"
+            digest = self.fixtures.deb_digest(repo)
+        else:
+            name = f"{repo}-{VERSION}.tar.{kind}"
+            digest = None
+        asset = {"name": name, "browser_download_url": f"{self.base_url}/assets/{repo}/{name}", "digest": digest}
+        return {
+            "tag_name": f"v{VERSION}",
+            "name": f"v{VERSION}",
+            "prerelease": False,
+            "draft": False,
+            "assets": [asset],
+        }
+
+    def tag_list(self, repo: str) -> list[tuple[str, int]]:
+        """Return the (name, commit date) of the tags of `repo`.
+
+        The latest tag by name is not the latest by date (a fix of an older version tagged after the latest release).
+        """
+        return [(f"v{VERSION}", 2), ("v0.9.1", 3)]
+
+    def tags(self, repo: str) -> list[dict]:
+        """Return the tags of `repo` as listed by the REST API, i.e. sorted by name in descending order."""
+        return [
+            {"name": name, "tarball_url": f"https://api.github.com/repos/{OWNER}/{repo}/tarball/refs/tags/{name}"}
+            for name, _ in sorted(self.tag_list(repo), reverse=True)
+        ]
+
+    def exists(self, owner: str, repo: str) -> bool:
+        match = re.fullmatch(r"pkg(\d+)", repo)
+        return owner == OWNER and match is not None and int(match.group(1)) < self.count
+
+    @staticmethod
+    def release_node(release: dict) -> dict:
+        """Convert a release of the REST API to a GraphQL `Release`."""
+        return {
+            "tagName": release["tag_name"],
+            "name": release["name"],
+            "isPrerelease": release["prerelease"],
+            "isDraft": release["draft"],
+            "releaseAssets": {
+                "nodes": [
+                    {"name": asset["name"], "downloadUrl": asset["browser_download_url"], "digest": asset["digest"]}
+                    for asset in release["assets"]
+                ]
+            },
+        }
+
+    def graphql(self, document: dict) -> dict:
+        """Answer a query of :mod:`aptator.source.graphql` with the data of the REST endpoints.
+
+        Only the `repository` fields of the queries built by aptator (one per line) are understood.
+        """
+        variables = document.get("variables", {})
+        data = {}
+        for line in document["query"].splitlines():
+            match = re.match(r"(r\d+): repository\(owner: \$(o\d+), name: \$(n\d+)\) \{ (\w+)", line)
+            if not match:
+                continue
+            alias, owner, repo, field = match.group(1), variables[match.group(2)], variables[match.group(3)], match[4]
+            if not self.exists(owner, repo):
+                data[alias] = None
+            elif field == "latestRelease":
+                data[alias] = {field: self.release_node(self.release(repo))}
+            elif field == "releases":
+                data[alias] = {field: {"nodes": [self.release_node(self.release(repo))]}}
+            else:
+                first = int(re.search(r"first: (\d+)", line).group(1))
+                order, direction = re.search(r"orderBy: \{field: (\w+), direction: (\w+)\}", line).groups()
+                key = (lambda tag: tag[1]) if order == "TAG_COMMIT_DATE" else (lambda tag: tag[0])
+                tags = sorted(self.tag_list(repo), key=key, reverse=direction == "DESC")
+                data[alias] = {field: {"nodes": [{"name": name} for name, _ in tags[:first]]}}
+        return {"data": data}
+
+    def asset(self, repo: str, name: str) -> tuple[Path, bytes] | None:
+        """Return the file and the suffix of an asset."""
+        if name.endswith(".deb"):
+            return self.fixtures.deb, self.fixtures.deb_suffix(repo)
+        match = re.search(r"\.tar\.(\w+)$", name)
+        if match and match.group(1) in self.fixtures.archives:
+            return self.fixtures.archives[match.group(1)], b""
+        return None
+
+    def handler(self):
+        return type("Handler", (FakeGitHubHandler,), {"fake": self})
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+        """Start the server in a background thread; `base_url` is set to its URL."""
+        server = ThreadingHTTPServer((host, port), self.handler())
+        server.daemon_threads = True
+        self.base_url = f"http://{host}:{server.server_address[1]}"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    """Serve the endpoints of a :class:`FakeGitHub` (set as the class attribute `fake`)."""
+
+    protocol_version = "HTTP/1.1"
+    fake = None
+    # (path pattern, method) of the GET endpoints; the groups of the pattern are passed to the method
+    routes = (
+        (rf"/repos/{OWNER}/(pkg\d+)/releases/latest", "get_latest_release"),
+        (rf"/repos/{OWNER}/(pkg\d+)/releases", "get_releases"),
+        (rf"/repos/{OWNER}/(pkg\d+)/tags", "get_tags"),
+        (r"/assets/(pkg\d+)/([^/]+)", "get_asset"),
+        (rf"/download/api\.github\.com/repos/{OWNER}/(pkg\d+)/tarball/refs/tags/([^/]+)", "get_tarball"),
+    )
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        with self.fake._lock:
+            self.fake.requests += 1
+        parts = urlsplit(self.path)
+        self.query = parse_qs(parts.query)
+        self.head = head
+        for pattern, method in self.routes:
+            match = re.fullmatch(pattern, parts.path)
+            if match:
+                getattr(self, method)(*match.groups())
+                return
+        self.send_error(404)
+
+    def do_POST(self):
+        with self.fake._lock:
+            self.fake.requests += 1
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.head = False
+        if urlsplit(self.path).path != "/graphql":
+            self.send_error(404)
+        elif not self.headers.get("Authorization"):
+            # as on GitHub, the GraphQL API requires authentication
+            self.send_error(401)
+        else:
+            self.send_json(self.fake.graphql(json.loads(body)))
+
+    def page(self) -> int:
+        return int(self.query.get("page", ["1"])[0])
+
+    def get_latest_release(self, repo):
+        self.send_json(self.fake.release(repo))
+
+    def get_releases(self, repo):
+        self.send_json([self.fake.release(repo)] if self.page() == 1 else [])
+
+    def get_tags(self, repo):
+        self.send_json(self.fake.tags(repo) if self.page() == 1 else [])
+
+    def get_asset(self, repo, name):
+        asset = self.fake.asset(repo, name)
+        if asset:
+            self.send_asset(*asset)
+        else:
+            self.send_error(404)
+
+    def get_tarball(self, repo, tag):
+        kind = self.fake.kind(int(repo.removeprefix("pkg")))
+        if tag in dict(self.fake.tag_list(repo)) and kind in self.fake.fixtures.archives:
+            self.send_asset(self.fake.fixtures.archives[kind], b"")
+        else:
+            self.send_error(404)
+
+    def send_json(self, document):
+        body = json.dumps(document).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not self.head:
+            self.wfile.write(body)
+
+    def send_asset(self, path: Path, suffix: bytes):
+        size = path.stat().st_size + len(suffix)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("ETag", f'"{path.name}-{hashlib.sha256(suffix).hexdigest()[:8]}"')
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        if self.head:
+            return
+        with path.open("rb") as f:
+            self.wfile.flush()
+            self.connection.sendfile(f)
+        self.wfile.write(suffix)
@@ -1,14 +1,28 @@
-import tomllib
 from os import getenv
 from pathlib import Path
 
 LOCAL_CONFIG_PATH = Path(getenv("XDG_CONFIG_HOME", Path.home() / ".config")) / "aptator" / "aptator.toml"
 GLOBAL_CONFIG_PATH = Path("/etc/aptator/aptator.toml")
+# downloads, staged updates and the responses of the mirror are stored below this directory
+CACHE_HOME = Path(getenv("XDG_CACHE_HOME", Path.home() / ".cache")) / "aptator"
 
-if not (GLOBAL_CONFIG_PATH.exists() or LOCAL_CONFIG_PATH.exists()):
-    raise FileNotFoundError("No configuration file found for aptator.")
 
-CONFIG_PATH = LOCAL_CONFIG_PATH if LOCAL_CONFIG_PATH.exists() else GLOBAL_CONFIG_PATH
+def default_config_path() -> Path:
+    """Return the configuration file of the user if it exists, otherwise the global one."""
+    return LOCAL_CONFIG_PATH if LOCAL_CONFIG_PATH.exists() else GLOBAL_CONFIG_PATH
+
+
+def write_atomic(path, text: str) -> None:
+    """Write a file by renaming a temporary file, so that readers (e.g., collectors of reports) never see a partial one.
+
+    The temporary file is hidden and specific to the writing thread, so that concurrent writers do not clash.
+    """
+    import threading
+
+    path = Path(path)
+    temp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+    temp.write_text(text)
+    temp.replace(path)
 
 
 class ConfigSection:
@@ -21,17 +35,42 @@ class ConfigSection:
 
 
 class AptatorConfigMeta(type):
-    """Metaclass for dynamic configuration management."""
+    """Metaclass for dynamic configuration management.
+
+    The configuration file is only read when the first section is accessed, and a missing configuration is only
+    reported then, so that the privileged helper (which runs as root without a configuration of its own) and commands
+    such as `--help` do not depend on it.
+    """
 
+    _path = None
     _sections = None
 
+    @property
+    def path(cls) -> Path:
+        """The configuration file (see :func:`default_config_path`, unless overridden with `use`)."""
+        return cls._path or default_config_path()
+
+    def use(cls, path) -> None:
+        """Read the configuration from `path` instead of the default location (e.g., `--config PATH`)."""
+        cls._path = Path(path)
+        cls._sections = None
+
     def __getattr__(cls, name):
-        """Dynamically access config sections and parameters."""
+        """Dynamically access config sections and parameters.
+
+        Tables are returned as :class:`ConfigSection`, other values (e.g., the list of `packages`) as they are.
+        """
         if cls._sections is None:
-            with CONFIG_PATH.open("rb") as f:
+            import tomllib
+
+            path = cls.path
+            if not path.exists():
+                raise FileNotFoundError(f"No configuration file found for aptator: {path}")
+            with path.open("rb") as f:
                 config_dict = tomllib.load(f)
                 cls._sections = {
-                    section_name: ConfigSection(section_data) for section_name, section_data in config_dict.items()
+                    section_name: ConfigSection(section_data) if isinstance(section_data, dict) else section_data
+                    for section_name, section_data in config_dict.items()
                 }
 
         return cls._sections.get(name)
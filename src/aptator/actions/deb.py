@@ -1,9 +1,45 @@
+import subprocess
+import sys
+
 from aptator import AptatorConfig
 from aptator.tools import run
 
-SUDO = AptatorConfig.paths.sudo
+DPKG = "/usr/bin/dpkg"
 
 
 def install_deb(path):
     """Install a .deb package using dpkg."""
-    run([SUDO, "/usr/bin/dpkg", "-i", path])
+    run([AptatorConfig.paths.sudo, DPKG, "-i", path])
+
+
+def install_debs(paths):
+    """Install several .deb packages in a single dpkg transaction.
+
+    dpkg reads its database and runs triggers (e.g., man-db, desktop database and icon caches) only once per
+    invocation. If the batch fails, the packages are installed one by one to isolate the failing package(s).
+
+    Args:
+        paths: Paths of the .deb packages to install.
+
+    Returns:
+        list: The paths of the packages that have been installed successfully.
+    """
+    if not paths:
+        return []
+
+    try:
+        run([AptatorConfig.paths.sudo, DPKG, "-i", *paths])
+    except subprocess.CalledProcessError:
+        print("  batch installation failed, installing packages one by one...", file=sys.stderr)
+    else:
+        return list(paths)
+
+    installed = []
+    for path in paths:
+        try:
+            install_deb(path)
+        except subprocess.CalledProcessError as e:
+            print(f"  installation of {path} failed: {e}", file=sys.stderr)
+        else:
+            installed.append(path)
+    return installed
@@ -1,52 +1,56 @@
-import os
-import tarfile
-import tempfile
 from pathlib import Path
-from urllib.request import urlopen
+from urllib.parse import urlparse
 
-from aptator import AptatorConfig
-from aptator.actions.tar_extraction_filter import rename
-from aptator.tools import run
+from aptator.actions.extract import linked_directory
+from aptator.cache import DownloadCache
+from aptator.download import mirror_url
+from aptator.httpclient import urlopen
+from aptator.privileged import FsPlan
 
-SUDO = AptatorConfig.paths.sudo
 
+def download_archive(url):
+    """Download an archive (or reuse it from the download cache).
 
-def download_extract_and_link(url, extract_to, link_to):
+    Returns:
+        Path: The downloaded archive.
+    """
+    return DownloadCache().fetch(url, Path(urlparse(url).path).name or "archive")
+
+
+def extract_archive_and_link(archive_path, extract_to, link_to, incremental=False):
+    """Extract a downloaded archive and create a symlink.
+
+    Args:
+        archive_path: Path of the archive.
+        extract_to: Path to which the archive should be extracted (e.g., /opt/Zotero-8.0.2).
+        link_to: Symlink path (e.g., /opt/zotero -> /opt/Zotero-8.0.2).
+        incremental: Hardlink files that did not change from the version link_to currently points to.
+
+    Raises:
+        subprocess.CalledProcessError: If the file is not a supported tar archive or linking fails.
+    """
+    previous = linked_directory(link_to) if incremental else None
+    FsPlan().extract(extract_to, archive=archive_path, previous=previous).symlink(extract_to, link_to).execute()
+
+
+def download_extract_and_link(url, extract_to, link_to, stream=False, incremental=False):
     """Download an archive, extract it, and create a symlink.
 
     Args:
         url: The URL of the archive to download.
         extract_to: Path to which the archive should be extracted (e.g., /opt/Zotero-8.0.2).
         link_to: Symlink path (e.g., /opt/zotero -> /opt/Zotero-8.0.2).
+        stream: Extract the archive directly from the HTTP response instead of downloading it to the download cache
+            first, i.e. in a single pass without writing the archive to disk.
+        incremental: Hardlink files that did not change from the version link_to currently points to.
 
     Raises:
-        ValueError: If the content type is unsupported.
+        subprocess.CalledProcessError: If the file is not a supported tar archive or linking fails.
     """
-    uid = os.getuid()
-    gid = os.getgid()
-    extract_to = Path(extract_to)
-    link_to = Path(link_to)
-
-    run([SUDO, AptatorConfig.paths.mkdir, "-p", extract_to])
-    run([SUDO, AptatorConfig.paths.chown, "-R", f"{uid}:{gid}", extract_to])
-
-    # Download the file to a temporary file
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        with urlopen(url) as response:
-            content_type = response.headers.get("Content-Type", "")
-            temp_file.write(response.read())
-        temp_file_path = Path(temp_file.name)
-
-    if "tar" in content_type.lower():
-        with tarfile.open(temp_file_path) as tar:
-            tar_filter = rename(str(extract_to.name))
-            tar.extractall(path=str(extract_to.parent), filter=tar_filter)
-    else:
-        raise ValueError(f"Unsupported content type: {content_type}")
-
-    # Remove existing symlink if it exists
-    run([SUDO, AptatorConfig.paths.chown, "-R", "root:root", extract_to])
-    run([SUDO, AptatorConfig.paths.ln, "-sfn", extract_to, link_to])
-
-    # Clean up temporary file
-    temp_file_path.unlink()
+    if not stream:
+        extract_archive_and_link(download_archive(url), extract_to, link_to, incremental)
+        return
+
+    previous = linked_directory(link_to) if incremental else None
+    with urlopen(mirror_url(url)) as response:
+        FsPlan().extract(extract_to, previous=previous).symlink(extract_to, link_to).execute(stdin=response)
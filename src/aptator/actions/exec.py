@@ -1,5 +1,7 @@
 import subprocess
 
+from aptator.report import timed
+
 
 def exec_command(command):
     """Execute a shell command.
@@ -7,6 +9,7 @@ def exec_command(command):
     Raises:
         subprocess.CalledProcessError: If the command exits with a non-zero status code.
     """
-    result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
+    with timed("subprocess", command=command):
+        result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
     if result.returncode != 0:
         raise subprocess.CalledProcessError(result.returncode, command, result.stdout, result.stderr)
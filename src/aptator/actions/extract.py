@@ -0,0 +1,317 @@
+"""Single-pass extraction of (possibly streamed) tar archives.
+
+The archive is decompressed and read sequentially, while small regular files are written by a pool of threads (see
+:class:`ParallelExtractor`). This overlaps the open/write/chmod/utime system calls of archives with many small files
+with the decompression of the following members.
+"""
+
+import io
+import os
+import shutil
+import stat
+import subprocess
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
+
+from aptator.actions.tar_extraction_filter import rename
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+CHUNK_SIZE = 256 * 1024
+# number of threads writing extracted files (1 extracts sequentially with `tarfile.extractall`)
+EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
+# larger files are written by the reading thread instead of being buffered in memory for the writer threads
+MAX_BUFFERED_FILE_SIZE = 1024 * 1024
+
+
+@contextmanager
+def open_tar_stream(fileobj):
+    """Open a tar archive for sequential reading (`r|*`) from a file object such as an HTTP response.
+
+    gzip, bzip2 and xz compression are detected by `tarfile`. zstd-compressed archives are decompressed natively if
+    `tarfile` supports them (Python 3.14+) and with the `zstd` command otherwise.
+
+    Raises:
+        ValueError: If the archive is zstd-compressed and no zstd decompressor is available.
+    """
+    if not hasattr(fileobj, "peek"):
+        fileobj = io.BufferedReader(fileobj)
+
+    if fileobj.peek(len(ZSTD_MAGIC))[: len(ZSTD_MAGIC)] != ZSTD_MAGIC or "zst" in tarfile.TarFile.OPEN_METH:
+        with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+            yield tar
+        return
+
+    zstd = shutil.which("zstd")
+    if not zstd:
+        raise ValueError("zstd-compressed archives require Python 3.14+ or the zstd command.")
+    with subprocess.Popen([zstd, "-dc"], stdin=subprocess.PIPE, stdout=subprocess.PIPE) as proc:
+
+        def feed():
+            try:
+                shutil.copyfileobj(fileobj, proc.stdin)
+            except BrokenPipeError:
+                pass
+            finally:
+                proc.stdin.close()
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        try:
+            with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+                yield tar
+        finally:
+            proc.stdout.close()
+            feeder.join()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, [zstd, "-dc"])
+
+
+def linked_directory(link_to):
+    """Return the directory that the symlink `link_to` currently points to, or None."""
+    link_to = Path(link_to)
+    if not link_to.is_symlink():
+        return None
+    target = link_to.resolve()
+    return target if target.is_dir() else None
+
+
+class IncrementalFilter:
+    """Extraction filter that hardlinks unchanged files from a previously extracted version of the archive.
+
+    Regular files whose counterpart in `previous` has the same size are compared with it while they are read from the
+    archive. Identical files (with identical permissions) are hardlinked from `previous`; changed files are written
+    by the filter itself, since the data of a streamed archive cannot be read twice. All other members are left to
+    `tarfile`.
+    """
+
+    def __init__(self, tar, base_filter, previous):
+        self.tar = tar
+        self.base_filter = base_filter
+        self.previous = Path(previous).resolve()
+        self.linked = 0
+        self.written = 0
+
+    def __call__(self, member, path):
+        tarinfo = self.base_filter(member, path)
+        if tarinfo is None or not tarinfo.isreg() or "/" not in tarinfo.name:
+            return tarinfo
+
+        # symlinks in `previous` must not make the filter link (or read) files outside of it
+        old = (self.previous / tarinfo.name.split("/", 1)[1]).resolve()
+        if not old.is_relative_to(self.previous):
+            return tarinfo
+        try:
+            old_stat = old.lstat()
+        except OSError:
+            return tarinfo
+        if not stat.S_ISREG(old_stat.st_mode) or old_stat.st_size != tarinfo.size:
+            return tarinfo
+
+        target = Path(path) / tarinfo.name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.unlink(missing_ok=True)
+        self._link_or_write(member, tarinfo, old, stat.S_IMODE(old_stat.st_mode), target)
+        return None
+
+    def _link_or_write(self, member, tarinfo, old, old_mode, target):
+        with self.tar.extractfile(member) as data, old.open("rb") as f_old:
+            identical = 0
+            chunk = data.read(CHUNK_SIZE)
+            while chunk and f_old.read(len(chunk)) == chunk:
+                identical += len(chunk)
+                chunk = data.read(CHUNK_SIZE)
+
+            if not chunk and old_mode == tarinfo.mode:
+                try:
+                    os.link(old, target)
+                except OSError:
+                    pass  # e.g., `previous` is located on another filesystem
+                else:
+                    self.linked += 1
+                    return
+
+            # copy the identical prefix from the old file and write the remaining data from the archive
+            f_old.seek(0)
+            with target.open("wb") as f:
+                while identical:
+                    block = f_old.read(min(identical, CHUNK_SIZE))
+                    f.write(block)
+                    identical -= len(block)
+                f.write(chunk)
+                shutil.copyfileobj(data, f, CHUNK_SIZE)
+
+        target.chmod(tarinfo.mode)
+        os.utime(target, (tarinfo.mtime, tarinfo.mtime))
+        self.written += 1
+
+
+class ParallelExtractor:
+    """Extract the members of a sequentially read tar archive with a pool of writer threads.
+
+    Members are filtered in archive order by the reading thread, i.e. the `tar_filter` sees the same filesystem state
+    as with `tarfile.extractall`. Regular files of up to `MAX_BUFFERED_FILE_SIZE` bytes are read into memory and
+    handed to the writer threads in batches of up to `BATCH_SIZE` bytes, which write them (including their
+    permissions, modification time and an optional fsync); at most `2 * workers` batches are buffered at a time.
+    Directories are created by the reading thread and their attributes are set at the end, as by
+    `tarfile.extractall`. Before any other member (symlinks, hardlinks, ...) is extracted, all pending writes are
+    completed, so that links are never created next to or before a file that is still being written.
+
+    Args:
+        tar: The tar archive, opened for sequential reading.
+        tar_filter: The extraction filter (e.g., :func:`aptator.actions.tar_extraction_filter.rename`).
+        workers: Number of writer threads.
+        fsync: Flush every extracted file to disk before the extraction is reported as complete.
+    """
+
+    BATCH_SIZE = 1024 * 1024
+    BATCH_FILES = 128
+
+    def __init__(self, tar, tar_filter, workers=EXTRACT_WORKERS, fsync=False):
+        self.tar = tar
+        self.tar_filter = tar_filter
+        self.workers = workers
+        self.fsync = fsync
+        self._batch = []
+        self._batch_size = 0
+        self._pending = {}
+        self._slots = threading.Semaphore(2 * workers)
+        self._directories = set()
+
+    def extractall(self, path):
+        path = Path(path)
+        directories = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="aptator-extract") as pool:
+            self._pool = pool
+            try:
+                for member in self.tar:
+                    tarinfo = self.tar_filter(member, str(path))
+                    if tarinfo is None:
+                        continue
+                    target = path / tarinfo.name.rstrip("/")
+                    if target in self._pending:
+                        # the archive contains the path more than once; the later member replaces the earlier one
+                        self._drain()
+                    if tarinfo.isdir():
+                        self._makedirs(target, tarinfo.mode)
+                        directories.append((tarinfo, target))
+                    elif tarinfo.isreg():
+                        self._makedirs(target.parent)
+                        self._extract_file(tarinfo, target)
+                    else:
+                        self._drain()
+                        # the member has already been filtered
+                        self.tar.extract(tarinfo, str(path), filter=lambda tarinfo, _: tarinfo)
+            finally:
+                self._drain()
+
+        # like `tarfile.extractall`, set the attributes of directories once their content has been extracted
+        for tarinfo, target in sorted(directories, key=lambda item: item[1], reverse=True):
+            self.tar.chown(tarinfo, target, numeric_owner=False)
+            self.tar.utime(tarinfo, target)
+            self.tar.chmod(tarinfo, target)
+
+    def _makedirs(self, directory, mode=None):
+        if directory in self._directories:
+            return
+        if not directory.is_dir():
+            directory.mkdir(0o700 if mode is not None else 0o777, parents=True)
+        self._directories.add(directory)
+
+    def _extract_file(self, tarinfo, target):
+        if tarinfo.size > MAX_BUFFERED_FILE_SIZE:
+            with self.tar.extractfile(tarinfo) as data, target.open("wb") as f:
+                shutil.copyfileobj(data, f, CHUNK_SIZE)
+                self._finish(tarinfo, target, f)
+            return
+
+        with self.tar.extractfile(tarinfo) as data:
+            self._batch.append((tarinfo, target, data.read()))
+        self._batch_size += tarinfo.size
+        self._pending[target] = None
+        if self._batch_size >= self.BATCH_SIZE or len(self._batch) >= self.BATCH_FILES:
+            self._submit()
+
+    def _submit(self):
+        if not self._batch:
+            return
+        batch, self._batch, self._batch_size = self._batch, [], 0
+        self._slots.acquire()
+        future = self._pool.submit(self._write, batch)
+        future.add_done_callback(lambda _: self._slots.release())
+        for _, target, _ in batch:
+            self._pending[target] = future
+
+    def _write(self, batch):
+        for tarinfo, target, content in batch:
+            with target.open("wb") as f:
+                f.write(content)
+                self._finish(tarinfo, target, f)
+
+    def _finish(self, tarinfo, target, f):
+        if self.fsync:
+            f.flush()
+            os.fsync(f.fileno())
+        self.tar.chown(tarinfo, target, numeric_owner=False)
+        self.tar.chmod(tarinfo, target)
+        self.tar.utime(tarinfo, target)
+
+    def _drain(self):
+        """Write the current batch, wait for all pending writes and raise the first error that occurred."""
+        self._submit()
+        futures, self._pending = set(self._pending.values()), {}
+        wait(futures)
+        for future in futures:
+            future.result()
+
+
+def extract_archive(fileobj, extract_to, previous=None, workers=EXTRACT_WORKERS, fsync=False):
+    """Extract a tar archive into `extract_to` in a single sequential pass.
+
+    The archive's root directory is renamed to the name of `extract_to` and the `data_filter` safety checks are
+    applied (see :func:`aptator.actions.tar_extraction_filter.rename`), which also drops the ownership information
+    of the archive, i.e. the extracted files are owned by the extracting user. The archive is extracted into a
+    temporary sibling directory that replaces an existing `extract_to` once the extraction has been completed.
+
+    Args:
+        fileobj: A binary file object positioned at the start of the archive (e.g., an HTTP response).
+        extract_to: Final path for the extracted directory (e.g., /opt/Zotero-8.0.2).
+        previous: Directory of a previously extracted version (e.g., /opt/Zotero-8.0.1). Files that did not change
+            are hardlinked from this directory instead of being written again (see :class:`IncrementalFilter`).
+        workers: Number of threads writing the extracted files (see :class:`ParallelExtractor`); 1 extracts the
+            archive sequentially with `tarfile.extractall`.
+        fsync: Flush the extracted files to disk before `extract_to` is replaced.
+    """
+    extract_to = Path(extract_to)
+    staging = extract_to.with_name(f".{extract_to.name}.partial")
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir(parents=True)
+
+    try:
+        with open_tar_stream(fileobj) as tar:
+            tar_filter = rename(extract_to.name)
+            if previous and Path(previous).is_dir():
+                tar_filter = IncrementalFilter(tar, tar_filter, previous)
+            if workers > 1:
+                ParallelExtractor(tar, tar_filter, workers, fsync).extractall(staging)
+            else:
+                tar.extractall(path=str(staging), filter=tar_filter)
+                if fsync:
+                    _fsync_tree(staging)
+        if isinstance(tar_filter, IncrementalFilter):
+            print(f"  {tar_filter.linked} unchanged files hardlinked from {previous}, {tar_filter.written} updated.")
+        if extract_to.exists():
+            shutil.rmtree(extract_to)
+        (staging / extract_to.name).rename(extract_to)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _fsync_tree(directory):
+    for path in Path(directory).rglob("*"):
+        if path.is_file() and not path.is_symlink():
+            with path.open("rb") as f:
+                os.fsync(f.fileno())
@@ -1,22 +1,24 @@
-import subprocess
-import tarfile
 from pathlib import Path
 
-from aptator import AptatorConfig
+from aptator.actions.extract import linked_directory
+from aptator.privileged import FsPlan
 
-SUDO = AptatorConfig.paths.sudo
 
+def extract_and_link(tar_gz_path, extract_to, link_to, incremental=False):
+    """Extract a tar archive, rename its root directory to extract_to, and create a symlink to it.
 
-def extract_and_link(tar_gz_path, extract_to, link_to):
-    """Extract a tar.gz file, rename it to extract_to, and create a symlink to it.
+    The archive is decompressed and extracted in a single pass; supported formats are .tar.gz, .tar.bz2, .tar.xz/.txz
+    and .tar.zst (see :func:`aptator.actions.extract.open_tar_stream`). Extracting and linking is performed by a
+    single privileged helper process.
 
     Args:
-        tar_gz_path: Path to the tar.gz file
+        tar_gz_path: Path to the tar archive
         extract_to: Final path for the extracted directory (e.g., /opt/Zotero-1.1.1)
         link_to: Path where to create the symlink (e.g., /opt/zotero)
+        incremental: Hardlink files that did not change from the version link_to currently points to
 
     Raises:
-        FileNotFoundError: If the tar.gz file doesn't exist
+        FileNotFoundError: If the archive doesn't exist
         subprocess.CalledProcessError: If extraction or linking fails
     """
     tar_gz_path = Path(tar_gz_path)
@@ -26,34 +28,30 @@ def extract_and_link(tar_gz_path, extract_to, link_to):
     if not tar_gz_path.exists():
         raise FileNotFoundError(f"Archive not found: {tar_gz_path}")
 
-    # Get the top-level directory name from the archive (without extracting)
-    with tarfile.open(tar_gz_path, "r:gz") as tar:
-        members = tar.getmembers()
-        if not members:
-            raise ValueError("Archive is empty")
-        top_level = members[0].name.split("/")[0]
+    print(f"  extracting to {extract_to} and creating symlink {link_to} -> {extract_to}...")
+    previous = linked_directory(link_to) if incremental else None
+    FsPlan().extract(extract_to, archive=tar_gz_path, previous=previous).symlink(extract_to, link_to).execute()
 
-    # Extract to parent directory
-    extract_parent = extract_to.parent
-    extracted_dir = extract_parent / top_level
+    print("  extraction and linking complete.")
 
-    # Extract the tar.gz file using sudo
-    print(f"  extracting to {extract_parent}...")
-    subprocess.run([SUDO, "tar", "-xzf", str(tar_gz_path), "-C", str(extract_parent)], check=True, capture_output=True)
 
-    # Rename the extracted directory to the desired name
-    if extracted_dir != extract_to:
-        print(f"  renaming {extracted_dir} to {extract_to}...")
-        # Remove extract_to if it already exists
-        subprocess.run([SUDO, "rm", "-rf", str(extract_to)], check=True, capture_output=True)
-        subprocess.run([SUDO, "mv", str(extracted_dir), str(extract_to)], check=True, capture_output=True)
+def extract_staged(tar_gz_path, staged, link_to, incremental=False):
+    """Extract a tar archive into the staging directory `staged` without linking it (e.g., by `aptator fetch`).
 
-    # Remove existing symlink if it exists (using sudo)
-    print(f"  removing existing link/directory at {link_to}...")
-    subprocess.run([SUDO, "rm", "-f", str(link_to)], check=True, capture_output=True)
+    `staged` should be located next to the final directory, so that :func:`install_staged` only has to rename it.
 
-    # Create symlink using sudo
-    print(f"  creating symlink {link_to} -> {extract_to}...")
-    subprocess.run([SUDO, "ln", "-sf", str(extract_to), str(link_to)], check=True, capture_output=True)
+    Args:
+        tar_gz_path: Path to the tar archive
+        staged: Path for the extracted directory (e.g., /opt/.Zotero-1.1.1.staged)
+        link_to: Path of the symlink that points to the current version (e.g., /opt/zotero)
+        incremental: Hardlink files that did not change from the version link_to currently points to
+    """
+    print(f"  extracting to {staged}...")
+    previous = linked_directory(link_to) if incremental else None
+    FsPlan().extract(staged, archive=tar_gz_path, previous=previous).execute()
 
-    print("  extraction and linking complete.")
+
+def install_staged(staged, extract_to, link_to):
+    """Move a directory extracted by :func:`extract_staged` to extract_to and point the symlink link_to to it."""
+    print(f"  moving {staged} to {extract_to} and creating symlink {link_to} -> {extract_to}...")
+    FsPlan().move(staged, extract_to).symlink(extract_to, link_to).execute()
@@ -20,16 +20,20 @@ def rename(root_dir: str, base_filter: str | None = "data_filter"):
         ...     tar.extractall(path="/extract/path", filter=tar_filter)
     """
     # Get the base filter from tarfile
-    if base_filter:
-        base = getattr(tarfile, base_filter)
+    base = getattr(tarfile, base_filter) if base_filter else None
+
+    def rename_root(name: str) -> str:
+        # Find the original root directory from the first component of the path
+        if "/" in name:
+            return "/".join((root_dir, name.split("/", 1)[1]))
+        return root_dir
 
     def rename_root_filter(tarinfo: tarfile.TarInfo, path: str) -> tarfile.TarInfo:
         """Filter that renames the root directory of the archive."""
-        # Find the original root directory from the first component of the path
-        if "/" in tarinfo.name:
-            tarinfo.name = "/".join((root_dir, tarinfo.name.split("/", 1)[1]))
-        else:
-            tarinfo.name = root_dir
+        tarinfo.name = rename_root(tarinfo.name)
+        # hard links refer to other members of the archive, which are renamed as well
+        if tarinfo.islnk():
+            tarinfo.linkname = rename_root(tarinfo.linkname)
 
         # Apply base filter if specified
         if base is not None:
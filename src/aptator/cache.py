@@ -0,0 +1,222 @@
+"""Content-addressed cache of downloaded assets.
+
+Assets are stored under a key derived from their digest (e.g. `sha256-<hash>`) or, for assets without a digest, from
+their URL and ETag. Each entry is a directory that contains the asset under its original file name. The cache is
+bounded by `[cache] max_size` (MiB, default: 2048); the least recently used entries are evicted first. During a run,
+eviction is deferred until all downloaded files have been installed (see :func:`deferred_eviction`).
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+
+from aptator import CACHE_HOME, AptatorConfig
+from aptator.download import download, format_size, mirror_url
+from aptator.httpclient import urlopen
+from aptator.report import current_package, report, timed
+
+CACHE_DIR = CACHE_HOME / "downloads"
+DEFAULT_MAX_SIZE = 2048 * 1024 * 1024
+
+# serializes concurrent fetches of the same asset, so that it is only downloaded once
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+_deferrals_lock = threading.Lock()
+# serializes evictions within the process
+_prune_lock = threading.Lock()
+
+
+@contextmanager
+def deferred_eviction():
+    """Do not evict any entries until the end of the block, and prune the cache afterwards.
+
+    Downloaded files are passed from the download stage to the install stage by their location within the cache, so
+    they must not be evicted by the downloads of other packages before they have been installed.
+    """
+    with _deferrals_lock:
+        DownloadCache.deferrals += 1
+    try:
+        yield
+    finally:
+        with _deferrals_lock:
+            DownloadCache.deferrals -= 1
+            last = DownloadCache.deferrals == 0
+        if last:
+            DownloadCache().prune()
+
+
+class DownloadCache:
+    """A size-bounded LRU cache of downloaded files."""
+
+    # number of active `deferred_eviction` blocks; entries are only evicted while it is 0
+    deferrals = 0
+
+    def __init__(self, path: Path = CACHE_DIR, max_size: int | None = None):
+        self.path = path
+        if max_size is None:
+            max_size_mib = getattr(AptatorConfig.cache, "max_size", None)
+            max_size = max_size_mib * 1024 * 1024 if max_size_mib is not None else DEFAULT_MAX_SIZE
+        self.max_size = max_size
+
+    @staticmethod
+    def key(url: str, hash_type: str | None = None, expected_hash: str | None = None) -> str | None:
+        """Return the cache key of an asset.
+
+        Assets with a digest are keyed by their hash. Otherwise, the URL is combined with the ETag (or Last-Modified
+        date) reported by a HEAD request, so that changed resources are not served from the cache.
+
+        Returns:
+            str | None: The key, or None if the asset cannot be cached.
+        """
+        if hash_type and expected_hash:
+            return f"{hash_type}-{expected_hash.lower()}"
+
+        try:
+            with urlopen(urllib.request.Request(url, method="HEAD")) as response:
+                validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+        except urllib.error.URLError:
+            return None
+        if not validator:
+            return None
+        return "url-" + hashlib.sha256(f"{url}\n{validator}".encode()).hexdigest()
+
+    def _entries(self) -> list[Path]:
+        return [entry for entry in self.path.iterdir() if entry.is_dir() and not entry.name.startswith(".")]
+
+    @staticmethod
+    def _size(entry: Path) -> int:
+        # entries may be removed concurrently, e.g. by `aptator cache prune`
+        try:
+            return sum(f.stat().st_size for f in entry.iterdir())
+        except FileNotFoundError:
+            return 0
+
+    def get(self, key: str | None) -> Path | None:
+        """Return the cached file for `key`, or None on a cache miss."""
+        entry = self.path / key if key else None
+        if not entry or not entry.is_dir():
+            return None
+        try:
+            files = list(entry.iterdir())
+            # the modification time of an entry records its last use
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return files[0] if files else None
+
+    def put(self, key: str, file_path: Path) -> Path:
+        """Move a downloaded file into the cache and evict the least recently used entries if required.
+
+        Returns:
+            Path: The location of the file within the cache.
+        """
+        entry = self.path / key
+        if entry.exists():
+            shutil.rmtree(entry)
+        entry.mkdir(parents=True)
+        cached_path = entry / file_path.name
+        shutil.move(file_path, cached_path)
+        os.utime(entry)
+        if not self.deferrals:
+            self.prune(keep=entry)
+        return cached_path
+
+    def fetch(self, url: str, filename: str, hash_type: str | None = None, expected_hash: str | None = None) -> Path:
+        """Return a local copy of `url`, downloading it only on a cache miss.
+
+        Args:
+            url: The URL of the asset.
+            filename: The file name under which the asset is stored.
+            hash_type: Name of the hashlib algorithm of the expected hash, or None.
+            expected_hash: The expected hex digest of the asset, or None.
+
+        Returns:
+            Path: The cached file.
+
+        Raises:
+            ValueError: If the checksum of the downloaded file does not match `expected_hash`.
+        """
+        url = mirror_url(url)
+        key = self.key(url, hash_type, expected_hash)
+        with _key_locks_lock:
+            lock = _key_locks.setdefault(key or url, threading.Lock())
+        with lock:
+            return self._fetch(url, filename, key, hash_type, expected_hash)
+
+    def _fetch(self, url, filename, key, hash_type, expected_hash) -> Path:
+        cached_path = self.get(key)
+        if cached_path:
+            print(f"  using cached download {cached_path}")
+            report.record("download", 0.0, current_package(), url=url, bytes=0, cached=True)
+            return cached_path
+
+        staging = self.path / ".staging"
+        staging.mkdir(parents=True, exist_ok=True)
+        file_path = Path(tempfile.mkdtemp(dir=staging)) / filename
+        try:
+            # assets without a usable key are stored under the sha256 hash of their content
+            computed_hash = download(url, file_path, hash_type if expected_hash else "sha256")
+            if expected_hash:
+                print(f"  verifying {hash_type} checksum...")
+                # the digest has been computed while downloading
+                with timed("verify", hash_type=hash_type):
+                    if computed_hash.lower() != expected_hash.lower():
+                        raise ValueError(f"Checksum verification of {filename} failed! Download may be corrupted.")
+                print("  checksum verified.")
+            else:
+                print("  no digest available, skipping verification")
+            return self.put(key or f"sha256-{computed_hash}", file_path)
+        finally:
+            shutil.rmtree(file_path.parent)
+
+    def stats(self) -> tuple[int, int]:
+        """Return the number of entries and the total size of the cache in bytes."""
+        if not self.path.exists():
+            return 0, 0
+        entries = self._entries()
+        return len(entries), sum(self._size(entry) for entry in entries)
+
+    def prune(self, max_size: int | None = None, keep: Path | None = None) -> tuple[int, int]:
+        """Evict the least recently used entries until the cache is not larger than `max_size` bytes.
+
+        Args:
+            max_size: The maximum size of the cache; defaults to the configured size.
+            keep: An entry that must not be evicted (e.g., the one that has just been added).
+
+        Returns:
+            tuple[int, int]: The number of evicted entries and the number of bytes freed.
+        """
+        if not self.path.exists():
+            return 0, 0
+        max_size = self.max_size if max_size is None else max_size
+        with _prune_lock:
+            entries = []
+            for entry in self._entries():
+                try:
+                    entries.append((entry.stat().st_mtime, entry, self._size(entry)))
+                except FileNotFoundError:
+                    continue
+            entries.sort()
+            total = sum(size for _, _, size in entries)
+            removed = freed = 0
+            for _, entry, size in entries:
+                if total <= max_size:
+                    break
+                if entry == keep:
+                    continue
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+                removed += 1
+                freed += size
+        return removed, freed
+
+    def __str__(self):
+        count, size = self.stats()
+        return f"{count} entries, {format_size(size)} of {format_size(self.max_size)} ({self.path})"
@@ -1,106 +1,91 @@
 #!/usr/bin/env python3
 
 import argparse
-import re
+import functools
 import sys
-import tomllib
-
-from aptator import CONFIG_PATH
-from aptator.actions.deb import install_deb
-from aptator.actions.download_extract_and_link import download_extract_and_link
-from aptator.actions.exec import exec_command
-from aptator.actions.extract_and_link import extract_and_link
-from aptator.source.github import GitHub
-from aptator.state import get_installed_version, set_installed_version
-
-
-def process_package(cfg, force_packages):
-    """Process a single package configuration."""
-    name = cfg["name"]
-    repo = cfg["repo"]
-    asset_re = re.compile(cfg["asset_pattern"])
-    asset_version_re = re.compile(cfg.get("asset_version_pattern", "(.*)"))
-    allow_prerelease = cfg.get("prerelease", False)
-    use_tag = cfg.get("use_tag", False)
-    action = cfg.get("action", {})
-    action_type = action.get("type") if isinstance(action, dict) else None
-
-    print(f"Checking {name} ({repo})")
-
-    # Get currently installed version
-    installed_version = get_installed_version(name)
-    print("... Installed version:", installed_version)
-
-    # Get latest release or tag from GitHub
-    gh = GitHub(repo, asset_version_re, asset_re)
-
-    if use_tag:
-        downloadable = gh.get_latest_tag()
-        if not downloadable:
-            print("No tag found...")
-            return
-        release_version = (
-            asset_version_re.search(downloadable.data["name"]).group(1)
-            if asset_version_re.search(downloadable.data["name"])
-            else downloadable.data["name"]
+
+from aptator import GLOBAL_CONFIG_PATH, LOCAL_CONFIG_PATH, AptatorConfig
+
+# kept in sync with aptator.mirror.DEFAULT_PORT, which is not imported for the sake of a fast startup
+DEFAULT_PORT = 8080
+
+
+def cache_command(args):
+    """Show statistics of the download cache or prune it."""
+    from aptator.cache import DownloadCache
+    from aptator.download import format_size
+
+    cache = DownloadCache()
+    if args.cache_command == "prune":
+        from aptator.state import run_lock
+
+        max_size = args.max_size * 1024 * 1024 if args.max_size is not None else None
+        # wait for a running update, whose downloads may not have been installed yet
+        with run_lock():
+            removed, freed = cache.prune(max_size=max_size)
+        print(f"Removed {removed} entries ({format_size(freed)}).")
+    print(f"Download cache: {cache}")
+
+
+def update_command(packages, args):
+    """Check, stage and/or install updates (`aptator`, `plan`, `apply`, `fetch` and `install`)."""
+    # the modules required for checking and installing packages are only imported once the configuration has been read
+    from aptator.pipeline import run_pipeline
+    from aptator.report import write_reports
+    from aptator.source.github import GitHub, cache_stats
+
+    GitHub.use_cache = not args.no_cache
+
+    if args.command == "plan":
+        from aptator.plan import create_plan, write_plan
+
+        write_plan(create_plan(packages, args.force, jobs=args.jobs), args.plan)
+    elif args.command == "apply":
+        from aptator.plan import apply_plan, load_plan
+
+        try:
+            plan = load_plan(args.plan)
+        except (OSError, ValueError) as e:
+            sys.exit(f"Error: {e}")
+        apply_plan(plan, packages, download_jobs=args.download_jobs)
+    elif args.command == "fetch":
+        from aptator.staging import stage_updates
+
+        run_pipeline(
+            packages,
+            args.force,
+            jobs=args.jobs,
+            download_jobs=args.download_jobs,
+            install=functools.partial(stage_updates, force_packages=args.force),
         )
+    elif args.command == "install":
+        from aptator.staging import install_staged
+
+        install_staged()
     else:
-        downloadable = gh.get_latest_release_asset(allow_prerelease=allow_prerelease)
-        if not downloadable:
-            print("No release asset found...")
-            return
-        release_version = gh.get_asset_version(downloadable.data)
+        # Packages are checked and downloaded concurrently while the downloaded updates are installed one after another.
+        run_pipeline(packages, args.force, jobs=args.jobs, download_jobs=args.download_jobs)
+    write_reports(args.report, args.prometheus)
 
-    print("... Latest release:", release_version if release_version else "none")
-    print()
+    if GitHub.use_cache and args.command in (None, "plan", "fetch"):
+        print(f"GitHub API cache: {cache_stats}")
 
-    # skip packages that have already the latest version installed
-    if installed_version == release_version and name not in force_packages:
-        return
 
-    if name in force_packages:
-        print(f"...Forcing reinstallation of {name} with version {release_version}")
-    else:
-        print(f"...Updating {name} to version {release_version}")
-
-    # Handle deb-install action
-    if action_type == "deb-install":
-        if gh.perform_action(downloadable, action=install_deb):
-            set_installed_version(name, release_version)
-            print(f"{name} updated successfully.")
-        else:
-            print(f"{name} update failed.")
-
-    # Handle exec action
-    elif action_type == "exec":
-        command = action.get("command")
-        if command:
-            exec_command(command)
-            set_installed_version(name, release_version)
-            print(f"{name} updated successfully.")
-        else:
-            print(f"{name} update failed: no command specified.")
-
-    # Handle extract-and-link action
-    elif action_type == "extract-and-link":
-        extract_to = action.get("extract_to") + f"/{name}-{release_version}"
-        link_to = action.get("link_to")
-        if extract_to and link_to:
-            if gh.perform_action(downloadable, action=lambda path: extract_and_link(str(path), extract_to, link_to)):
-                set_installed_version(name, release_version)
-                print(f"{name} updated successfully.")
-            else:
-                print(f"{name} update failed.")
-        else:
-            print(f"{name} update failed: extract_to and link_to must be specified.")
-
-    elif action_type == "download-extract-and-link":
-        url = action.get("url")
-        extract_to = action.get("extract_to") + f"/{name}-{release_version}"
-        link_to = action.get("link_to")
-        download_extract_and_link(url, extract_to, link_to)
-        set_installed_version(name, release_version)
-        print(f"{name} updated successfully.")
+def rollback_command(packages, args):
+    """Switch a package back to a retained previous version."""
+    import subprocess
+
+    from aptator.retention import rollback
+    from aptator.state import run_lock
+
+    cfg = next((pkg for pkg in packages if pkg["name"] == args.name), None)
+    if cfg is None:
+        sys.exit(f"Error: package {args.name} is not configured.")
+    try:
+        with run_lock():
+            rollback(cfg, args.version)
+    except (ValueError, subprocess.CalledProcessError) as e:
+        sys.exit(f"Error: {e}")
 
 
 def main():
@@ -109,6 +94,11 @@ def main():
         description="Manage GitHub release-based package installations",
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
+    parser.add_argument(
+        "--config",
+        metavar="PATH",
+        help=f"Configuration file (default: {LOCAL_CONFIG_PATH} if it exists, otherwise {GLOBAL_CONFIG_PATH})",
+    )
     parser.add_argument(
         "--force",
         nargs="+",
@@ -116,16 +106,121 @@ def main():
         default=[],
         help="Force update/install for specified package names (e.g., --force FreeTube Zotero)",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=8,
+        metavar="N",
+        help="Number of packages to check concurrently (default: 8)",
+    )
+    parser.add_argument(
+        "--download-jobs",
+        type=int,
+        default=4,
+        metavar="N",
+        help="Number of assets to download concurrently (default: 4)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not use or update the cache of GitHub API responses",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="FILE",
+        help="Write a JSON report with the timing of every phase (lookup, download, install, ...) to FILE",
+    )
+    parser.add_argument(
+        "--prometheus",
+        metavar="FILE",
+        help="Write the run report in the Prometheus text format to FILE (e.g., for the node exporter's textfile "
+        "collector)",
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    cache_parser = subparsers.add_parser("cache", help="Show statistics of the download cache or prune it")
+    cache_parser.add_argument("cache_command", choices=["stats", "prune"])
+    cache_parser.add_argument(
+        "--max-size",
+        type=int,
+        metavar="MIB",
+        help="Prune the cache to at most MIB mebibytes (default: [cache] max_size, 0 clears the cache)",
+    )
+    subparsers.add_parser(
+        "daemon",
+        help="Keep running and check every package once per check_interval, adapting to GitHub's rate limit",
+    )
+    plan_parser = subparsers.add_parser(
+        "plan", help="Resolve the latest releases of all packages and write the updates to a JSON plan"
+    )
+    plan_parser.add_argument("plan", metavar="PLAN", help="Plan file to write")
+    apply_parser = subparsers.add_parser(
+        "apply", help="Install the updates of a plan (created by `aptator plan`) without using the GitHub API"
+    )
+    apply_parser.add_argument("plan", metavar="PLAN", help="Plan file to apply")
+    subparsers.add_parser(
+        "fetch", help="Download and verify the updates of all packages and stage them for a later `aptator install`"
+    )
+    subparsers.add_parser("install", help="Install the updates staged by `aptator fetch` without downloading anything")
+    rollback_parser = subparsers.add_parser(
+        "rollback", help="Switch a package back to a retained previous version without downloading it again"
+    )
+    rollback_parser.add_argument("name", metavar="NAME", help="Name of the package")
+    rollback_parser.add_argument(
+        "version", nargs="?", metavar="VERSION", help="Version to switch to (default: the previously installed one)"
+    )
+    serve_parser = subparsers.add_parser(
+        "serve", help="Run a caching mirror of the GitHub API and of asset downloads for other aptator hosts"
+    )
+    serve_parser.add_argument("--bind", default="127.0.0.1", metavar="ADDRESS", help="Address to listen on")
+    serve_parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})"
+    )
     args = parser.parse_args()
 
-    with CONFIG_PATH.open("rb") as f:
-        config = tomllib.load(f)
+    if args.config:
+        AptatorConfig.use(args.config)
+
+    if args.command == "cache":
+        cache_command(args)
+        return
+
+    packages = AptatorConfig.packages or []
+    if not packages and args.command is None:
+        print("No packages configured.")
+        return
+
+    if args.command == "rollback":
+        rollback_command(packages, args)
+        return
+
+    if args.command == "serve":
+        from aptator.mirror import serve
 
-    for pkg in config.get("packages", []):
         try:
-            process_package(pkg, force_packages=args.force)
-        except Exception as e:
-            print(f"Error processing {pkg.get('name')}: {e}", file=sys.stderr)
+            serve(packages, bind=args.bind, port=args.port)
+        except KeyboardInterrupt:
+            print("Stopped.")
+        return
+
+    if args.command == "daemon":
+        from aptator.daemon import run_daemon
+        from aptator.source.github import GitHub
+
+        GitHub.use_cache = not args.no_cache
+        try:
+            run_daemon(
+                packages,
+                jobs=args.jobs,
+                download_jobs=args.download_jobs,
+                report_file=args.report,
+                prometheus_file=args.prometheus,
+            )
+        except KeyboardInterrupt:
+            print("Stopped.")
+        return
+
+    update_command(packages, args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+"""Long-running mode that checks every package on its own schedule.
+
+Every package is checked once per `check_interval` seconds (per package, or `[daemon] check_interval`). The time of
+the last successful check is stored in the state database, so that restarting the daemon (or running aptator from
+cron in between) does not trigger additional checks. Checks are jittered and spread over time, and deferred until the
+rate limit resets if the GitHub API reports that too few requests remain.
+"""
+
+import random
+import time
+
+from aptator import AptatorConfig
+from aptator.pipeline import run_pipeline
+from aptator.report import report, write_reports
+from aptator.source.github import rate_limit
+from aptator.state import get_last_checked
+
+# default number of seconds between two checks of a package
+DEFAULT_CHECK_INTERVAL = 6 * 60 * 60
+# checks are randomly moved by up to this fraction of their interval
+DEFAULT_JITTER = 0.1
+# overdue checks (e.g., after starting the daemon) are spread over up to this number of seconds
+SPREAD = 10 * 60
+# number of API requests kept in reserve (e.g., for manual runs) when scheduling checks
+RATE_LIMIT_RESERVE = 5
+# maximum number of seconds to sleep between two scheduling rounds
+MAX_SLEEP = 15 * 60
+
+
+def _jitter(seconds: float) -> float:
+    """Return a random delay of up to `seconds`, so that checks are spread over time and do not synchronize."""
+    # scheduling jitter, not cryptography
+    return random.uniform(0, seconds)  # noqa: S311
+
+
+class Scheduler:
+    """Keep track of the next check time of every package."""
+
+    def __init__(self, packages, check_interval=DEFAULT_CHECK_INTERVAL, jitter=DEFAULT_JITTER):
+        self.packages = {pkg["name"]: pkg for pkg in packages}
+        self.check_interval = check_interval
+        self.jitter = jitter
+        self.next_check = {}
+
+        now = time.time()
+        for name in self.packages:
+            last_checked = get_last_checked(name)
+            due = last_checked + self.interval(name) if last_checked is not None else now
+            # spread overdue checks, so that they do not all hit the API at once
+            self.next_check[name] = max(due, now + _jitter(min(SPREAD, self.interval(name))))
+
+    def interval(self, name) -> float:
+        return self.packages[name].get("check_interval", self.check_interval)
+
+    def due(self, now: float) -> list:
+        """Return the configurations of all packages whose check is due, most overdue first."""
+        names = sorted((name for name, t in self.next_check.items() if t <= now), key=self.next_check.get)
+        return [self.packages[name] for name in names]
+
+    def reschedule(self, name, now: float) -> None:
+        """Schedule the next regular check of a package."""
+        interval = self.interval(name)
+        # moved by up to `jitter` times the interval in either direction
+        self.next_check[name] = now + interval * (1 - self.jitter) + _jitter(2 * self.jitter * interval)
+
+    def defer(self, name, until: float) -> None:
+        """Defer the check of a package until the given time (plus a random delay)."""
+        self.next_check[name] = until + _jitter(min(SPREAD, self.interval(name)))
+
+    def next_wakeup(self) -> float:
+        return min(self.next_check.values())
+
+
+def run_daemon(packages, jobs=8, download_jobs=4, report_file=None, prometheus_file=None):
+    """Check and update packages according to their schedule until interrupted.
+
+    Args:
+        packages: The package configurations.
+        jobs: Number of concurrent checks.
+        download_jobs: Number of concurrent downloads.
+        report_file: File to which the JSON report of every run is written (see :mod:`aptator.report`), or None.
+        prometheus_file: File to which the report of every run is written in the Prometheus format, or None.
+    """
+    daemon_cfg = AptatorConfig.daemon
+    scheduler = Scheduler(
+        packages,
+        check_interval=getattr(daemon_cfg, "check_interval", DEFAULT_CHECK_INTERVAL),
+        jitter=getattr(daemon_cfg, "jitter", DEFAULT_JITTER),
+    )
+    if not packages:
+        return
+
+    while True:
+        now = time.time()
+        due = scheduler.due(now)
+
+        # throttle: only run as many checks as the remaining rate limit permits and defer the others
+        if due and rate_limit.remaining is not None and rate_limit.reset and rate_limit.reset > now:
+            budget = max(0, rate_limit.remaining - RATE_LIMIT_RESERVE)
+            for pkg in due[budget:]:
+                scheduler.defer(pkg["name"], rate_limit.reset)
+            if len(due) > budget:
+                print(f"Rate limit: deferring {len(due) - budget} checks until {time.ctime(rate_limit.reset)}")
+            due = due[:budget]
+
+        if due:
+            print(f"{time.ctime(now)}: checking {', '.join(pkg['name'] for pkg in due)}")
+            report.reset()
+            run_pipeline(due, [], jobs=jobs, download_jobs=download_jobs)
+            write_reports(report_file, prometheus_file)
+            for pkg in due:
+                last_checked = get_last_checked(pkg["name"])
+                if last_checked is not None and last_checked >= now:
+                    scheduler.reschedule(pkg["name"], time.time())
+                elif rate_limit.exhausted:
+                    scheduler.defer(pkg["name"], rate_limit.reset)
+                else:
+                    # the check failed for another reason; retry after a shorter delay
+                    scheduler.defer(pkg["name"], time.time() + min(SPREAD, scheduler.interval(pkg["name"])))
+
+        time.sleep(min(MAX_SLEEP, max(1.0, scheduler.next_wakeup() - time.time())))
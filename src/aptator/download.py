@@ -0,0 +1,379 @@
+"""Download engine with on-the-fly checksum computation, resume support and segmented downloads.
+
+Downloads are written to a persistent partial file in `PARTIAL_DIR`. If the connection drops, the download is resumed
+from the partial file using an HTTP `Range` request, either immediately (up to `RETRIES` times) or by the next run.
+Large assets may be split into several byte ranges that are downloaded in parallel (see `[download] segments` in the
+configuration).
+
+Next to the partial file, a single-stream download keeps the validator (ETag or Last-Modified date) of the asset in a
+`.validator` file, and a segmented download the validator and the remaining byte ranges in a `.segments` file. Partial
+files are only resumed if the validator still matches the asset.
+"""
+
+import functools
+import hashlib
+import http.client
+import json
+import shutil
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from aptator import CACHE_HOME, AptatorConfig, write_atomic
+from aptator.httpclient import urlopen
+from aptator.report import timed
+
+# number of bytes read from the network and written to disk at once; bounds the memory used by a download
+CHUNK_SIZE = 256 * 1024
+# minimum number of seconds between two progress reports
+PROGRESS_INTERVAL = 1.0
+# number of times an interrupted download is resumed before giving up
+RETRIES = 3
+# assets smaller than this are never split into segments
+SEGMENT_MIN_SIZE = 16 * 1024 * 1024
+
+PARTIAL_DIR = CACHE_HOME / "partial"
+
+# serializes concurrent downloads of the same URL, which share a partial file
+_partial_locks = {}
+_partial_locks_lock = threading.Lock()
+
+
+def format_size(num_bytes: float) -> str:
+    """Format a number of bytes in human-readable binary units."""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if num_bytes < 1024 or unit == "GiB":
+            break
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} {unit}"
+
+
+class Progress:
+    """Report the progress and throughput of a download (thread-safe, for segmented downloads)."""
+
+    def __init__(self, total: int | None = None, stream=None):
+        self.total = total
+        # bytes of the asset that were downloaded by an earlier run and are not transferred again
+        self.resumed = 0
+        # bytes transferred by this run, which determine the throughput
+        self.done = 0
+        self.stream = stream or sys.stdout
+        self.started = time.monotonic()
+        self._last_report = self.started
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def throughput(self) -> float:
+        """Average throughput in bytes per second."""
+        return self.done / max(self.elapsed, 1e-6)
+
+    def update(self, num_bytes: int) -> None:
+        with self._lock:
+            self.done += num_bytes
+            now = time.monotonic()
+            if now - self._last_report < PROGRESS_INTERVAL:
+                return
+            self._last_report = now
+        self.report()
+
+    def report(self) -> None:
+        total = f" of {format_size(self.total)}" if self.total else ""
+        downloaded = format_size(self.resumed + self.done)
+        print(f"  downloaded {downloaded}{total} ({format_size(self.throughput)}/s)", file=self.stream)
+
+
+def mirror_url(url: str) -> str:
+    """Return the URL from which an asset is downloaded.
+
+    If `[download] mirror` is set to the download URL of an `aptator serve` mirror (e.g., http://mirror:8080/download),
+    https URLs are mapped to `<mirror>/<host>/<path>`.
+    """
+    mirror = getattr(AptatorConfig.download, "mirror", None)
+    parts = urlsplit(url)
+    if not mirror or parts.scheme != "https":
+        return url
+    return f"{mirror.rstrip('/')}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+
+
+def _validator(headers) -> str | None:
+    """Return the validator to use in an `If-Range` header (a strong ETag or the Last-Modified date)."""
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified")
+
+
+def _hash_file(path: Path, hash_func) -> None:
+    """Feed the contents of a file to `hash_func`."""
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            hash_func.update(chunk)
+
+
+def _copy(response, f, hash_func, progress, written=None) -> None:
+    """Copy a response to a file in fixed-size chunks, hashing and reporting the data as it arrives.
+
+    Args:
+        written: Called with the number of bytes after every chunk written to `f`, or None.
+
+    Raises:
+        http.client.IncompleteRead: If the connection was closed before the whole body has been received.
+    """
+    received = 0
+    for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+        f.write(chunk)
+        if hash_func:
+            hash_func.update(chunk)
+        if written:
+            written(len(chunk))
+        received += len(chunk)
+        progress.update(len(chunk))
+
+    # `HTTPResponse.read(amt)` signals a prematurely closed connection by returning no more data
+    length = response.headers.get("Content-Length")
+    if length and received < int(length):
+        raise http.client.IncompleteRead(b"", int(length) - received)
+
+
+def _resume_request(url: str, part: Path, validator_path: Path) -> tuple[urllib.request.Request, int]:
+    """Return the request of a single-stream download and the offset at which it resumes the partial file.
+
+    A partial file is only resumed if the validator of its asset has been recorded; the `If-Range` header makes the
+    server send the complete asset instead if it changed since.
+    """
+    request = urllib.request.Request(url)
+    offset = part.stat().st_size if part.exists() and validator_path.exists() else 0
+    if offset:
+        request.add_header("Range", f"bytes={offset}-")
+        request.add_header("If-Range", validator_path.read_text())
+    return request, offset
+
+
+def _start_stream(response, part: Path, validator_path: Path, offset: int, hash_func) -> int:
+    """Prepare the partial file for a response and return the offset at which the response is written.
+
+    A partial response resumes the partial file, whose contents are hashed first. Otherwise the server sent the
+    complete (possibly changed) asset, whose validator is recorded so that the download can be resumed.
+    """
+    if response.status == 206:
+        print(f"  resuming download at {format_size(offset)}...")
+        if hash_func:
+            _hash_file(part, hash_func)
+        return offset
+
+    validator = _validator(response.headers)
+    if validator and response.headers.get("Accept-Ranges") == "bytes":
+        validator_path.write_text(validator)
+    else:
+        validator_path.unlink(missing_ok=True)
+    return 0
+
+
+def _download_stream(url: str, part: Path, hash_type: str | None, progress: Progress) -> str | None:
+    """Download `url` to `part` in a single stream, resuming from the existing partial file if possible."""
+    validator_path = part.with_suffix(".validator")
+    # the partial file of an earlier segmented attempt cannot be resumed in a single stream
+    part.with_suffix(".segments").unlink(missing_ok=True)
+    for attempt in range(RETRIES + 1):
+        hash_func = hashlib.new(hash_type) if hash_type else None
+        request, offset = _resume_request(url, part, validator_path)
+        try:
+            with urlopen(request) as response:
+                offset = _start_stream(response, part, validator_path, offset, hash_func)
+                length = response.headers.get("Content-Length")
+                progress.total = offset + int(length) if length else None
+                if not attempt or not offset:
+                    # a retry resumes the bytes transferred by an earlier attempt, which are counted by `done`
+                    progress.resumed = offset
+                with part.open("ab" if offset else "wb") as f:
+                    _copy(response, f, hash_func, progress)
+        except urllib.error.HTTPError as e:
+            if e.code != 416:
+                raise
+            # the partial file does not match the resource anymore
+            part.unlink(missing_ok=True)
+            validator_path.unlink(missing_ok=True)
+        except (OSError, http.client.HTTPException) as e:
+            if attempt == RETRIES:
+                raise
+            print(f"  download interrupted ({e}), retrying...", file=sys.stderr)
+            time.sleep(2**attempt)
+        else:
+            validator_path.unlink(missing_ok=True)
+            return hash_func.hexdigest() if hash_func else None
+
+    raise OSError(f"Unable to download {url}")
+
+
+class _Segments:
+    """The byte ranges of a segmented download that remain to be downloaded, saved in a `.segments` file.
+
+    The file is saved at most once per `PROGRESS_INTERVAL` while the segments are downloaded and whenever a segment
+    stops, so that an interrupted download is resumed by the next run. It only lists bytes already written to the
+    partial file.
+    """
+
+    def __init__(self, path: Path, validator: str, length: int, ranges: list):
+        self.path = path
+        self.validator = validator
+        self.length = length
+        # [next position, last position] of every segment
+        self.ranges = ranges
+        self._saved = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Path, part: Path, validator: str, length: int) -> "_Segments | None":
+        """Return the saved state of a download, or None if there is none for the current version of the asset."""
+        try:
+            data = json.loads(path.read_text())
+            if data["validator"] != validator or data["length"] != length or part.stat().st_size != length:
+                return None
+            return cls(path, validator, length, data["ranges"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    @property
+    def remaining(self) -> int:
+        return sum(end + 1 - position for position, end in self.ranges)
+
+    def advance(self, index: int, num_bytes: int) -> None:
+        """Record that `num_bytes` of segment `index` have been written."""
+        with self._lock:
+            self.ranges[index][0] += num_bytes
+            if time.monotonic() - self._saved >= PROGRESS_INTERVAL:
+                self._save()
+
+    def save(self) -> None:
+        with self._lock:
+            self._save()
+
+    def _save(self) -> None:
+        write_atomic(self.path, json.dumps({"validator": self.validator, "length": self.length, "ranges": self.ranges}))
+        self._saved = time.monotonic()
+
+
+def _download_range(url: str, part: Path, segments: _Segments, index: int, progress: Progress) -> None:
+    """Download the remaining byte range of segment `index` of `url` into the corresponding region of `part`."""
+    for attempt in range(RETRIES + 1):
+        position, end = segments.ranges[index]
+        request = urllib.request.Request(
+            url, headers={"Range": f"bytes={position}-{end}", "If-Range": segments.validator}
+        )
+        try:
+            with urlopen(request) as response, part.open("r+b") as f:
+                if response.status != 206:
+                    raise ValueError(f"The asset {url} changed during the download.")
+                f.seek(position)
+                try:
+                    _copy(response, f, None, progress, functools.partial(segments.advance, index))
+                finally:
+                    segments.save()
+        except urllib.error.HTTPError:
+            raise
+        except (OSError, http.client.HTTPException) as e:
+            if attempt == RETRIES:
+                raise
+            print(f"  segment download interrupted ({e}), retrying...", file=sys.stderr)
+            time.sleep(2**attempt)
+        else:
+            return
+
+
+def _download_segmented(url: str, part: Path, segments: int, progress: Progress) -> bool:
+    """Download `url` to `part` using `segments` parallel range requests.
+
+    Returns:
+        bool: False if the asset is too small or the server does not support range requests.
+    """
+    try:
+        with urlopen(urllib.request.Request(url, method="HEAD")) as response:
+            # reuse the final URL of redirects (e.g., to objects.githubusercontent.com) for all segments
+            url = response.url
+            length = int(response.headers.get("Content-Length") or 0)
+            validator = _validator(response.headers)
+            accepts_ranges = response.headers.get("Accept-Ranges") == "bytes"
+    except urllib.error.HTTPError:
+        return False
+
+    if not (accepts_ranges and validator and length >= SEGMENT_MIN_SIZE):
+        return False
+
+    # the validator of an earlier single-stream attempt does not describe the segmented partial file
+    part.with_suffix(".validator").unlink(missing_ok=True)
+    state_path = part.with_suffix(".segments")
+    state = _Segments.load(state_path, part, validator, length)
+    if state:
+        print(f"  resuming segmented download at {format_size(length - state.remaining)}...")
+    else:
+        print(f"  downloading {format_size(length)} in {segments} segments...")
+        segment_size = -(-length // segments)
+        ranges = [[start, min(start + segment_size, length) - 1] for start in range(0, length, segment_size)]
+        state = _Segments(state_path, validator, length, ranges)
+        with part.open("wb") as f:
+            f.truncate(length)
+        state.save()
+    progress.total = length
+    progress.resumed = length - state.remaining
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        futures = [
+            executor.submit(_download_range, url, part, state, index, progress)
+            for index, (position, end) in enumerate(state.ranges)
+            if position <= end
+        ]
+        for future in futures:
+            future.result()
+    state_path.unlink(missing_ok=True)
+    return True
+
+
+def download(url: str, file_path: Path, hash_type: str | None = None, segments: int | None = None) -> str | None:
+    """Download a URL to a file in fixed-size chunks, hashing the data as it arrives.
+
+    The data is written to a partial file that survives interrupted downloads, which are resumed with HTTP range
+    requests. Large assets are downloaded in `segments` parallel byte ranges if the server supports range requests;
+    in that case the checksum is computed once the segments have been reassembled.
+
+    Args:
+        url: The URL to download.
+        file_path: Path of the file to write.
+        hash_type: Name of the hashlib algorithm to compute (e.g., "sha256"), or None.
+        segments: Number of parallel range requests; defaults to `[download] segments` of the configuration or 1.
+
+    Returns:
+        str | None: The hex digest of the downloaded data, or None if no `hash_type` was given.
+    """
+    if segments is None:
+        segments = getattr(AptatorConfig.download, "segments", 1)
+    PARTIAL_DIR.mkdir(parents=True, exist_ok=True)
+    part = PARTIAL_DIR / f"{hashlib.sha256(url.encode()).hexdigest()}.part"
+    with _partial_locks_lock:
+        lock = _partial_locks.setdefault(part, threading.Lock())
+
+    with lock, timed("download", url=url) as info:
+        progress = Progress()
+        if segments > 1 and _download_segmented(url, part, segments, progress):
+            info["segments"] = segments
+            digest = None
+            if hash_type:
+                with timed("checksum", hash_type=hash_type):
+                    hash_func = hashlib.new(hash_type)
+                    _hash_file(part, hash_func)
+                    digest = hash_func.hexdigest()
+        else:
+            digest = _download_stream(url, part, hash_type, progress)
+
+        progress.report()
+        info["bytes"] = progress.done
+        info["throughput"] = progress.throughput
+        shutil.move(part, file_path)
+    return digest
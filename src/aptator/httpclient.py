@@ -0,0 +1,254 @@
+"""Shared HTTP client with per-host keep-alive connection pooling.
+
+All requests to the GitHub API and to asset hosts go through :func:`urlopen`. Idle connections (and thus their TCP and
+TLS sessions) are reused for subsequent requests to the same host, including requests that follow redirects (e.g.,
+from github.com to objects.githubusercontent.com). Failed connection attempts and temporary server errors are retried
+with exponential backoff. Responses and errors behave like the ones of :func:`urllib.request.urlopen`, i.e. HTTP error
+statuses raise :class:`urllib.error.HTTPError` and connection errors :class:`urllib.error.URLError`.
+
+Timeouts and retries are configured in the `[http]` section (`timeout`, `retries`).
+"""
+
+import functools
+import http.client
+import io
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urljoin, urlsplit
+
+from aptator import AptatorConfig
+
+USER_AGENT = "aptator"
+# seconds without data after which a connection is considered dead
+DEFAULT_TIMEOUT = 60
+# number of times a failed connection attempt or temporary server error is retried
+DEFAULT_RETRIES = 3
+# seconds to wait before the first retry; doubled for every further retry
+BACKOFF = 1.0
+RETRY_STATUS = {502, 503, 504}
+REDIRECT_STATUS = {301, 302, 303, 307, 308}
+MAX_REDIRECTS = 5
+# maximum number of idle connections kept per host
+MAX_IDLE_PER_HOST = 8
+# the unread rest of a response is read (instead of closing its connection) if it is not larger than this
+DRAIN_LIMIT = 64 * 1024
+
+
+class PooledResponse:
+    """An HTTP response whose connection is returned to the pool once the response has been read and closed.
+
+    All other attributes are the ones of the underlying :class:`http.client.HTTPResponse`.
+    """
+
+    def __init__(self, pool, key, conn, response, url):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.url = url
+        self.status = self.code = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def geturl(self) -> str:
+        return self.url
+
+    def getcode(self) -> int:
+        return self.status
+
+    def info(self):
+        return self.headers
+
+    def close(self) -> None:
+        conn, response = self._conn, self._response
+        if conn is None:
+            return
+        self._conn = None
+        try:
+            if not response.isclosed() and response.length is not None and response.length <= DRAIN_LIMIT:
+                response.read()
+        except (OSError, http.client.HTTPException):
+            pass
+        if response.isclosed() and not response.will_close:
+            self._pool.release(self._key, conn)
+        else:
+            response.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _proxy(scheme: str, host: str):
+    """Return the (parsed) proxy configured in the environment for the given scheme and host, or None."""
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(host):
+        return None
+    return urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+
+
+class ConnectionPool:
+    """Keep-alive connections to HTTP(S) hosts, keyed by scheme, host and port (thread-safe).
+
+    Args:
+        timeout: Socket timeout in seconds.
+        retries: Number of retries of failed connection attempts and temporary server errors (502, 503, 504).
+        max_idle: Maximum number of idle connections per host.
+    """
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES, max_idle=MAX_IDLE_PER_HOST):
+        self.timeout = timeout
+        self.retries = retries
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @functools.cached_property
+    def _context(self) -> ssl.SSLContext:
+        # loading the CA certificates takes a while, so the context is only created for the first HTTPS connection
+        return ssl.create_default_context()
+
+    def _connect(self, key):
+        scheme, host, port = key
+        proxy = _proxy(scheme, host)
+        if scheme == "https":
+            if proxy:
+                conn = http.client.HTTPSConnection(
+                    proxy.hostname, proxy.port or 80, timeout=self.timeout, context=self._context
+                )
+                conn.set_tunnel(host, port)
+                return conn
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self._context)
+        if proxy:
+            return http.client.HTTPConnection(proxy.hostname, proxy.port or 80, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def acquire(self, key):
+        """Return an idle connection to a host (or a new one) and whether it has been used before."""
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def release(self, key, conn) -> None:
+        """Return a connection whose last response has been read completely to the pool."""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _send(self, method: str, url: str, headers: dict, body: bytes | None) -> PooledResponse:
+        """Send a single request, retrying failed connection attempts and temporary server errors."""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise urllib.error.URLError(f"unsupported URL: {url}")
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        if parts.scheme == "http" and _proxy(parts.scheme, parts.hostname):
+            # requests through a plain HTTP proxy use the absolute URL as request target
+            target = url
+        else:
+            target = f"{parts.path or '/'}?{parts.query}" if parts.query else parts.path or "/"
+        headers = {"Host": parts.netloc, **headers}
+
+        attempt = 0
+        while True:
+            conn, reused = self.acquire(key)
+            try:
+                conn.request(method, target, body=body, headers=headers)
+                response = conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                if reused:
+                    # the server has closed the idle connection; retry immediately with another one
+                    continue
+                if attempt >= self.retries:
+                    raise urllib.error.URLError(e) from e
+            else:
+                pooled = PooledResponse(self, key, conn, response, url)
+                if response.status not in RETRY_STATUS or attempt >= self.retries:
+                    return pooled
+                pooled.close()
+            time.sleep(BACKOFF * 2**attempt)
+            attempt += 1
+
+    def request(self, method: str, url: str, headers: dict | None = None, body: bytes | None = None):
+        """Send a request and follow redirects.
+
+        The `Authorization` header is not sent to other hosts than the one of the original request.
+
+        Returns:
+            PooledResponse: The response, which has to be closed (e.g., by using it as a context manager).
+
+        Raises:
+            urllib.error.HTTPError: If the server returns an error status (or `304 Not Modified`).
+            urllib.error.URLError: If the server cannot be reached.
+        """
+        headers = {"User-Agent": USER_AGENT, **(headers or {})}
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._send(method, url, headers, body)
+            location = response.headers.get("Location")
+            if response.status in REDIRECT_STATUS and location:
+                response.close()
+                location = urljoin(url, location)
+                if response.status == 303 or (response.status in (301, 302) and method == "POST"):
+                    method, body = "GET", None
+                    headers = {k: v for k, v in headers.items() if k.lower() not in ("content-type", "content-length")}
+                if urlsplit(location).netloc != urlsplit(url).netloc:
+                    headers = {k: v for k, v in headers.items() if k.lower() != "authorization"}
+                url = location
+                continue
+            if response.status >= 400 or response.status == 304:
+                with response:
+                    error_body = response.read() if method != "HEAD" else b""
+                raise urllib.error.HTTPError(
+                    url, response.status, response.reason, response.headers, io.BytesIO(error_body)
+                )
+            return response
+        raise urllib.error.HTTPError(url, response.status, "Too many redirects", response.headers, None)
+
+
+@functools.cache
+def get_pool() -> ConnectionPool:
+    """Return the connection pool shared by all sources and actions."""
+    http_cfg = AptatorConfig.http
+    return ConnectionPool(
+        timeout=getattr(http_cfg, "timeout", DEFAULT_TIMEOUT), retries=getattr(http_cfg, "retries", DEFAULT_RETRIES)
+    )
+
+
+def urlopen(request, token: str | None = None) -> PooledResponse:
+    """Open a URL (or :class:`urllib.request.Request`) using the shared connection pool.
+
+    Args:
+        request: The URL or request (method, headers and data are used).
+        token: An optional token that is sent as `Authorization: Bearer` header.
+
+    Returns:
+        PooledResponse: The response, which has to be closed (e.g., by using it as a context manager).
+    """
+    if isinstance(request, str):
+        request = urllib.request.Request(request)
+    headers = dict(request.header_items())
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    return get_pool().request(request.get_method(), request.full_url, headers, request.data)
@@ -0,0 +1,429 @@
+"""Caching mirror of the GitHub API and of asset downloads for a fleet of aptator hosts (`aptator serve`).
+
+The mirror serves two URL spaces:
+
+- `/api/<path>`: GET requests to the release and tag endpoints of the GitHub API (`https://api.github.com/<path>`);
+  GraphQL queries (`POST /api/graphql`) are forwarded without caching, authenticated with the client's token;
+- `/download/<host>/<path>`: downloads of `https://<host>/<path>`, e.g. release assets.
+
+Clients use the mirror by setting `[github] api_url = "http://mirror:8080/api"` and `[download] mirror =
+"http://mirror:8080/download"`. Responses are stored on disk and revalidated upstream (using conditional requests) at
+most once per `[serve] ttl` seconds; stale responses are served if GitHub cannot be reached. Concurrent requests for
+the same URL wait for a single upstream request, while requests for different URLs are served concurrently. The store
+is bounded by `[serve] max_size` (MiB, default: 4096); the least recently used responses are evicted first.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from aptator import CACHE_HOME, AptatorConfig, write_atomic
+from aptator.httpclient import urlopen
+from aptator.source.github import GITHUB_API_URL, github_token
+
+MIRROR_DIR = CACHE_HOME / "mirror"
+DEFAULT_PORT = 8080
+# seconds after which a stored response is revalidated upstream
+DEFAULT_TTL = 600
+DEFAULT_MAX_SIZE = 4096 * 1024 * 1024
+CHUNK_SIZE = 256 * 1024
+# hosts that may be downloaded from, in addition to the hosts of the `url`s of the configured packages
+GITHUB_HOSTS = {
+    "api.github.com",
+    "github.com",
+    "codeload.github.com",
+    "objects.githubusercontent.com",
+    "release-assets.githubusercontent.com",
+}
+# the paths of the GitHub API that are mirrored: the release and tag lookups of aptator and the tarballs of tags; all
+# other endpoints (e.g., /user) are not served, since the mirror's token is used for the upstream requests
+API_PATH = re.compile(
+    r"/repos/[\w-]+/(?!\.\.?/)[\w.-]+/(?:releases(?:/latest|/tags/[^/]+)?|tags|tarball/refs/tags/[^/]+)"
+)
+# response headers that are stored together with a response
+STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+
+class Mirror:
+    """The on-disk store of the mirror.
+
+    Every upstream URL is stored as `<sha256(url)>.body` together with its metadata (`<sha256(url)>.json`).
+    """
+
+    def __init__(
+        self,
+        path: Path = MIRROR_DIR,
+        ttl: float = DEFAULT_TTL,
+        allowed_hosts=GITHUB_HOSTS,
+        max_size: int = DEFAULT_MAX_SIZE,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.allowed_hosts = set(allowed_hosts)
+        self.max_size = max_size
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        path.mkdir(parents=True, exist_ok=True)
+
+    def upstream_url(self, path: str) -> str | None:
+        """Return the upstream URL of a request path, or None if the path is not mirrored."""
+        if path.startswith("/api/"):
+            url = GITHUB_API_URL + path[len("/api") :]
+        elif path.startswith("/download/"):
+            url = "https://" + path[len("/download/") :]
+            if urlsplit(url).hostname not in self.allowed_hosts:
+                return None
+        else:
+            return None
+        parts = urlsplit(url)
+        if parts.hostname == urlsplit(GITHUB_API_URL).hostname and not API_PATH.fullmatch(parts.path):
+            return None
+        return url
+
+    def lock(self, url: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def _files(self, url: str) -> tuple[Path, Path]:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.path / f"{key}.body", self.path / f"{key}.json"
+
+    def load(self, url: str) -> dict | None:
+        """Return the metadata of a stored response, or None."""
+        body, meta = self._files(url)
+        try:
+            return json.loads(meta.read_text()) if body.exists() else None
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, meta: dict | None) -> bool:
+        return meta is not None and time.time() - meta["fetched"] < self.ttl
+
+    def body(self, url: str) -> Path:
+        return self._files(url)[0]
+
+    def save(self, url: str, meta: dict, body: Path | None = None) -> None:
+        """Store the metadata (and the body, which is moved into the store) of a response."""
+        body_path, meta_path = self._files(url)
+        if body:
+            body.replace(body_path)
+        write_atomic(meta_path, json.dumps(meta))
+
+    def temp_body(self, url: str) -> Path:
+        body = self._files(url)[0]
+        return body.with_name(f"{body.name}.{threading.get_ident()}.tmp")
+
+    def prune(self, keep: str | None = None) -> int:
+        """Evict the least recently used responses until the store is not larger than `max_size` bytes.
+
+        Args:
+            keep: The URL of a response that must not be evicted (e.g., the one that has just been stored).
+
+        Returns:
+            int: The number of evicted responses.
+        """
+        keep_body = self.body(keep) if keep else None
+        with self._prune_lock:
+            entries = []
+            for body in self.path.glob("*.body"):
+                try:
+                    stat = body.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, body, stat.st_size))
+            total = sum(size for _, _, size in entries)
+            removed = 0
+            for _, body, size in sorted(entries):
+                if total <= self.max_size:
+                    break
+                if body == keep_body:
+                    continue
+                body.with_suffix(".json").unlink(missing_ok=True)
+                body.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+        return removed
+
+
+class MirrorRequestHandler(BaseHTTPRequestHandler):
+    """Serve mirrored responses, fetching (and streaming) them from upstream if required."""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "aptator-mirror"
+    mirror = None
+
+    def log_message(self, format, *args):  # noqa: A002
+        print(f"{self.address_string()} {format % args}", file=sys.stderr)
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_POST(self):
+        """Forward GraphQL queries to GitHub (without caching), authenticated with the token of the client."""
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path != "/api/graphql":
+            self.send_error(404)
+            return
+        # the documents are supplied by the client, so the mirror's own token must never be used for them
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not token:
+            self.send_error(401, "GraphQL queries require the client's GitHub token")
+            return
+        request = urllib.request.Request(
+            GITHUB_API_URL + "/graphql", data=body, headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urlopen(request, token=token) as response:
+                status, headers, data = response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            status, headers, data = e.code, e.headers, e.read()
+        except urllib.error.URLError as e:
+            self.send_error(502, str(e.reason))
+            return
+        self._send_body(status, {"Content-Type": headers.get("Content-Type", "application/json")}, data)
+
+    def _send_body(self, status: int, headers: dict, data: bytes, head: bool = False) -> None:
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(data)
+
+    def _serve(self, head: bool) -> None:
+        url = self.mirror.upstream_url(self.path)
+        if not url:
+            self.send_error(404)
+            return
+
+        meta = self.mirror.load(url)
+        if not self.mirror.is_fresh(meta):
+            if head and meta is None:
+                # do not block HEAD requests (e.g., of download clients) until an uncached asset has been fetched
+                self._forward_head(url)
+                return
+            with self.mirror.lock(url):
+                meta = self.mirror.load(url)
+                if not self.mirror.is_fresh(meta):
+                    meta = self._fetch(url, meta, head)
+                    if meta is None:
+                        # the response has already been sent
+                        return
+        self._send_stored(url, meta, head)
+
+    def _forward_head(self, url: str) -> None:
+        try:
+            with urlopen(urllib.request.Request(url, method="HEAD")) as response:
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as e:
+            status, headers = e.code, e.headers
+        except urllib.error.URLError as e:
+            self.send_error(502, str(e.reason))
+            return
+        self.send_response(status)
+        for name in (*STORED_HEADERS, "Content-Length"):
+            if headers.get(name):
+                self.send_header(name, headers[name])
+        # range requests are only supported for stored responses
+        self.send_header("Accept-Ranges", "none")
+        self.end_headers()
+
+    def _fetch(self, url: str, stale: dict | None, head: bool) -> dict | None:
+        """Fetch (or revalidate) a response from upstream.
+
+        A new response is streamed to the client while it is stored.
+
+        Returns:
+            dict | None: The metadata of the stored response to send, or None if the response has already been sent.
+        """
+        request = urllib.request.Request(url)
+        if stale:
+            if stale["headers"].get("ETag"):
+                request.add_header("If-None-Match", stale["headers"]["ETag"])
+            if stale["headers"].get("Last-Modified"):
+                request.add_header("If-Modified-Since", stale["headers"]["Last-Modified"])
+        # only the endpoints of API_PATH reach this point (see `Mirror.upstream_url`)
+        token = github_token() if url.startswith(GITHUB_API_URL + "/") else None
+
+        try:
+            response = urlopen(request, token=token)
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and stale:
+                stale["fetched"] = time.time()
+                self.mirror.save(url, stale)
+                return stale
+            if stale and e.code >= 500:
+                return stale
+            self._send_body(e.code, {"Content-Type": e.headers.get("Content-Type", "text/plain")}, e.read(), head)
+            return None
+        except urllib.error.URLError as e:
+            if stale:
+                # serve the stale response while GitHub cannot be reached
+                return stale
+            self.send_error(502, str(e.reason))
+            return None
+
+        meta = {
+            "url": url,
+            "headers": {name: response.headers[name] for name in STORED_HEADERS if response.headers.get(name)},
+            "fetched": time.time(),
+        }
+        with response:
+            self._store(url, meta, response, head)
+        self.mirror.prune(keep=url)
+        return meta if head else None
+
+    def _store(self, url: str, meta: dict, response, head: bool) -> None:
+        """Store an upstream response and stream it to the client (unless `head` is set)."""
+        temp = self.mirror.temp_body(url)
+        with temp.open("wb") as f:
+            client = not head
+            if client:
+                self.send_response(200)
+                for name, value in meta["headers"].items():
+                    self.send_header(name, value)
+                if response.headers.get("Content-Length"):
+                    self.send_header("Content-Length", response.headers["Content-Length"])
+                else:
+                    self.send_header("Connection", "close")
+                    self.close_connection = True
+                self.end_headers()
+            try:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                    f.write(chunk)
+                    if client:
+                        try:
+                            self.wfile.write(chunk)
+                        except OSError:
+                            # the client went away; finish storing the response anyway
+                            client = False
+            except BaseException:
+                self.close_connection = True
+                temp.unlink(missing_ok=True)
+                raise
+        self.mirror.save(url, meta, temp)
+
+    def _send_stored(self, url: str, meta: dict, head: bool) -> None:
+        """Send a stored response, answering conditional and range requests."""
+        headers = meta["headers"]
+        etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        if_none_match = self.headers.get("If-None-Match")
+        if (etag and if_none_match == etag) or (
+            not if_none_match and last_modified and self.headers.get("If-Modified-Since") == last_modified
+        ):
+            self.send_response(304)
+            for name in ("ETag", "Last-Modified"):
+                if headers.get(name):
+                    self.send_header(name, headers[name])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        try:
+            # the open file remains readable even if the response is evicted concurrently
+            f = self.mirror.body(url).open("rb")
+        except FileNotFoundError:
+            self.send_error(503, "The response has just been evicted, please retry")
+            return
+        with f:
+            # the modification time of a response records its last use
+            os.utime(f.fileno())
+            self._send_file(f, headers, etag or last_modified, head)
+
+    def _send_file(self, f, headers: dict, validator: str | None, head: bool) -> None:
+        size = os.fstat(f.fileno()).st_size
+        start, end = 0, size - 1
+        status = 200
+        byte_range = self._range(size, validator)
+        if byte_range:
+            (start, end), status = byte_range, 206
+        elif byte_range is not None:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if not head and end >= start:
+            self.wfile.flush()
+            self.connection.sendfile(f, start, end - start + 1)
+
+    def _range(self, size: int, validator: str | None):
+        """Parse the `Range` header of the request.
+
+        Returns:
+            None if the complete response is to be sent, (start, end) for a satisfiable range, and () otherwise.
+        """
+        header = self.headers.get("Range", "")
+        if_range = self.headers.get("If-Range")
+        if not header.startswith("bytes=") or "," in header or (if_range and if_range != validator):
+            return None
+        first, _, last = header[len("bytes=") :].partition("-")
+        try:
+            if first:
+                start, end = int(first), min(int(last), size - 1) if last else size - 1
+            else:
+                start, end = max(0, size - int(last)), size - 1
+        except ValueError:
+            return None
+        return (start, end) if start <= end else ()
+
+
+def allowed_hosts(packages) -> set:
+    """Return the hosts that the mirror may download from."""
+    hosts = set(GITHUB_HOSTS)
+    for pkg in packages:
+        action = pkg.get("action", {})
+        if isinstance(action, dict) and action.get("url"):
+            hosts.add(urlsplit(action["url"]).hostname)
+    return hosts
+
+
+def serve(packages, bind: str = "127.0.0.1", port: int = DEFAULT_PORT) -> None:
+    """Run the mirror until interrupted.
+
+    Args:
+        packages: The package configurations; downloads from the hosts of their `url`s are permitted.
+        bind: The address to listen on.
+        port: The port to listen on.
+    """
+    serve_cfg = AptatorConfig.serve
+    max_size_mib = getattr(serve_cfg, "max_size", None)
+    mirror = Mirror(
+        Path(getattr(serve_cfg, "path", MIRROR_DIR)),
+        getattr(serve_cfg, "ttl", DEFAULT_TTL),
+        allowed_hosts(packages),
+        max_size_mib * 1024 * 1024 if max_size_mib is not None else DEFAULT_MAX_SIZE,
+    )
+    # remove responses that were incomplete when the mirror stopped
+    for temp in mirror.path.glob("*.tmp"):
+        temp.unlink(missing_ok=True)
+    mirror.prune()
+
+    handler = type("Handler", (MirrorRequestHandler,), {"mirror": mirror})
+    with ThreadingHTTPServer((bind, port), handler) as server:
+        server.daemon_threads = True
+        print(f"Serving the aptator mirror on http://{bind}:{port}/ (API: /api, downloads: /download)")
+        server.serve_forever()
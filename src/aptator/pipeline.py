@@ -0,0 +1,507 @@
+"""Pipelined check -> download -> install execution of package updates.
+
+Updates pass through three stages that are connected by bounded queues:
+
+1. check: the latest release of every package is resolved concurrently;
+2. download: the artifacts of outdated packages are downloaded and verified concurrently;
+3. install: a single consumer installs the artifacts, since installations need the dpkg lock and sudo.
+
+Package N+1 is therefore downloaded while package N is installed. Updates of batch action types (deb-install) are
+held back until all downloads have finished and are then installed together, i.e. in a single dpkg transaction. The
+output of every package and stage is buffered and printed as one block, and an error only affects the package that
+caused it.
+"""
+
+import contextlib
+import importlib
+import queue
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from aptator.cache import deferred_eviction
+from aptator.report import package_context, report, timed
+from aptator.retention import EXTRACT_ACTIONS, is_held, prune_versions
+from aptator.source.github import GitHub
+from aptator.source.graphql import resolve_latest
+from aptator.state import batch_writes, get_installed_version, record_install, run_lock, set_last_checked
+from aptator.tools import buffered_output
+
+
+class Update:
+    """A package for which a newer (or forced) release has been found."""
+
+    def __init__(self, cfg, gh, downloadable, release_version):
+        self.cfg = cfg
+        self.name = cfg["name"]
+        self.gh = gh
+        self.downloadable = downloadable
+        self.release_version = release_version
+        action = cfg.get("action", {})
+        self.action = action if isinstance(action, dict) else {}
+        self.action_type = self.action.get("type")
+
+
+def resolve_release(cfg, prefetched=None):
+    """Resolve the latest release (or tag, for `use_tag` packages) of a package.
+
+    Args:
+        cfg: The package configuration.
+        prefetched: API documents resolved in advance (see :func:`aptator.source.graphql.resolve_latest`), or None.
+
+    Returns:
+        tuple | None: The (GitHub source, Downloadable, release version), or None if no matching release was found.
+    """
+    asset_re = re.compile(cfg["asset_pattern"])
+    asset_version_re = re.compile(cfg.get("asset_version_pattern", "(.*)"))
+    gh = GitHub(cfg["repo"], asset_version_re, asset_re, prefetched)
+
+    if cfg.get("use_tag", False):
+        downloadable = gh.get_latest_tag()
+        if not downloadable:
+            print("No tag found...")
+            return None
+        release_version = (
+            asset_version_re.search(downloadable.data["name"]).group(1)
+            if asset_version_re.search(downloadable.data["name"])
+            else downloadable.data["name"]
+        )
+    else:
+        downloadable = gh.get_latest_release_asset(allow_prerelease=cfg.get("prerelease", False))
+        if not downloadable:
+            print("No release asset found...")
+            return None
+        release_version = gh.get_asset_version(downloadable.data)
+
+    print("... Latest release:", release_version or "none")
+    print()
+    return gh, downloadable, release_version
+
+
+def check_package(cfg, installed_version, force_packages, prefetched=None):
+    """Resolve the latest release of a package and decide whether it needs to be updated.
+
+    Args:
+        cfg: The package configuration.
+        installed_version: The currently installed version, or None.
+        force_packages: Names of packages that should be reinstalled regardless of their version.
+        prefetched: API documents resolved in advance (see :func:`resolve_release`), or None.
+
+    Returns:
+        Update | None: The pending update, or None if the package is up to date.
+    """
+    name = cfg["name"]
+    print(f"Checking {name} ({cfg['repo']})")
+    print("... Installed version:", installed_version)
+
+    # Get latest release or tag from GitHub
+    resolved = resolve_release(cfg, prefetched)
+    if not resolved:
+        return None
+    gh, downloadable, release_version = resolved
+
+    # skip packages that have already the latest version installed
+    if installed_version == release_version and name not in force_packages:
+        return None
+    if is_held(name, release_version, name in force_packages):
+        return None
+
+    if name in force_packages:
+        print(f"...Forcing reinstallation of {name} with version {release_version}")
+    else:
+        print(f"...Updating {name} to version {release_version}")
+    return Update(cfg, gh, downloadable, release_version)
+
+
+class ActionHandler:
+    """The download and install steps of an action type.
+
+    Args:
+        download: Callable(update) that returns the artifact required for the installation (e.g., the downloaded
+            file), or None if the action does not download anything.
+        install: Callable(update, artifact) that installs the update. For batch handlers, Callable(items) that
+            installs a list of (update, artifact) pairs at once and returns the successfully installed updates.
+        batch: Whether the install stage may combine several updates into a single installation.
+        stage: Callable(update, artifact) that prepares the installation as far as possible without changing the
+            installed version (see :mod:`aptator.staging`) and returns the artifact to install later, or None if the
+            downloaded artifact is installed as it is.
+    """
+
+    def __init__(self, download, install, batch=False, stage=None):
+        self.download = download
+        self.install = install
+        self.batch = batch
+        self.stage = stage
+
+
+class StagedTree:
+    """An archive that has been extracted next to its final location in advance and only has to be moved there."""
+
+    def __init__(self, path):
+        self.path = path
+
+
+def _action(name):
+    """Return a function of an action module, which is only imported once an action of its type is run.
+
+    Args:
+        name: The module (relative to :mod:`aptator.actions`) and the function, e.g. `"deb.install_debs"`.
+    """
+    module, _, function = name.rpartition(".")
+    return getattr(importlib.import_module(f"aptator.actions.{module}"), function)
+
+
+def _targets(update):
+    """Return the directory to extract to and the symlink to create for extract actions."""
+    extract_to = update.action.get("extract_to")
+    link_to = update.action.get("link_to")
+    if not (extract_to and link_to):
+        raise ValueError("extract_to and link_to must be specified.")
+    # normalized (e.g., without a trailing slash of `extract_to`), as the paths are matched by :func:`prune_versions`
+    return str(Path(extract_to) / f"{update.name}-{update.release_version}"), link_to
+
+
+def _download_asset(update):
+    path = update.gh.download(update.downloadable)
+    if not path:
+        raise ValueError("checksum verification failed.")
+    return path
+
+
+def _install_debs(items):
+    installed = _action("deb.install_debs")([path for _, path in items])
+    return [update for update, path in items if path in installed]
+
+
+def _exec(update, _):
+    command = update.action.get("command")
+    if not command:
+        raise ValueError("no command specified.")
+    _action("exec.exec_command")(command)
+
+
+def _download_extract_asset(update):
+    _targets(update)
+    return _download_asset(update)
+
+
+def _extract_and_link(update, path):
+    extract_to, link_to = _targets(update)
+    if isinstance(path, StagedTree):
+        _action("extract_and_link.install_staged")(path.path, extract_to, link_to)
+        return
+    incremental = update.action.get("incremental", False)
+    _action("extract_and_link.extract_and_link")(str(path), extract_to, link_to, incremental=incremental)
+
+
+def _download_archive(update):
+    _targets(update)
+    if update.action.get("stream", False):
+        # streamed archives are extracted directly from the HTTP response by the install step
+        return None
+    return _action("download_extract_and_link.download_archive")(update.action.get("url"))
+
+
+def _extract_archive_and_link(update, path):
+    extract_to, link_to = _targets(update)
+    incremental = update.action.get("incremental", False)
+    if isinstance(path, StagedTree):
+        _action("extract_and_link.install_staged")(path.path, extract_to, link_to)
+    elif path is None:
+        _action("download_extract_and_link.download_extract_and_link")(
+            update.action.get("url"), extract_to, link_to, stream=True, incremental=incremental
+        )
+    else:
+        _action("download_extract_and_link.extract_archive_and_link")(path, extract_to, link_to, incremental)
+
+
+def _stage_tree(update, path):
+    extract_to, link_to = _targets(update)
+    if path is None:
+        # streamed archives are downloaded, since they are not extracted by the install step
+        path = _action("download_extract_and_link.download_archive")(update.action.get("url"))
+    staged = Path(extract_to).with_name(f".{Path(extract_to).name}.staged")
+    incremental = update.action.get("incremental", False)
+    _action("extract_and_link.extract_staged")(str(path), staged, link_to, incremental=incremental)
+    return StagedTree(str(staged))
+
+
+ACTIONS = {
+    "deb-install": ActionHandler(_download_asset, _install_debs, batch=True),
+    "exec": ActionHandler(None, _exec),
+    "extract-and-link": ActionHandler(_download_extract_asset, _extract_and_link, stage=_stage_tree),
+    "download-extract-and-link": ActionHandler(_download_archive, _extract_archive_and_link, stage=_stage_tree),
+}
+
+
+def _handler(update):
+    handler = ACTIONS.get(update.action_type)
+    if not handler:
+        raise ValueError(f"unsupported action type: {update.action_type}")
+    return handler
+
+
+def _installed_path(update, artifact):
+    """Return the file or directory installed by an update, as recorded in the install history."""
+    if update.action_type in EXTRACT_ACTIONS:
+        return _targets(update)[0]
+    return str(artifact) if artifact else None
+
+
+def _installed(update, artifact):
+    # the digest is only known for release assets, not for the `url` of download-extract-and-link actions
+    digest = update.downloadable.get_digest() if update.action_type != "download-extract-and-link" else None
+    with package_context(update.name):
+        with timed("state"):
+            record_install(
+                update.name,
+                update.release_version,
+                action=update.action_type,
+                path=_installed_path(update, artifact),
+                digest=digest,
+            )
+        report.set_status(update.name, "updated")
+        keep = update.cfg.get("keep")
+        if keep and update.action_type in EXTRACT_ACTIONS:
+            try:
+                with timed("retention"):
+                    prune_versions(update.name, _targets(update)[0], update.action["extract_to"], keep)
+            except Exception as e:
+                print(f"Error removing old versions of {update.name}: {e}", file=sys.stderr)
+    print(f"{update.name} updated successfully.")
+
+
+def _failed(update):
+    report.set_status(update.name, "failed")
+
+
+def download_update(update):
+    """Run the download step of an update's action.
+
+    Returns:
+        The artifact to pass to :func:`install_updates`.
+    """
+    handler = _handler(update)
+    if not handler.download:
+        return None
+    print(f"Downloading {update.name} {update.release_version}")
+    return handler.download(update)
+
+
+def stage_update(update, artifact):
+    """Run the stage step of an update's action (see :class:`ActionHandler`).
+
+    Returns:
+        The artifact to pass to :func:`install_updates` later.
+    """
+    handler = _handler(update)
+    return handler.stage(update, artifact) if handler.stage else artifact
+
+
+def install_updates(items):
+    """Run the install step for a list of downloaded (update, artifact) pairs.
+
+    Updates of batch action types (e.g., deb-install) are installed together. Errors are reported per package.
+
+    Returns:
+        list[Update]: The successfully installed updates.
+    """
+    installed_updates = []
+    batches = {}
+    for update, artifact in items:
+        handler = _handler(update)
+        if handler.batch:
+            batches.setdefault(handler, []).append((update, artifact))
+            continue
+        try:
+            with package_context(update.name), timed("install", action=update.action_type):
+                handler.install(update, artifact)
+        except Exception as e:
+            print(f"Error processing {update.name}: {e}", file=sys.stderr)
+            _failed(update)
+        else:
+            _installed(update, artifact)
+            installed_updates.append(update)
+
+    for handler, batch in batches.items():
+        print(f"Installing {', '.join(update.name for update, _ in batch)}")
+        try:
+            names = [update.name for update, _ in batch]
+            with timed("install", action=batch[0][0].action_type, packages=names):
+                installed = handler.install(batch)
+        except Exception as e:
+            print(f"Error installing {', '.join(update.name for update, _ in batch)}: {e}", file=sys.stderr)
+            installed = []
+        for update, artifact in batch:
+            if update in installed:
+                _installed(update, artifact)
+                installed_updates.append(update)
+            else:
+                print(f"{update.name} update failed.")
+                _failed(update)
+    return installed_updates
+
+
+def _check_stage(cfg, force_packages, prefetched):
+    """Check stage (worker thread): resolve the latest release of a package."""
+    with buffered_output() as output, package_context(cfg["name"]):
+        try:
+            with timed("lookup"):
+                update = check_package(cfg, get_installed_version(cfg["name"]), force_packages, prefetched)
+        except Exception as e:
+            print(f"Error processing {cfg.get('name')}: {e}", file=sys.stderr)
+            report.set_status(cfg["name"], "failed")
+            return output, None
+        with timed("state"):
+            set_last_checked(cfg["name"], time.time())
+        if not update:
+            report.set_status(cfg["name"], "up-to-date")
+        return output, update
+
+
+def _download_stage(update, install_queue):
+    """Download stage (worker thread): fetch the artifact of an update and pass it on to the install stage."""
+    with buffered_output() as output, package_context(update.name):
+        try:
+            item = (update, download_update(update))
+        except Exception as e:
+            print(f"Error processing {update.name}: {e}", file=sys.stderr)
+            report.set_status(update.name, "failed")
+            item = None
+    install_queue.put((output, item))
+
+
+def _install_stage(install_queue, install):
+    """Install stage (single consumer): install the downloaded updates until the queue is closed.
+
+    Updates of batch action types are held back until the queue is closed and then installed with a single call. An
+    error of `install` fails the updates of its call that have not been installed, and the stage goes on with the next
+    downloads, so that the producers are never blocked on a full queue.
+    """
+    held = []
+    closed = False
+    while not closed:
+        entries = [install_queue.get()]
+        # greedily combine all downloads that are already available
+        while entries[-1] is not None:
+            try:
+                entries.append(install_queue.get_nowait())
+            except queue.Empty:
+                break
+        closed = entries[-1] is None
+
+        items = []
+        for output, item in filter(None, entries):
+            output.replay()
+            if item:
+                handler = ACTIONS.get(item[0].action_type)
+                (held if handler and handler.batch else items).append(item)
+        if closed:
+            items.extend(held)
+        if items:
+            _install_batch(items, install)
+
+
+def _install_batch(items, install):
+    with buffered_output() as output:
+        try:
+            install(items)
+        except Exception as e:
+            print(f"Error installing {', '.join(update.name for update, _ in items)}: {e}", file=sys.stderr)
+            for update, _ in items:
+                if report.status.get(update.name) not in ("updated", "staged"):
+                    _failed(update)
+    output.replay()
+
+
+def _drain(install_queue, feeder):
+    """Discard the downloads of a stopped install stage until the feeder has finished."""
+    while feeder.is_alive() or not install_queue.empty():
+        with contextlib.suppress(queue.Empty):
+            install_queue.get(timeout=0.1)
+
+
+def run_pipeline(packages, force_packages, jobs=8, download_jobs=4, install=install_updates):
+    """Check, download and install updates for all packages in a pipeline.
+
+    Overlapping runs of other aptator processes are waited for, and the state updates of the run are committed at its
+    end.
+
+    Args:
+        packages: The package configurations.
+        force_packages: Names of packages that should be reinstalled regardless of their version.
+        jobs: Number of concurrent checks.
+        download_jobs: Number of concurrent downloads; also bounds the number of downloads waiting for installation.
+        install: Callable(items) that installs a list of downloaded (update, artifact) pairs, e.g.
+            :func:`aptator.staging.stage_updates` to stage them instead.
+    """
+
+    def check(submit):
+        # resolve the latest releases of all packages with a few batched GraphQL queries (if a token is available)
+        prefetched = resolve_latest(packages)
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as checks:
+            futures = [checks.submit(_check_stage, pkg, force_packages, prefetched) for pkg in packages]
+            # report the checks in configuration order
+            for future in futures:
+                output, update = future.result()
+                output.replay()
+                if update:
+                    submit(update)
+
+    _run(check, download_jobs, install)
+
+
+def install_resolved(updates, download_jobs=4):
+    """Download and install updates whose releases have already been resolved (e.g., from a plan) in a pipeline.
+
+    Args:
+        updates: The updates to install.
+        download_jobs: Number of concurrent downloads.
+    """
+
+    def feed(submit):
+        for update in updates:
+            submit(update)
+
+    _run(feed, download_jobs, install_updates)
+
+
+def _run(produce, download_jobs, install):
+    """Run the download and install stages for the updates that `produce(submit)` passes to `submit`."""
+    # downloaded files are evicted from the cache only after they have been installed
+    with run_lock(), batch_writes(), deferred_eviction():
+        install_queue = queue.Queue(maxsize=max(1, download_jobs))
+        stopped = threading.Event()
+        errors = []
+
+        def download(update):
+            # downloads that have not been started are skipped once the install stage has stopped
+            if not stopped.is_set():
+                _download_stage(update, install_queue)
+
+        def feed():
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, download_jobs)) as downloads:
+                    produce(lambda update: None if stopped.is_set() else downloads.submit(download, update))
+            except BaseException as e:
+                # re-raised by the main thread, e.g. a failed check stage must not end the run successfully
+                errors.append(e)
+            finally:
+                install_queue.put(None)
+
+        feeder = threading.Thread(target=feed, name="aptator-feeder")
+        feeder.start()
+        try:
+            _install_stage(install_queue, install)
+        except BaseException:
+            # e.g., KeyboardInterrupt: unblock the producers, which wait for free space in the queue
+            stopped.set()
+            _drain(install_queue, feeder)
+            raise
+        finally:
+            feeder.join()
+        if errors:
+            raise errors[0]
@@ -0,0 +1,170 @@
+"""Update plans: resolve the releases of all packages once and install them later, possibly on many hosts.
+
+`aptator plan PLAN` resolves the latest release of every package concurrently and writes a JSON plan with, per
+package, the installed and the latest version and the chosen asset (URL and digest). `aptator apply PLAN` installs the
+planned releases without using the GitHub API. Whether and how a package is updated is decided by the configuration and
+the state of the host the plan is applied on, so that a plan created once can be applied to a whole fleet; the plan
+does not contain any configuration (e.g., actions or paths).
+"""
+
+import json
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from aptator.pipeline import Update, install_resolved, resolve_release
+from aptator.report import package_context, report, timed
+from aptator.retention import is_held
+from aptator.source.github import Asset, GitHub, Tag
+from aptator.source.graphql import resolve_latest
+from aptator.state import get_installed_version
+from aptator.tools import buffered_output
+
+PLAN_VERSION = 1
+
+
+def _plan_package(cfg, force_packages, prefetched):
+    """Resolve the latest release of a package (worker thread) and return the buffered output and the plan entry."""
+    name = cfg["name"]
+    entry = {"name": name, "installed_version": get_installed_version(name), "force": name in force_packages}
+    with buffered_output() as output, package_context(name):
+        print(f"Checking {name} ({cfg['repo']})")
+        print("... Installed version:", entry["installed_version"])
+        try:
+            with timed("lookup"):
+                resolved = resolve_release(cfg, prefetched)
+        except Exception as e:
+            print(f"Error processing {name}: {e}", file=sys.stderr)
+            report.set_status(name, "failed")
+            return output, {**entry, "error": str(e)}
+    if not resolved:
+        return output, entry
+
+    _, downloadable, release_version = resolved
+    if not entry["force"] and entry["installed_version"] == release_version:
+        report.set_status(name, "up-to-date")
+    return output, plan_entry(cfg, downloadable, release_version, entry["installed_version"], entry["force"])
+
+
+def plan_entry(cfg, downloadable, release_version, installed_version, force=False) -> dict:
+    """Return the plan entry of a resolved release (see :func:`update_from_entry` for the reverse direction)."""
+    return {
+        "name": cfg["name"],
+        "installed_version": installed_version,
+        "force": force,
+        "latest_version": release_version,
+        "update": force or installed_version != release_version,
+        "asset": {
+            "type": "tag" if isinstance(downloadable, Tag) else "asset",
+            "name": downloadable.data["name"],
+            "url": downloadable.get_download_url(),
+            "digest": downloadable.get_digest(),
+        },
+    }
+
+
+def create_plan(packages, force_packages, jobs=8):
+    """Resolve the latest releases of all packages concurrently.
+
+    Args:
+        packages: The package configurations.
+        force_packages: Names of packages that are reinstalled by `apply` regardless of their installed version.
+        jobs: Number of concurrent checks.
+
+    Returns:
+        dict: The plan (see :func:`write_plan`).
+    """
+    prefetched = resolve_latest(packages)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as checks:
+        futures = [checks.submit(_plan_package, pkg, force_packages, prefetched) for pkg in packages]
+        entries = []
+        for future in futures:
+            output, entry = future.result()
+            output.replay()
+            entries.append(entry)
+    return {"version": PLAN_VERSION, "created": time.time(), "packages": entries}
+
+
+def write_plan(plan, path) -> None:
+    """Write a plan as JSON and print the packages it updates."""
+    Path(path).write_text(json.dumps(plan, indent=2) + "\n")
+    updates = [entry for entry in plan["packages"] if entry.get("update")]
+    print(f"Plan written to {path}: {len(updates)} of {len(plan['packages'])} packages to update.")
+    for entry in updates:
+        print(f"  {entry['name']}: {entry['installed_version']} -> {entry['latest_version']}")
+
+
+def load_plan(path) -> dict:
+    """Read a plan written by :func:`write_plan`.
+
+    Raises:
+        ValueError: If the file is not a plan of a supported version.
+    """
+    plan = json.loads(Path(path).read_text())
+    if not isinstance(plan, dict) or plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"{path} is not an aptator plan (version {PLAN_VERSION}).")
+    return plan
+
+
+def update_from_entry(entry, packages):
+    """Return the update of a plan entry, which is installed without requesting the GitHub API.
+
+    Args:
+        entry: The plan entry.
+        packages: The package configurations of this host; the entry is installed as configured there.
+
+    Raises:
+        ValueError: If the package is not configured or the planned asset does not match its `asset_pattern`.
+    """
+    cfg = next((pkg for pkg in packages if pkg["name"] == entry["name"]), None)
+    if cfg is None:
+        raise ValueError(f"package {entry['name']} is not configured.")
+    asset = entry["asset"]
+    if asset["type"] == "tag":
+        downloadable = Tag({"name": asset["name"], "tarball_url": asset["url"]})
+    else:
+        if not re.search(cfg["asset_pattern"], asset["name"]):
+            raise ValueError(f"the planned asset {asset['name']} does not match the asset_pattern of {cfg['name']}.")
+        downloadable = Asset({"name": asset["name"], "browser_download_url": asset["url"], "digest": asset["digest"]})
+    gh = GitHub(cfg["repo"], cfg.get("asset_version_pattern", "(.*)"), cfg["asset_pattern"])
+    return Update(cfg, gh, downloadable, entry["latest_version"])
+
+
+def apply_plan(plan, packages, download_jobs=4):
+    """Download and install the planned releases that are not installed on this host, without using the GitHub API.
+
+    Entries of packages that are not configured on this host are refused.
+
+    Args:
+        plan: The plan (see :func:`load_plan`).
+        packages: The package configurations of this host.
+        download_jobs: Number of concurrent downloads.
+    """
+    updates = []
+    for entry in plan["packages"]:
+        name = entry["name"]
+        if "asset" not in entry:
+            print(f"{name}: no release has been resolved, skipping.")
+            continue
+        installed_version = get_installed_version(name)
+        if installed_version == entry["latest_version"] and not entry["force"]:
+            report.set_status(name, "up-to-date")
+            continue
+        if is_held(name, entry["latest_version"], entry["force"]):
+            report.set_status(name, "up-to-date")
+            continue
+        try:
+            update = update_from_entry(entry, packages)
+        except ValueError as e:
+            print(f"Error applying the plan entry of {name}: {e}", file=sys.stderr)
+            report.set_status(name, "failed")
+            continue
+        print(f"{name}: {installed_version} -> {entry['latest_version']}")
+        updates.append(update)
+
+    if not updates:
+        print("All packages are up to date.")
+        return
+    install_resolved(updates, download_jobs=download_jobs)
@@ -0,0 +1,164 @@
+"""Declarative plans of privileged filesystem operations.
+
+Instead of spawning a `sudo` process for every filesystem step, actions describe the required operations in a
+:class:`FsPlan`, which is executed by a single privileged helper process (`sudo python -I -m aptator.privileged PLAN`).
+An archive to extract may be streamed to the helper's standard input. The helper runs in isolated mode (`-I`), i.e.
+neither the current directory nor `PYTHONPATH` or the user's site-packages are searched for modules, so aptator must be
+installed for the interpreter that runs it (e.g., by pipx).
+
+Setting `[paths] sudo` to a command that just executes its arguments (e.g., `/usr/bin/env`) runs the helper without
+privileges, e.g. to test actions against a temporary root directory.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from aptator import AptatorConfig
+from aptator.report import timed
+
+
+class FsPlan:
+    """A list of filesystem operations that is executed by one privileged helper invocation."""
+
+    def __init__(self):
+        self.operations = []
+
+    def extract(self, extract_to, archive=None, previous=None):
+        """Extract an archive to `extract_to` (see :func:`aptator.actions.extract.extract_archive`).
+
+        The number of writer threads and whether the extracted files are flushed to disk are configured by `[extract]
+        workers` and `[extract] fsync`.
+
+        Args:
+            extract_to: Final path for the extracted directory.
+            archive: Path of the archive, or None to read the archive from the standard input of the helper.
+            previous: Directory of a previous version from which unchanged files are hardlinked, or None.
+        """
+        self.operations.append(
+            {
+                "op": "extract",
+                "extract_to": str(extract_to),
+                "archive": archive and str(archive),
+                "previous": previous and str(previous),
+                "workers": getattr(AptatorConfig.extract, "workers", None),
+                "fsync": getattr(AptatorConfig.extract, "fsync", False),
+            }
+        )
+        return self
+
+    def symlink(self, target, link):
+        """Atomically create or replace the symlink `link` pointing to `target`."""
+        self.operations.append({"op": "symlink", "target": str(target), "link": str(link)})
+        return self
+
+    def move(self, source, target):
+        """Rename `source` to `target`, replacing an existing `target` (both must be on the same filesystem)."""
+        self.operations.append({"op": "move", "source": str(source), "target": str(target)})
+        return self
+
+    def remove(self, path):
+        """Remove a file, symlink or directory tree if it exists."""
+        self.operations.append({"op": "remove", "path": str(path)})
+        return self
+
+    def execute(self, stdin=None):
+        """Execute the plan in a single privileged helper process.
+
+        Args:
+            stdin: A binary file object (e.g., an HTTP response) that is copied to the helper's standard input.
+
+        Raises:
+            subprocess.CalledProcessError: If the helper fails.
+        """
+        if not self.operations:
+            return
+        # isolated mode: a module planted in the current directory must not be imported by the privileged process
+        cmd = [AptatorConfig.paths.sudo, sys.executable, "-I", "-m", "aptator.privileged", json.dumps(self.operations)]
+        operations = [operation["op"] for operation in self.operations]
+        phase = "extract" if "extract" in operations else "subprocess"
+        with (
+            timed(phase, command="aptator.privileged", operations=operations),
+            tempfile.TemporaryFile() as stdout_file,
+            tempfile.TemporaryFile() as stderr_file,
+        ):
+            # the output is collected in files rather than pipes, so that the helper never blocks on a full pipe while
+            # an archive is still being streamed to its standard input
+            with subprocess.Popen(
+                cmd, stdin=subprocess.PIPE if stdin else subprocess.DEVNULL, stdout=stdout_file, stderr=stderr_file
+            ) as proc:
+                if stdin:
+                    try:
+                        shutil.copyfileobj(stdin, proc.stdin)
+                    except BrokenPipeError:
+                        pass
+                    finally:
+                        proc.stdin.close()
+            stdout_file.seek(0)
+            stderr_file.seek(0)
+            stdout = stdout_file.read().decode(errors="replace")
+            stderr = stderr_file.read().decode(errors="replace")
+        # print the helper's output through `sys.stdout`, so that it is buffered with the output of the package
+        print(stdout, end="")
+        if proc.returncode:
+            print(f"  {stderr.strip()}", file=sys.stderr)
+            raise subprocess.CalledProcessError(proc.returncode, cmd[:-1], stderr=stderr)
+
+
+def _symlink(target, link):
+    """Replace `link` by a symlink to `target` using rename, i.e. `link` exists at any time."""
+    link = Path(link)
+    temp_link = link.with_name(f".{link.name}.tmp")
+    temp_link.unlink(missing_ok=True)
+    temp_link.symlink_to(target)
+    temp_link.replace(link)
+
+
+def _move(source, target):
+    _remove(target)
+    Path(source).rename(target)
+
+
+def _remove(path):
+    path = Path(path)
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def apply(operations, stdin):
+    """Apply the operations of a plan (helper side)."""
+    # only the helper extracts archives, so tarfile is not imported by the processes that create plans
+    from aptator.actions.extract import EXTRACT_WORKERS, extract_archive
+
+    for operation in operations:
+        op = operation["op"]
+        if op == "extract":
+            options = {"workers": operation["workers"] or EXTRACT_WORKERS, "fsync": operation["fsync"]}
+            if operation["archive"]:
+                with Path(operation["archive"]).open("rb") as f:
+                    extract_archive(f, operation["extract_to"], operation["previous"], **options)
+            else:
+                extract_archive(stdin, operation["extract_to"], operation["previous"], **options)
+        elif op == "symlink":
+            _symlink(operation["target"], operation["link"])
+        elif op == "move":
+            _move(operation["source"], operation["target"])
+        elif op == "remove":
+            _remove(operation["path"])
+        else:
+            raise ValueError(f"Unsupported operation: {op}")
+
+
+if __name__ == "__main__":
+    os.umask(0o022)
+    try:
+        apply(json.loads(sys.argv[1]), sys.stdin.buffer)
+    except Exception as e:
+        print(f"{type(e).__name__}: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,162 @@
+"""Per-phase timing of a run and machine-readable run reports.
+
+The phases of a run (version lookup, download, checksum verification, extraction, subprocess calls and state updates)
+are timed with :func:`timed` and recorded in the global :data:`report`. Phases are attributed to the package that the
+current thread is working on (see :func:`package_context`). The report can be written as JSON (`--report FILE`) and
+in the Prometheus text format, e.g. for the textfile collector of the node exporter (`--prometheus FILE`).
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from aptator import write_atomic
+
+_current = threading.local()
+
+
+class RunReport:
+    """Thread-safe collection of the timed phases and the outcome of every package of a run."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = time.time()
+        self.finished = None
+        self.phases = []
+        self.status = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase: str, duration: float, package: str | None = None, **fields) -> None:
+        """Record a timed phase, e.g. `record("download", 1.2, "Zotero", bytes=1024)`."""
+        with self._lock:
+            self.phases.append({"phase": phase, "package": package, "duration": duration, **fields})
+
+    def set_status(self, package: str, status: str) -> None:
+        """Record the outcome of a package ("up-to-date", "updated", "staged" or "failed")."""
+        with self._lock:
+            self.status[package] = status
+
+    def finish(self) -> None:
+        self.finished = time.time()
+
+    def to_dict(self) -> dict:
+        """Return the report, with the phases grouped by package."""
+        with self._lock:
+            phases, status = list(self.phases), dict(self.status)
+        packages = {name: {"status": state, "phases": []} for name, state in status.items()}
+        totals = {}
+        for phase in phases:
+            name = phase["package"]
+            entry = {key: value for key, value in phase.items() if key != "package"}
+            if name is not None:
+                packages.setdefault(name, {"status": None, "phases": []})["phases"].append(entry)
+            total = totals.setdefault(phase["phase"], {"count": 0, "duration": 0.0})
+            total["count"] += 1
+            total["duration"] += phase["duration"]
+        return {
+            "started": self.started,
+            "duration": (self.finished or time.time()) - self.started,
+            "packages": packages,
+            "phases": totals,
+            "unattributed": [phase for phase in phases if phase["package"] is None],
+        }
+
+    def write_json(self, path) -> None:
+        write_atomic(path, json.dumps(self.to_dict(), indent=2) + "\n")
+
+    def write_prometheus(self, path) -> None:
+        """Write the report in the Prometheus text exposition format."""
+        data = self.to_dict()
+        lines = [
+            "# HELP aptator_run_timestamp_seconds Start time of the last aptator run.",
+            "# TYPE aptator_run_timestamp_seconds gauge",
+            f"aptator_run_timestamp_seconds {data['started']:.3f}",
+            "# HELP aptator_run_duration_seconds Duration of the last aptator run.",
+            "# TYPE aptator_run_duration_seconds gauge",
+            f"aptator_run_duration_seconds {data['duration']:.6f}",
+            "# HELP aptator_phase_duration_seconds Total duration of the phases of the last run.",
+            "# TYPE aptator_phase_duration_seconds gauge",
+        ]
+        durations = {}
+        downloaded = {}
+        for name, package in data["packages"].items():
+            for phase in package["phases"]:
+                key = (name, phase["phase"])
+                durations[key] = durations.get(key, 0.0) + phase["duration"]
+                if phase["phase"] == "download":
+                    downloaded[name] = downloaded.get(name, 0) + phase.get("bytes", 0)
+        for phase in data["unattributed"]:
+            key = ("", phase["phase"])
+            durations[key] = durations.get(key, 0.0) + phase["duration"]
+        lines.extend(
+            f'aptator_phase_duration_seconds{{package="{_escape(name)}",phase="{phase}"}} {duration:.6f}'
+            for (name, phase), duration in sorted(durations.items())
+        )
+        lines += [
+            "# HELP aptator_download_bytes Bytes downloaded per package in the last run.",
+            "# TYPE aptator_download_bytes gauge",
+        ]
+        lines.extend(
+            f'aptator_download_bytes{{package="{_escape(name)}"}} {size}' for name, size in sorted(downloaded.items())
+        )
+        lines += [
+            "# HELP aptator_package_status Outcome of the packages in the last run.",
+            "# TYPE aptator_package_status gauge",
+        ]
+        lines.extend(
+            f'aptator_package_status{{package="{_escape(name)}",status="{package["status"]}"}} 1'
+            for name, package in sorted(data["packages"].items())
+            if package["status"]
+        )
+        write_atomic(path, "\n".join(lines) + "\n")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+report = RunReport()
+
+
+def write_reports(json_path=None, prometheus_path=None) -> None:
+    """Finish the report of the current run and write it to the given files (if any)."""
+    report.finish()
+    if json_path:
+        report.write_json(json_path)
+    if prometheus_path:
+        report.write_prometheus(prometheus_path)
+
+
+def current_package() -> str | None:
+    return getattr(_current, "package", None)
+
+
+@contextmanager
+def package_context(name: str | None):
+    """Attribute the phases timed by the current thread to the package `name`."""
+    previous = current_package()
+    _current.package = name
+    try:
+        yield
+    finally:
+        _current.package = previous
+
+
+@contextmanager
+def timed(phase: str, **fields):
+    """Time a phase of the current package.
+
+    The yielded dictionary contains `fields` and may be extended with further fields (e.g., the number of bytes
+    downloaded), which are recorded together with the duration.
+    """
+    started = time.perf_counter()
+    try:
+        yield fields
+    except BaseException:
+        fields["failed"] = True
+        raise
+    finally:
+        report.record(phase, time.perf_counter() - started, current_package(), **fields)
@@ -0,0 +1,134 @@
+"""Rollback to retained versions and bounded retention of installed versions.
+
+Extract actions install every version into a directory of its own (e.g., `/opt/Zotero-8.0.2`) and point `link_to` to
+it. The directories of previous versions are kept, so that :func:`rollback` only has to swap the symlink (atomically,
+by renaming a new symlink over the old one). With `keep = N` in the configuration of a package, only the directories of
+the N most recently installed versions are retained; older ones are removed after every update (see
+:func:`prune_versions`). Both use the install history of the state database; directories of versions installed before
+the history was recorded are left alone.
+
+After a rollback, the version rolled back from is held: it is not installed again by later runs until another release
+is installed (e.g., a newer release or a forced reinstallation).
+"""
+
+import time
+from pathlib import Path
+
+from aptator.privileged import FsPlan
+from aptator.state import (
+    get_held_version,
+    get_install_history,
+    get_installed_version,
+    mark_removed,
+    record_install,
+    set_held_version,
+)
+
+EXTRACT_ACTIONS = ("extract-and-link", "download-extract-and-link")
+
+
+def _retained(history):
+    """Return the latest history entry of every installed path that still exists, newest first."""
+    entries = {}
+    for entry in history:
+        path = entry[2] and str(Path(entry[2]))
+        if path and entry[5] is None and path not in entries and Path(path).exists():
+            entries[path] = entry
+    return list(entries.values())
+
+
+def rollback(cfg, version=None):
+    """Switch a package back to a retained previous version.
+
+    Extract actions only replace the symlink `link_to`; for `deb-install` actions, the retained .deb package (if it is
+    still in the download cache) is installed again. The version rolled back from is held (see :func:`is_held`).
+
+    Args:
+        cfg: The package configuration.
+        version: The version to switch to, or None for the most recently installed version other than the current one.
+
+    Returns:
+        str: The version the package has been switched to.
+
+    Raises:
+        ValueError: If no matching version is retained or the action does not support rollbacks.
+    """
+    name = cfg["name"]
+    action = cfg.get("action", {})
+    installed = get_installed_version(name)
+    candidates = [
+        entry
+        for entry in _retained(get_install_history(name))
+        if (entry[0] == version if version else entry[0] != installed)
+    ]
+    if not candidates:
+        raise ValueError(f"no retained version {version or 'other than ' + str(installed)} of {name} found.")
+    target_version, action_type, path, digest, _, _ = candidates[0]
+
+    started = time.perf_counter()
+    if action_type in EXTRACT_ACTIONS:
+        link_to = action.get("link_to")
+        if not link_to:
+            raise ValueError("link_to must be specified.")
+        FsPlan().symlink(path, link_to).execute()
+    elif action_type == "deb-install":
+        from aptator.actions.deb import install_deb
+
+        install_deb(path)
+    else:
+        raise ValueError(f"rollback is not supported for action type: {action_type}")
+
+    # a previous rollback has already held the newest version
+    held = get_held_version(name) or installed
+    record_install(name, target_version, action=action_type, path=path, digest=digest)
+    if held and held != target_version:
+        set_held_version(name, held)
+    print(f"{name} rolled back from {installed} to {target_version} ({(time.perf_counter() - started) * 1000:.0f} ms).")
+    return target_version
+
+
+def is_held(name, version, force=False) -> bool:
+    """Return whether `version` of a package must not be installed, since the package has been rolled back from it.
+
+    Args:
+        name: The name of the package.
+        version: The version to install.
+        force: Whether the installation has been forced (e.g., by `--force`), which ignores the hold.
+    """
+    if force or get_held_version(name) != version:
+        return False
+    print(f"{name} {version} has been rolled back and is not installed again (use --force to install it).")
+    return True
+
+
+def prune_versions(name, current, extract_to, keep):
+    """Remove the directories of all but the `keep` most recently installed versions of a package.
+
+    Args:
+        name: The name of the package.
+        current: The directory of the version that has just been installed, which is always retained.
+        extract_to: The directory the versions are extracted to; only directories of the package below it are removed.
+        keep: The number of versions to retain (including the current one).
+
+    Returns:
+        list[str]: The removed directories.
+    """
+    extract_to, current = Path(extract_to), Path(current)
+    retained = [entry[2] for entry in _retained(get_install_history(name)) if Path(entry[2]) != current]
+    # paths are compared as `Path`s, which normalizes paths recorded with redundant slashes
+    obsolete = [
+        path
+        for path in retained[max(0, keep - 1) :]
+        if Path(path).parent == extract_to and Path(path).name.startswith(f"{name}-")
+    ]
+    if not obsolete:
+        return []
+
+    plan = FsPlan()
+    for path in obsolete:
+        plan.remove(path)
+    plan.execute()
+    for path in obsolete:
+        mark_removed(name, path)
+    print(f"  removed {len(obsolete)} old version(s) of {name}: {', '.join(obsolete)}")
+    return obsolete
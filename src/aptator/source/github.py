@@ -1,16 +1,165 @@
+import codecs
+import itertools
 import json
 import re
 import sys
+import threading
+import time
 import urllib.request
 from abc import ABC, abstractmethod
-from collections.abc import Callable
+from os import getenv
 from pathlib import Path
-from tempfile import TemporaryDirectory
 
+from aptator import AptatorConfig
+from aptator.cache import DownloadCache
+from aptator.httpclient import urlopen
 from aptator.source import Source
-from aptator.tools import verify_checksum
+from aptator.state import get_cached_response, set_cached_response
 
-GITHUB_API = "https://api.github.com/repos/{repo}/releases"
+# base URL of the GitHub API; may be replaced by an `aptator serve` mirror using `[github] api_url`
+GITHUB_API_URL = "https://api.github.com"
+
+# releases are requested in small pages, since most lookups only need the newest release
+RELEASES_PER_PAGE = 5
+# maximum number of pages searched for a release with a matching asset
+MAX_RELEASE_PAGES = 6
+CHUNK_SIZE = 16 * 1024
+
+
+def api_url() -> str:
+    """Return the base URL of the GitHub API (`[github] api_url`)."""
+    return getattr(AptatorConfig.github, "api_url", GITHUB_API_URL).rstrip("/")
+
+
+def releases_url(repo: str, page: int = 1) -> str:
+    return f"{api_url()}/repos/{repo}/releases?per_page={RELEASES_PER_PAGE}&page={page}"
+
+
+def latest_release_url(repo: str) -> str:
+    return f"{api_url()}/repos/{repo}/releases/latest"
+
+
+def tags_url(repo: str) -> str:
+    # only the latest tag is used
+    return f"{api_url()}/repos/{repo}/tags?per_page=1"
+
+
+def github_token() -> str | None:
+    """Return the GitHub token from `[github] token` or the `GITHUB_TOKEN` environment variable."""
+    return getattr(AptatorConfig.github, "token", None) or getenv("GITHUB_TOKEN")
+
+
+class CacheStats:
+    """Thread-safe hit/miss counters of the conditional-request cache."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def __str__(self):
+        return f"{self.hits} hits, {self.misses} misses"
+
+
+cache_stats = CacheStats()
+
+
+class RateLimitExceededError(Exception):
+    """Raised if a request has been rejected due to GitHub's rate limit."""
+
+    def __init__(self, reset: float):
+        self.reset = reset
+        super().__init__(f"GitHub API rate limit exceeded until {time.strftime('%H:%M:%S', time.localtime(reset))}")
+
+
+class RateLimit:
+    """The most recent rate limit status reported by the GitHub API (thread-safe)."""
+
+    def __init__(self):
+        self.remaining = None
+        self.reset = None
+        self._lock = threading.Lock()
+
+    def update(self, headers) -> None:
+        """Update the status from the `X-RateLimit-*` (or `Retry-After`) headers of a response."""
+        with self._lock:
+            if headers.get("X-RateLimit-Remaining") is not None:
+                self.remaining = int(headers["X-RateLimit-Remaining"])
+            if headers.get("X-RateLimit-Reset") is not None:
+                self.reset = float(headers["X-RateLimit-Reset"])
+            if headers.get("Retry-After") is not None:
+                # secondary rate limits: wait for the given number of seconds
+                self.remaining = 0
+                self.reset = time.time() + int(headers["Retry-After"])
+
+    @property
+    def exhausted(self) -> bool:
+        return self.remaining == 0 and self.reset is not None and self.reset > time.time()
+
+
+rate_limit = RateLimit()
+
+
+def _split_element(decoder: json.JSONDecoder, text: str):
+    """Split the next element off `text`, the part of a JSON array that follows the "[" or a ",".
+
+    An element is only decoded once the "," or "]" after it has been read, since an element at the end of the text
+    might be incomplete (e.g., a number split between two reads).
+
+    Returns:
+        tuple | None: The decoded elements (none for an empty array), the delimiter ("," or "]") and the text after
+        it, or None if more text is needed.
+    """
+    text = text.lstrip()
+    if text.startswith("]"):
+        return [], "]", text[1:]
+    try:
+        item, end = decoder.raw_decode(text)
+    except json.JSONDecodeError:
+        return None
+    rest = text[end:].lstrip()
+    if not rest or rest[0] not in ",]":
+        return None
+    return [item], rest[0], rest[1:]
+
+
+def _iter_json_array(fp, raw: list):
+    """Incrementally decode the elements of a JSON array that is read from a binary file object.
+
+    Args:
+        fp: The file object (e.g., an HTTP response).
+        raw: A list to which the decoded text is appended.
+
+    Raises:
+        ValueError: If the document is not a valid JSON array.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer, started, eof = "", False, False
+    while not eof:
+        chunk = fp.read1(CHUNK_SIZE) if hasattr(fp, "read1") else fp.read(CHUNK_SIZE)
+        eof = not chunk
+        text = utf8.decode(chunk, final=eof)
+        raw.append(text)
+        buffer += text
+        if not started and buffer.strip():
+            buffer = buffer.lstrip()
+            if buffer[0] != "[":
+                raise ValueError("Expected a JSON array.")
+            buffer, started = buffer[1:], True
+        while started and (element := _split_element(decoder, buffer)):
+            items, delimiter, buffer = element
+            yield from items
+            if delimiter == "]":
+                return
+    raise ValueError("Invalid or incomplete JSON array.")
 
 
 class Downloadable(ABC):
@@ -67,10 +216,15 @@ class Tag(Downloadable):
 
 
 class GitHub(Source):
-    def __init__(self, repo: str, asset_version_re: str, asset_re: str):
+    # revalidate cached API responses with conditional requests (disabled by `--no-cache`)
+    use_cache = True
+
+    def __init__(self, repo: str, asset_version_re: str, asset_re: str, prefetched: dict | None = None):
         self.repo = repo
         self.asset_version_re = re.compile(asset_version_re)
         self.asset_re = re.compile(asset_re)
+        # API documents resolved in advance (see :func:`aptator.source.graphql.resolve_latest`), keyed by their URL
+        self.prefetched = prefetched or {}
 
     @staticmethod
     def parse_digest(digest_str):
@@ -79,16 +233,96 @@ class GitHub(Source):
             return None, None
         return digest_str.split(":", 1)
 
+    def _open(self, url: str):
+        """Send a (conditional) request to the GitHub API.
+
+        Responses are cached together with their ETag/Last-Modified validators and revalidated with
+        conditional requests; GitHub does not count a `304 Not Modified` against the rate limit.
+
+        Returns:
+            tuple: The response and None, or None and the cached body if it is still valid.
+
+        Raises:
+            RateLimitExceededError: If the request has been rejected due to the rate limit.
+            urllib.error.HTTPError: If the request fails.
+        """
+        request = urllib.request.Request(url)
+        cached = get_cached_response(url) if self.use_cache else None
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                request.add_header("If-None-Match", etag)
+            if last_modified:
+                request.add_header("If-Modified-Since", last_modified)
+
+        try:
+            response = urlopen(request, token=github_token())
+        except urllib.error.HTTPError as e:
+            rate_limit.update(e.headers)
+            if e.code in (403, 429) and rate_limit.exhausted:
+                raise RateLimitExceededError(rate_limit.reset) from e
+            if e.code != 304 or not cached:
+                raise
+            cache_stats.record(hit=True)
+            return None, cached[2]
+        rate_limit.update(response.headers)
+        if self.use_cache:
+            cache_stats.record(hit=False)
+        return response, None
+
+    def _store(self, url: str, response, body: str) -> None:
+        if self.use_cache:
+            set_cached_response(url, response.headers.get("ETag"), response.headers.get("Last-Modified"), body)
+
+    def _get_json(self, url: str):
+        """Fetch and decode a JSON document from the GitHub API (see :meth:`_open`)."""
+        if url in self.prefetched:
+            return self.prefetched[url]
+
+        response, body = self._open(url)
+        if response:
+            with response:
+                body = response.read().decode("utf-8")
+            self._store(url, response, body)
+        return json.loads(body)
+
+    def _iter_json(self, url: str):
+        """Lazily fetch and decode the elements of a JSON array from the GitHub API (see :meth:`_open`).
+
+        Elements are decoded while the response is read. Without caching, reading stops as soon as the consumer stops
+        iterating; otherwise the rest of the (small) page is read, so that it can be revalidated by the next run.
+        """
+        if url in self.prefetched:
+            yield from self.prefetched[url]
+            return
+
+        response, body = self._open(url)
+        if not response:
+            yield from json.loads(body)
+            return
+
+        with response:
+            raw = []
+            items = _iter_json_array(response, raw)
+            for item in items:
+                try:
+                    yield item
+                except GeneratorExit:
+                    if self.use_cache:
+                        for _ in items:
+                            pass
+                        self._store(url, response, "".join(raw))
+                    raise
+            self._store(url, response, "".join(raw))
+
     def get_latest_tag(self) -> Tag | None:
         """Get the latest tag from the repository.
 
         Returns:
             dict: JSON object representing the latest tag, or None if no tags found.
         """
-        tags_url = f"https://api.github.com/repos/{self.repo}/tags"
         try:
-            with urllib.request.urlopen(tags_url, timeout=15) as response:
-                tags = json.loads(response.read().decode("utf-8"))
+            tags = self._get_json(tags_url(self.repo))
 
             if not tags:
                 print("  no tags found")
@@ -99,23 +333,55 @@ class GitHub(Source):
             print(f"  error fetching tags: {e}")
             return None
 
+    def iter_releases(self, allow_prerelease: bool = False):
+        """Lazily iterate over the published releases of the repository, newest first.
+
+        Releases are requested in pages of `RELEASES_PER_PAGE`; the next page is only requested once the consumer has
+        iterated over the previous one. Drafts (and pre-releases, unless `allow_prerelease` is set) are skipped.
+        """
+        for page in range(1, MAX_RELEASE_PAGES + 1):
+            count = 0
+            for release in self._iter_json(releases_url(self.repo, page)):
+                count += 1
+                if release.get("draft") or (release.get("prerelease") and not allow_prerelease):
+                    continue
+                yield release
+            if count < RELEASES_PER_PAGE:
+                return
+
+    def _matching_asset(self, release: dict) -> dict | None:
+        return next((a for a in release.get("assets", []) if self.asset_re.search(a["name"])), None)
+
     def get_latest_release_asset(self, allow_prerelease: bool = False) -> Asset | None:
-        # Get releases based on prerelease preference
-        if allow_prerelease:
-            # Get all releases to include pre-releases
-            with urllib.request.urlopen(GITHUB_API.format(repo=self.repo), timeout=15) as response:
-                releases = json.loads(response.read().decode("utf-8"))
-            release = releases[0] if releases else {}
-        else:
-            # Get only the latest non-prerelease
-            with urllib.request.urlopen(GITHUB_API.format(repo=self.repo) + "/latest", timeout=15) as response:
-                release = json.loads(response.read().decode("utf-8"))
-
-        if not release:
-            print("  no releases found")
-            return None
+        """Return the matching asset of the newest release that provides one.
 
-        return Asset(next((a for a in release.get("assets", []) if self.asset_re.search(a["name"])), None))
+        Without pre-releases, the latest release (`/releases/latest`) is checked first. Older releases are only
+        requested if it has no matching asset (e.g., while the assets of a new release are still being uploaded).
+
+        Returns:
+            Asset | None: The asset, or None if no release provides a matching asset.
+        """
+        releases = self.iter_releases(allow_prerelease)
+        if not allow_prerelease:
+            try:
+                releases = itertools.chain([self._get_json(latest_release_url(self.repo))], releases)
+            except urllib.error.HTTPError as e:
+                if e.code != 404:
+                    raise
+                # GitHub reports a missing latest release as "404 Not Found"
+                releases = iter(())
+
+        first = None
+        for release in releases:
+            first = first or release
+            asset = self._matching_asset(release)
+            if asset:
+                if release is not first:
+                    print(f"  no matching asset in release {first.get('tag_name')}, using {release.get('tag_name')}")
+                return Asset(asset)
+
+        print("  no releases found" if first is None else "  no release with a matching asset found")
+        return None
 
     def get_asset_version(self, asset):
         # Extract version from asset filename
@@ -125,34 +391,20 @@ class GitHub(Source):
             return None
         return version_match.group(1)
 
-    def perform_action(self, downloadable: Downloadable, action: Callable) -> bool:
-        """Download and verify a Downloadable object, then perform an action on it.
+    def download(self, downloadable: Downloadable) -> Path | None:
+        """Download and verify a Downloadable object.
 
-        Args:
-            downloadable: A Downloadable object (Asset or Tag)
-            action: Callable that takes the file path as argument
+        Downloads are kept in the download cache, i.e. reinstalling the same asset does not download it again.
 
         Returns:
-            bool: True if successful, False otherwise
+            Path | None: The verified file, or None if the checksum verification failed.
         """
-        with TemporaryDirectory() as tmp, urllib.request.urlopen(downloadable.get_download_url()) as response:
-            file_path = Path(tmp) / downloadable.get_filename()
-            file_path.write_bytes(response.read())
-
-            # Verify checksum if available
-            digest = downloadable.get_digest()
-            if digest:
-                hash_type, expected_hash = self.parse_digest(digest)
-                if hash_type and expected_hash:
-                    print(f"  verifying {hash_type} checksum...")
-                    if verify_checksum(file_path, expected_hash, hash_type):
-                        print("  checksum verified.")
-                        action(file_path)
-                        return True
-                    print("  checksum verification failed! Download may be corrupted.", file=sys.stderr)
-                    print("  aborting installation.", file=sys.stderr)
-                    return False
-            else:
-                print("  no digest available, skipping verification")
-            action(file_path)
-            return True
+        hash_type, expected_hash = self.parse_digest(downloadable.get_digest())
+        try:
+            return DownloadCache().fetch(
+                downloadable.get_download_url(), downloadable.get_filename(), hash_type, expected_hash
+            )
+        except ValueError as e:
+            print(f"  {e}", file=sys.stderr)
+            print("  aborting installation.", file=sys.stderr)
+            return None
@@ -0,0 +1,152 @@
+"""Batched resolution of the latest releases and tags of many repositories through the GitHub GraphQL API.
+
+A single GraphQL query resolves the latest release (or tag) of up to `BATCH_SIZE` repositories. The results are
+converted to the documents returned by the corresponding REST endpoints and keyed by their REST URL, so that
+:class:`aptator.source.github.GitHub` can use them instead of issuing one REST request per package. The GraphQL API
+requires authentication; without a token (`[github] token` or `GITHUB_TOKEN`) nothing is resolved and all packages
+use the REST API.
+"""
+
+import json
+import sys
+import urllib.error
+import urllib.request
+
+from aptator.httpclient import urlopen
+from aptator.source.github import RELEASES_PER_PAGE, api_url, github_token, latest_release_url, releases_url, tags_url
+
+# tarball URLs always refer to GitHub, as in the documents returned by the REST API
+GITHUB_TARBALL_URL = "https://api.github.com/repos/{repo}/tarball/refs/tags/{tag}"
+
+# number of repositories per query; keeps the query well below GitHub's node and cost limits
+BATCH_SIZE = 25
+
+RELEASE_FRAGMENT = """
+fragment release on Release {
+  tagName name isPrerelease isDraft
+  releaseAssets(first: 100) { nodes { name downloadUrl digest } }
+}
+"""
+
+FIELDS = {
+    "latest": "latestRelease { ...release }",
+    "releases": f"releases(first: {RELEASES_PER_PAGE}, orderBy: {{field: CREATED_AT, direction: DESC}}) "
+    "{ nodes { ...release } }",
+    # the REST API lists tags by name in descending order (not by date), so the GraphQL lookup has to sort them the same
+    # way to resolve the same "latest" tag
+    "tags": 'refs(refPrefix: "refs/tags/", first: 1, orderBy: {field: ALPHABETICAL, direction: DESC}) '
+    "{ nodes { name } }",
+}
+
+
+def _lookup(pkg) -> tuple[str, str]:
+    """Return the kind of lookup ("latest", "releases" or "tags") and the REST URL it replaces."""
+    repo = pkg["repo"]
+    if pkg.get("use_tag", False):
+        return "tags", tags_url(repo)
+    if pkg.get("prerelease", False):
+        # the first page of releases (drafts are skipped by `GitHub.iter_releases`)
+        return "releases", releases_url(repo)
+    return "latest", latest_release_url(repo)
+
+
+def _release(node: dict) -> dict:
+    """Convert a GraphQL release to the format of the REST API."""
+    return {
+        "tag_name": node["tagName"],
+        "name": node["name"],
+        "prerelease": node["isPrerelease"],
+        "draft": node["isDraft"],
+        "assets": [
+            {"name": asset["name"], "browser_download_url": asset["downloadUrl"], "digest": asset.get("digest")}
+            for asset in node["releaseAssets"]["nodes"]
+        ],
+    }
+
+
+def _convert(kind: str, repo: str, repository: dict):
+    """Convert the GraphQL result of a repository to the document returned by the REST API."""
+    if kind == "latest":
+        # repositories without releases are left to the REST API, which reports them as before
+        return _release(repository["latestRelease"]) if repository["latestRelease"] else None
+    if kind == "releases":
+        return [_release(node) for node in repository["releases"]["nodes"]]
+    return [
+        {"name": node["name"], "tarball_url": GITHUB_TARBALL_URL.format(repo=repo, tag=node["name"])}
+        for node in repository["refs"]["nodes"]
+    ]
+
+
+def _query(lookups: list[tuple[str, str]], token: str) -> dict:
+    """Resolve a batch of (kind, repo) lookups with a single GraphQL query.
+
+    Returns:
+        dict: The `data` object of the response, with the fields `r0`, `r1`, ... for the lookups.
+    """
+    variables = {}
+    parameters = []
+    fields = []
+    for i, (kind, repo) in enumerate(lookups):
+        variables[f"o{i}"], variables[f"n{i}"] = repo.split("/", 1)
+        parameters.append(f"$o{i}: String!, $n{i}: String!")
+        fields.append(f"r{i}: repository(owner: $o{i}, name: $n{i}) {{ {FIELDS[kind]} }}")
+    query = f"query({', '.join(parameters)}) {{\n{chr(10).join(fields)}\n}}\n"
+    # GraphQL rejects fragments that are not used
+    if any(kind != "tags" for kind, _ in lookups):
+        query += RELEASE_FRAGMENT
+
+    request = urllib.request.Request(
+        f"{api_url()}/graphql",
+        data=json.dumps({"query": query, "variables": variables}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    # GraphQL requests have a rate limit of their own, i.e. they are not recorded in `rate_limit`
+    with urlopen(request, token=token) as response:
+        result = json.load(response)
+    if not isinstance(result, dict) or not isinstance(result.get("data"), dict) or not result["data"]:
+        errors = result.get("errors") if isinstance(result, dict) else None
+        messages = [error.get("message", "") for error in errors or [] if isinstance(error, dict)]
+        raise ValueError("; ".join(messages) or "no data")
+    # errors of individual repositories (e.g., NOT_FOUND) only affect their fields, which are null
+    return result["data"]
+
+
+def resolve_latest(packages) -> dict:
+    """Resolve the latest releases or tags of all packages with batched GraphQL queries.
+
+    Args:
+        packages: The package configurations.
+
+    Returns:
+        dict: The REST documents of the resolved lookups, keyed by their REST URL. Lookups that could not be resolved
+        (no token, failed queries or repositories) are missing and fall back to the REST API.
+    """
+    token = github_token()
+    if not token:
+        return {}
+
+    lookups = {}
+    for pkg in packages:
+        kind, url = _lookup(pkg)
+        lookups[url] = (kind, pkg["repo"])
+    urls = list(lookups)
+
+    resolved = {}
+    for start in range(0, len(urls), BATCH_SIZE):
+        batch = urls[start : start + BATCH_SIZE]
+        try:
+            data = _query([lookups[url] for url in batch], token)
+        except (urllib.error.URLError, ValueError, OSError) as e:
+            print(f"GraphQL query failed, falling back to the REST API: {e}", file=sys.stderr)
+            continue
+        for i, url in enumerate(batch):
+            repository = data.get(f"r{i}")
+            try:
+                document = _convert(*lookups[url], repository) if repository else None
+            except (KeyError, TypeError, AttributeError) as e:
+                # a result of an unexpected shape only affects its repository, which is left to the REST API
+                print(f"Unexpected GraphQL result for {lookups[url][1]}, using the REST API: {e!r}", file=sys.stderr)
+                continue
+            if document is not None:
+                resolved[url] = document
+    return resolved
@@ -0,0 +1,206 @@
+"""Pre-fetched updates: download and prepare updates ahead of time and install them later.
+
+`aptator fetch` checks all packages and downloads and verifies the assets of outdated ones (see
+:mod:`aptator.pipeline`), but stages them instead of installing them: .deb packages are linked into the staging
+directory, and archives of extract actions are extracted next to their final location (e.g.,
+`/opt/.Zotero-8.0.2.staged`). `aptator install` then only performs the privileged step, i.e. the dpkg transaction or
+renaming the extracted directory and swapping the symlink, and does not access the network.
+
+The staged updates are listed in `manifest.json` in the staging directory, with the entries of a plan (see
+:func:`aptator.plan.plan_entry`) plus the staged artifact or directory. Staged .deb packages are installed from the
+download cache, which retains them for rollbacks (see :mod:`aptator.retention`).
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aptator import CACHE_HOME, AptatorConfig, write_atomic
+from aptator.cache import DownloadCache, deferred_eviction
+from aptator.pipeline import StagedTree, install_updates, stage_update
+from aptator.plan import plan_entry, update_from_entry
+from aptator.privileged import FsPlan
+from aptator.report import package_context, report, timed
+from aptator.retention import is_held
+from aptator.source.github import GitHub
+from aptator.state import batch_writes, get_installed_version, run_lock
+
+STAGING_DIR = CACHE_HOME / "staging"
+MANIFEST = STAGING_DIR / "manifest.json"
+
+
+def load_manifest() -> dict:
+    """Return the staged updates, keyed by package name.
+
+    An unreadable manifest is reported and treated as empty, i.e. the updates are staged again by the next fetch.
+    """
+    try:
+        return json.loads(MANIFEST.read_text())
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Ignoring the unreadable manifest of staged updates {MANIFEST}: {e}", file=sys.stderr)
+        return {}
+
+
+def _save_manifest(entries) -> None:
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    write_atomic(MANIFEST, json.dumps(entries, indent=2) + "\n")
+
+
+def _is_staged(entry) -> bool:
+    """Return whether the staged artifact or directory of an entry still exists."""
+    path = entry.get("tree") or entry.get("artifact")
+    return path is None or Path(path).exists()
+
+
+def _link(source, target) -> None:
+    """Hardlink `source` to `target`, or copy it if it cannot be linked (e.g., across filesystems)."""
+    target.unlink(missing_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def _link_into_staging(name, path) -> Path:
+    """Link a downloaded file into the staging directory, so that pruning the download cache keeps it."""
+    staged = STAGING_DIR / name / Path(path).name
+    staged.parent.mkdir(parents=True, exist_ok=True)
+    _link(path, staged)
+    return staged
+
+
+def _retain(entry) -> Path:
+    """Link a staged file into the download cache, which retains it for rollbacks once the staged file is discarded.
+
+    Returns:
+        Path: The file within the cache, which is installed and recorded in the install history.
+    """
+    staged = Path(entry["artifact"])
+    hash_type, expected_hash = GitHub.parse_digest(entry["asset"]["digest"])
+    if not expected_hash:
+        with staged.open("rb") as f:
+            hash_type, expected_hash = "sha256", hashlib.file_digest(f, "sha256").hexdigest()
+    cache = DownloadCache()
+    temp_dir = cache.path / ".staging"
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    temp = Path(tempfile.mkdtemp(dir=temp_dir)) / staged.name
+    try:
+        _link(staged, temp)
+        return cache.put(DownloadCache.key(entry["asset"]["url"], hash_type, expected_hash), temp)
+    finally:
+        shutil.rmtree(temp.parent)
+
+
+def _discard(entry) -> None:
+    """Remove the staged files of a manifest entry."""
+    if entry.get("tree") and Path(entry["tree"]).exists():
+        FsPlan().remove(entry["tree"]).execute()
+    if entry.get("artifact"):
+        artifact = Path(entry["artifact"])
+        if STAGING_DIR in artifact.parents:
+            artifact.unlink(missing_ok=True)
+            with contextlib.suppress(OSError):
+                artifact.parent.rmdir()
+
+
+def stage_updates(items, force_packages=()):
+    """Stage a list of downloaded (update, artifact) pairs instead of installing them (used by `aptator fetch`).
+
+    Returns:
+        list[Update]: The successfully staged updates.
+    """
+    entries = load_manifest()
+    staged_updates = []
+    for update, artifact in items:
+        previous = entries.get(update.name)
+        if previous and previous["latest_version"] == update.release_version and _is_staged(previous):
+            print(f"{update.name} {update.release_version} is already staged.")
+            report.set_status(update.name, "staged")
+            staged_updates.append(update)
+            continue
+
+        with package_context(update.name):
+            try:
+                with timed("stage", action=update.action_type):
+                    staged = stage_update(update, artifact)
+                    if isinstance(staged, StagedTree):
+                        tree, staged = staged.path, None
+                    else:
+                        tree = None
+                    if staged is not None:
+                        staged = _link_into_staging(update.name, staged)
+                if previous:
+                    _discard(previous)
+                entry = plan_entry(
+                    update.cfg,
+                    update.downloadable,
+                    update.release_version,
+                    get_installed_version(update.name),
+                    update.name in force_packages,
+                )
+                entry.update(artifact=staged and str(staged), tree=tree, staged=time.time())
+                # the manifest is written per package, so that a failure only affects the package at hand
+                _save_manifest({**entries, update.name: entry})
+            except Exception as e:
+                print(f"Error staging {update.name}: {e}", file=sys.stderr)
+                report.set_status(update.name, "failed")
+                continue
+        entries[update.name] = entry
+        report.set_status(update.name, "staged")
+        staged_updates.append(update)
+        print(f"{update.name} {update.release_version} staged.")
+
+    return staged_updates
+
+
+def _artifact(entry):
+    if entry.get("tree"):
+        return StagedTree(entry["tree"])
+    return _retain(entry) if entry.get("artifact") else None
+
+
+def install_staged():
+    """Install all staged updates (used by `aptator install`).
+
+    Updates whose version has been installed in the meantime are discarded. Updates that fail remain staged.
+    """
+    packages = AptatorConfig.packages or []
+    # the staged packages are only evicted from the download cache once they have been installed
+    with run_lock(), batch_writes(), deferred_eviction():
+        entries = load_manifest()
+        items = []
+        for name, entry in list(entries.items()):
+            if get_installed_version(name) == entry["latest_version"] and not entry["force"]:
+                print(f"{name} {entry['latest_version']} is already installed, discarding the staged update.")
+                _discard(entries.pop(name))
+                report.set_status(name, "up-to-date")
+            elif is_held(name, entry["latest_version"], entry["force"]):
+                _discard(entries.pop(name))
+                report.set_status(name, "up-to-date")
+            elif not _is_staged(entry):
+                print(f"The staged files of {name} are missing, run `aptator fetch` again.", file=sys.stderr)
+                del entries[name]
+                report.set_status(name, "failed")
+            else:
+                try:
+                    items.append((update_from_entry(entry, packages), _artifact(entry)))
+                except (ValueError, OSError) as e:
+                    print(f"Error installing the staged update of {name}: {e}", file=sys.stderr)
+                    if isinstance(e, ValueError):
+                        # the package is no longer configured (as staged)
+                        _discard(entries.pop(name))
+                    report.set_status(name, "failed")
+
+        if not items:
+            print("No staged updates.")
+        for update in install_updates(items):
+            _discard(entries.pop(update.name))
+        _save_manifest(entries)
@@ -1,29 +1,167 @@
-"""Record and retrieve the state of installed packages."""
+"""Record and retrieve the state of installed packages.
 
+The state database uses SQLite's write-ahead log, so that it can be read while it is written, also by other aptator
+processes. Every thread reads through a connection of its own, while all writes go through a single connection that is
+serialized by `write_lock`. Installations are committed immediately, so that the state matches the system even if a
+run is interrupted. Cached API responses and check times written within :func:`batch_writes` (i.e., during a run) are
+collected in memory and committed together at its end, so that no write transaction is kept open during a run. Reads
+only see committed writes.
+
+:func:`run_lock` prevents overlapping runs of several aptator processes (e.g., from cron and from a user).
+"""
+
+import fcntl
+import functools
+import os
 import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
 db_path = Path("~/.local/share/aptator/state.db").expanduser()
-db_path.parent.mkdir(parents=True, exist_ok=True)
 
-conn = sqlite3.connect(db_path)
-conn.execute("""
+# seconds to wait for a lock held by another connection (e.g., of another process) before giving up
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
     CREATE TABLE IF NOT EXISTS packages (
         name TEXT PRIMARY KEY,
         installed_version TEXT NOT NULL
-    )
-""")
+    );
+    CREATE TABLE IF NOT EXISTS http_cache (
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        body TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS checks (
+        name TEXT PRIMARY KEY,
+        last_checked REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS install_history (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        version TEXT NOT NULL,
+        action TEXT,
+        path TEXT,
+        digest TEXT,
+        installed_at REAL NOT NULL,
+        removed_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS install_history_name ON install_history (name, installed_at);
+    CREATE TABLE IF NOT EXISTS holds (
+        name TEXT PRIMARY KEY,
+        version TEXT NOT NULL
+    );
+"""
+
+write_lock = threading.Lock()
+_local = threading.local()
+_batch_depth = 0
+# the (sql, params) of the batched writes that are committed at the end of `batch_writes`
+_pending = []
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode = WAL")
+    # with the write-ahead log, commits are only synced at checkpoints; a crash loses at most the last commits
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+@functools.cache
+def _writer() -> sqlite3.Connection:
+    """Return the connection used for all writes, which creates the database on first use (call with `write_lock`)."""
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = _connect()
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _reader() -> sqlite3.Connection:
+    """Return the connection of the current thread for reading the state database."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        with write_lock:
+            _writer()
+        conn = _local.conn = _connect()
+    return conn
+
+
+def _commit(statements) -> None:
+    """Execute a list of (sql, params) in a single transaction (call with `write_lock`)."""
+    with _writer() as conn:
+        for sql, params in statements:
+            conn.execute(sql, params)
+
+
+def _write(*statements: tuple[str, tuple], batched: bool = False) -> None:
+    """Commit (sql, params) statements in a single transaction.
+
+    Args:
+        statements: The statements to execute.
+        batched: Whether the statements may be deferred to the end of :func:`batch_writes`.
+    """
+    with write_lock:
+        if batched and _batch_depth:
+            _pending.extend(statements)
+        else:
+            _commit(statements)
+
+
+@contextmanager
+def batch_writes():
+    """Commit the batched writes of the enclosed block (e.g., of a run) in a single transaction at its end."""
+    global _batch_depth  # noqa: PLW0603
+    with write_lock:
+        _batch_depth += 1
+    try:
+        yield
+    finally:
+        with write_lock:
+            _batch_depth -= 1
+            if not _batch_depth and _pending:
+                _commit(_pending)
+                _pending.clear()
+
+
+@contextmanager
+def run_lock():
+    """Hold the process-level lock of the state database, waiting for other aptator processes that hold it."""
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    with db_path.with_suffix(".lock").open("a+") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.seek(0)
+            print(f"Waiting for another aptator process (pid {f.read().strip() or '?'})...", file=sys.stderr)
+            fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
 
 
 def get_installed_version(package_name: str) -> str | None:
     """Get the installed version of a package, or None if not installed."""
-    row = conn.execute("SELECT installed_version FROM packages WHERE name = ?", (package_name,)).fetchone()
+    row = _reader().execute("SELECT installed_version FROM packages WHERE name = ?", (package_name,)).fetchone()
     return row[0] if row else None
 
 
 def set_installed_version(package_name: str, version: str) -> None:
     """Set the installed version of the given package."""
-    conn.execute(
+    _write(_set_installed_version(package_name, version))
+
+
+def _set_installed_version(package_name: str, version: str) -> tuple[str, tuple]:
+    return (
         """
         INSERT INTO packages (name, installed_version)
         VALUES (?, ?)
@@ -31,4 +169,112 @@ def set_installed_version(package_name: str, version: str) -> None:
         """,
         (package_name, version),
     )
-    conn.commit()
+
+
+def record_install(
+    package_name: str, version: str, action: str | None = None, path: str | None = None, digest: str | None = None
+) -> None:
+    """Set the installed version of a package, add the installation to its history and release its hold.
+
+    Args:
+        package_name: The name of the package.
+        version: The installed version.
+        action: The action type used for the installation (e.g., `deb-install`).
+        path: The installed file or directory (e.g., the .deb package or the directory of the extracted archive).
+        digest: The digest (algorithm:hash) of the installed asset, if known.
+    """
+    _write(
+        _set_installed_version(package_name, version),
+        (
+            "INSERT INTO install_history (name, version, action, path, digest, installed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (package_name, version, action, path, digest, time.time()),
+        ),
+        ("DELETE FROM holds WHERE name = ?", (package_name,)),
+    )
+
+
+def get_install_history(package_name: str) -> list[tuple]:
+    """Get the (version, action, path, digest, installed_at, removed_at) of every installation of a package.
+
+    The installations are returned newest first; looking them up uses the index on the package name.
+    """
+    cursor = _reader().execute(
+        """
+        SELECT version, action, path, digest, installed_at, removed_at FROM install_history
+        WHERE name = ? ORDER BY installed_at DESC
+        """,
+        (package_name,),
+    )
+    return cursor.fetchall()
+
+
+def mark_removed(package_name: str, path: str) -> None:
+    """Record that the installed file or directory `path` of a package has been removed."""
+    _write(
+        (
+            "UPDATE install_history SET removed_at = ? WHERE name = ? AND path = ? AND removed_at IS NULL",
+            (time.time(), package_name, path),
+        )
+    )
+
+
+def get_held_version(package_name: str) -> str | None:
+    """Get the version of a package that is not installed again (since it has been rolled back), or None."""
+    row = _reader().execute("SELECT version FROM holds WHERE name = ?", (package_name,)).fetchone()
+    return row[0] if row else None
+
+
+def set_held_version(package_name: str, version: str) -> None:
+    """Hold a package, i.e. do not install `version` again until another release is installed."""
+    _write(
+        (
+            """
+            INSERT INTO holds (name, version)
+            VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET version = excluded.version
+            """,
+            (package_name, version),
+        )
+    )
+
+
+def get_cached_response(url: str) -> tuple[str | None, str | None, str] | None:
+    """Get the cached (etag, last_modified, body) of an HTTP response, or None if the URL has not been cached."""
+    return _reader().execute("SELECT etag, last_modified, body FROM http_cache WHERE url = ?", (url,)).fetchone()
+
+
+def set_cached_response(url: str, etag: str | None, last_modified: str | None, body: str) -> None:
+    """Cache an HTTP response together with the validators required for revalidating it."""
+    _write(
+        (
+            """
+            INSERT INTO http_cache (url, etag, last_modified, body)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET
+                etag = excluded.etag, last_modified = excluded.last_modified, body = excluded.body
+            """,
+            (url, etag, last_modified, body),
+        ),
+        batched=True,
+    )
+
+
+def get_last_checked(package_name: str) -> float | None:
+    """Get the time (seconds since the epoch) of the last successful check of a package, or None."""
+    row = _reader().execute("SELECT last_checked FROM checks WHERE name = ?", (package_name,)).fetchone()
+    return row[0] if row else None
+
+
+def set_last_checked(package_name: str, timestamp: float) -> None:
+    """Record the time (seconds since the epoch) of a successful check of a package."""
+    _write(
+        (
+            """
+            INSERT INTO checks (name, last_checked)
+            VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET last_checked = excluded.last_checked
+            """,
+            (package_name, timestamp),
+        ),
+        batched=True,
+    )
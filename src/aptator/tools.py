@@ -1,19 +1,71 @@
-import hashlib
 import subprocess
-from pathlib import Path
+import sys
+import threading
+from contextlib import contextmanager
+
+from aptator.report import timed
 
 
 def run(cmd):
     """Run a command and return its output as a string."""
-    return subprocess.check_output(cmd, stderr=subprocess.DEVNULL, text=True).strip()
+    with timed("subprocess", command=" ".join(map(str, cmd))):
+        return subprocess.check_output(cmd, stderr=subprocess.DEVNULL, text=True).strip()
+
+
+class _ThreadLocalStream:
+    """Proxy for ``sys.stdout``/``sys.stderr`` that buffers writes of threads with an active capture."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        records = getattr(_captures, "records", None)
+        if records is None:
+            return self._stream.write(text)
+        records.append((self._stream, text))
+        return len(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class OutputBuffer:
+    """Output recorded by :func:`buffered_output`."""
+
+    def __init__(self):
+        self.records = []
+
+    def replay(self):
+        """Write the recorded output to the streams it was originally printed to (as one uninterrupted block)."""
+        with _replay_lock:
+            for stream, text in self.records:
+                stream.write(text)
+            for stream in {stream for stream, _ in self.records}:
+                stream.flush()
+        self.records.clear()
+
+
+_captures = threading.local()
+_proxy_lock = threading.Lock()
+_replay_lock = threading.Lock()
+
 
+@contextmanager
+def buffered_output():
+    """Buffer everything the current thread prints, so that concurrent workers do not interleave their output.
 
-def verify_checksum(file_path: Path, expected_hash: str, hash_type: str = "sha256") -> bool:
-    """Verify file checksum against expected hash."""
-    hash_func = getattr(hashlib, hash_type)()
-    with file_path.open("rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            hash_func.update(chunk)
+    Yields:
+        OutputBuffer: call ``replay()`` to emit the buffered output.
+    """
+    with _proxy_lock:
+        if not isinstance(sys.stdout, _ThreadLocalStream):
+            sys.stdout = _ThreadLocalStream(sys.stdout)
+        if not isinstance(sys.stderr, _ThreadLocalStream):
+            sys.stderr = _ThreadLocalStream(sys.stderr)
 
-    computed = hash_func.hexdigest()
-    return computed.lower() == expected_hash.lower()
+    output = OutputBuffer()
+    _captures.records = output.records
+    try:
+        yield output
+    finally:
+        _captures.records = None
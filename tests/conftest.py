@@ -0,0 +1,49 @@
+"""Shared fixtures; the tests run in a temporary HOME, so that they never touch the state or caches of the user."""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# set before aptator is imported, which derives its state and cache paths from them
+_home = tempfile.mkdtemp(prefix="aptator-tests-")
+os.environ.update(HOME=_home, XDG_CONFIG_HOME=f"{_home}/config", XDG_CACHE_HOME=f"{_home}/cache")
+os.environ.pop("GITHUB_TOKEN", None)
+
+from fake_github import FakeGitHub, Fixtures  # noqa: E402
+
+from aptator import AptatorConfig  # noqa: E402
+from aptator.source.github import GitHub  # noqa: E402
+
+
+@pytest.fixture
+def config(tmp_path):
+    """Return a function that makes aptator use a configuration with the given TOML text."""
+
+    def use(text: str = "") -> None:
+        path = tmp_path / "aptator.toml"
+        path.write_text(text)
+        AptatorConfig.use(path)
+
+    use()
+    return use
+
+
+@pytest.fixture
+def fake_github(tmp_path, monkeypatch, config):
+    """Run a :class:`FakeGitHub` with 10 packages and configure aptator to use it (with a token)."""
+    fake = FakeGitHub(Fixtures(tmp_path / "fixtures", deb_size=1024, archive_files=1, archive_file_size=16), 10)
+    server = fake.start()
+    config(
+        f'[github]\napi_url = "{fake.base_url}"\ntoken = "test-token"\n'
+        # tag tarballs refer to api.github.com, which the fake serves as a download mirror
+        f'[download]\nmirror = "{fake.base_url}/download"\n'
+        # the privileged helper runs without privileges
+        f'[paths]\nsudo = "{shutil.which("env")}"\n'
+    )
+    # every lookup has to reach the server, not the HTTP cache of a previous test
+    monkeypatch.setattr(GitHub, "use_cache", False)
+    yield fake
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,58 @@
+import os
+import sys
+
+from aptator import cli
+from aptator.cache import CACHE_DIR, DownloadCache, deferred_eviction
+
+KIB = 1024
+
+
+def _put(cache, tmp_path, key, size, mtime):
+    file_path = tmp_path / f"{key}.bin"
+    file_path.write_bytes(b"x" * size)
+    entry = cache.put(key, file_path).parent
+    os.utime(entry, (mtime, mtime))
+
+
+def _keys(cache):
+    return sorted(entry.name for entry in cache.path.iterdir() if not entry.name.startswith("."))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, config):
+    cache = DownloadCache(tmp_path / "cache", max_size=3 * KIB)
+    for i, key in enumerate(["a", "b", "c"]):
+        _put(cache, tmp_path, key, KIB, 1000 + i)
+    # using an entry protects it from eviction
+    assert cache.get("a").read_bytes() == b"x" * KIB
+    _put(cache, tmp_path, "d", KIB, 2000)
+    assert _keys(cache) == ["a", "c", "d"]
+    # an entry that is larger than the cache is kept until the next one is added
+    _put(cache, tmp_path, "e", 4 * KIB, 3000)
+    assert _keys(cache) == ["e"]
+    assert cache.stats() == (1, 4 * KIB)
+
+
+def test_eviction_is_deferred(tmp_path, config):
+    config("[cache]\nmax_size = 0\n")
+    cache = DownloadCache(tmp_path / "cache")
+    with deferred_eviction():
+        _put(cache, tmp_path, "a", KIB, 1000)
+        _put(cache, tmp_path, "b", KIB, 1001)
+        assert _keys(cache) == ["a", "b"]
+    assert cache.prune() == (2, 2 * KIB)
+
+
+def test_prune_command(tmp_path, monkeypatch, capsys, config):
+    cache = DownloadCache(CACHE_DIR, max_size=None)
+    cache.prune(max_size=0)
+    for i, key in enumerate(["a", "b", "c"]):
+        _put(cache, tmp_path, key, 600 * KIB, 1000 + i)
+
+    monkeypatch.setattr(sys, "argv", ["aptator", "cache", "prune", "--max-size", "1"])
+    cli.main()
+    assert _keys(cache) == ["c"]
+    assert "Removed 2 entries" in capsys.readouterr().out
+
+    monkeypatch.setattr(sys, "argv", ["aptator", "cache", "prune", "--max-size", "0"])
+    cli.main()
+    assert _keys(cache) == []
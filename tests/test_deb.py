@@ -0,0 +1,31 @@
+from aptator.pipeline import run_pipeline
+from aptator.report import report
+from aptator.state import get_installed_version
+
+SUDO_STUB = """#!/bin/sh
+echo "$*" >> "{log}"
+case "$1" in
+  */dpkg) case "$*" in *{failing}*) exit 1 ;; esac; exit 0 ;;
+esac
+exec "$@"
+"""
+
+
+def test_failed_batch_falls_back_to_single_packages(fake_github, config, tmp_path):
+    packages = [pkg for pkg in fake_github.packages(tmp_path) if pkg["action"]["type"] == "deb-install"][:3]
+    for pkg in packages:
+        pkg["name"] = f"deb-{tmp_path.name}-{pkg['name']}"
+    failing = packages[1]["repo"].split("/")[1]
+    log = tmp_path / "sudo.log"
+    sudo = tmp_path / "sudo"
+    sudo.write_text(SUDO_STUB.format(log=log, failing=failing))
+    sudo.chmod(0o755)
+    config(f'[github]\napi_url = "{fake_github.base_url}"\n[paths]\nsudo = "{sudo}"\n')
+
+    report.reset()
+    run_pipeline(packages, set())
+    calls = [line.split() for line in log.read_text().splitlines()]
+    # one batch with all packages, then every package on its own
+    assert [len(call) for call in calls] == [5, 3, 3, 3]
+    assert [report.status[pkg["name"]] for pkg in packages] == ["updated", "failed", "updated"]
+    assert [get_installed_version(pkg["name"]) for pkg in packages] == ["1.0.0", None, "1.0.0"]
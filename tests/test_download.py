@@ -0,0 +1,170 @@
+import hashlib
+import http.client
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from aptator import download
+from aptator.report import report
+
+SIZE = 64 * 1024
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serve `server.content` with a strong ETag and support for (single) `Range` and `If-Range` requests.
+
+    The first `server.interrupt` responses are cut off after half of their body, as if the connection dropped.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        server = self.server
+        content = server.content
+        etag = f'"{hashlib.sha256(content).hexdigest()[:16]}"'
+        start, end = 0, len(content) - 1
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        partial = match and self.headers.get("If-Range", etag) == etag
+        if partial:
+            start, end = int(match[1]), int(match[2] or end)
+        with server.lock:
+            server.requests.append((self.command, self.headers.get("Range"), self.headers.get("If-Range")))
+            interrupt = not head and server.interrupt > 0
+            server.interrupt -= interrupt
+        body = content[start : end + 1]
+        self.send_response(206 if partial else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(body)))
+        if partial:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        self.end_headers()
+        if head:
+            return
+        if interrupt:
+            body = body[: len(body) // 2]
+            self.close_connection = True
+        self.wfile.write(body)
+        with server.lock:
+            server.sent += len(body)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch, config):
+    config("[http]\nretries = 0\n")
+    monkeypatch.setattr(download, "PARTIAL_DIR", tmp_path / "partial")
+    monkeypatch.setattr(download, "CHUNK_SIZE", 4096)
+    # interrupted downloads are resumed by the next call instead of being retried
+    monkeypatch.setattr(download, "RETRIES", 0)
+    monkeypatch.setattr(download, "SEGMENT_MIN_SIZE", 1)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    server.daemon_threads = True
+    server.content = bytes(range(256)) * (SIZE // 256)
+    server.interrupt = 0
+    server.requests = []
+    server.sent = 0
+    server.lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/asset.bin"
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _leftovers():
+    return sorted(path.suffix for path in download.PARTIAL_DIR.iterdir())
+
+
+def test_download(server, tmp_path):
+    digest = download.download(server.url, tmp_path / "asset.bin", "sha256", segments=1)
+    assert digest == hashlib.sha256(server.content).hexdigest()
+    assert (tmp_path / "asset.bin").read_bytes() == server.content
+    assert _leftovers() == []
+
+
+def test_resume(server, tmp_path):
+    server.interrupt = 1
+    with pytest.raises(http.client.HTTPException):
+        download.download(server.url, tmp_path / "asset.bin", "sha256", segments=1)
+    assert _leftovers() == [".part", ".validator"]
+
+    server.sent = 0
+    report.reset()
+    digest = download.download(server.url, tmp_path / "asset.bin", "sha256", segments=1)
+    assert server.requests[-1][1] == f"bytes={SIZE // 2}-"
+    assert server.sent == SIZE // 2
+    # only the bytes transferred by this run are reported
+    assert report.phases[-1]["bytes"] == SIZE // 2
+    assert digest == hashlib.sha256(server.content).hexdigest()
+    assert (tmp_path / "asset.bin").read_bytes() == server.content
+    assert _leftovers() == []
+
+
+def test_resume_changed_asset(server, tmp_path):
+    server.interrupt = 1
+    with pytest.raises(http.client.HTTPException):
+        download.download(server.url, tmp_path / "asset.bin", "sha256", segments=1)
+
+    # the validator does not match anymore: the server sends the complete new asset
+    server.content = bytes(reversed(server.content))
+    digest = download.download(server.url, tmp_path / "asset.bin", "sha256", segments=1)
+    assert server.requests[-1][1] == f"bytes={SIZE // 2}-"
+    assert digest == hashlib.sha256(server.content).hexdigest()
+    assert (tmp_path / "asset.bin").read_bytes() == server.content
+
+
+def test_segmented(server, tmp_path):
+    digest = download.download(server.url, tmp_path / "asset.bin", "sha256", segments=4)
+    ranges = sorted(request[1] for request in server.requests if request[0] == "GET")
+    assert ranges == sorted(f"bytes={start}-{start + SIZE // 4 - 1}" for start in range(0, SIZE, SIZE // 4))
+    assert digest == hashlib.sha256(server.content).hexdigest()
+    assert (tmp_path / "asset.bin").read_bytes() == server.content
+    assert _leftovers() == []
+
+
+def test_segmented_resume(server, tmp_path):
+    server.interrupt = 4
+    with pytest.raises(http.client.HTTPException):
+        download.download(server.url, tmp_path / "asset.bin", "sha256", segments=4)
+    assert _leftovers() == [".part", ".segments"]
+
+    server.sent = 0
+    report.reset()
+    digest = download.download(server.url, tmp_path / "asset.bin", "sha256", segments=4)
+    assert server.sent == SIZE // 2
+    assert report.phases[-1]["bytes"] == SIZE // 2
+    assert digest == hashlib.sha256(server.content).hexdigest()
+    assert (tmp_path / "asset.bin").read_bytes() == server.content
+    assert _leftovers() == []
+
+
+def test_segmented_resume_changed_asset(server, tmp_path):
+    server.interrupt = 4
+    with pytest.raises(http.client.HTTPException):
+        download.download(server.url, tmp_path / "asset.bin", "sha256", segments=4)
+
+    server.content = bytes(reversed(server.content))
+    server.sent = 0
+    digest = download.download(server.url, tmp_path / "asset.bin", "sha256", segments=4)
+    assert server.sent == SIZE
+    assert digest == hashlib.sha256(server.content).hexdigest()
+    assert (tmp_path / "asset.bin").read_bytes() == server.content
+
+
+def test_segmented_removes_stale_validator(server, tmp_path):
+    # an interrupted single-stream attempt, followed by a segmented download
+    server.interrupt = 1
+    with pytest.raises(http.client.HTTPException):
+        download.download(server.url, tmp_path / "asset.bin", "sha256", segments=1)
+    digest = download.download(server.url, tmp_path / "asset.bin", "sha256", segments=4)
+    assert digest == hashlib.sha256(server.content).hexdigest()
+    assert (tmp_path / "asset.bin").read_bytes() == server.content
+    assert _leftovers() == []
@@ -0,0 +1,43 @@
+import io
+import tarfile
+
+import pytest
+
+from aptator.actions.extract import extract_archive
+
+
+def _archive(files: dict[str, bytes]) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(f"app/{name}")
+            info.size = len(data)
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_incremental_extraction(tmp_path, workers):
+    extract_archive(_archive({"same": b"same", "changed": b"old"}), tmp_path / "app-1", workers=workers)
+    extract_archive(
+        _archive({"same": b"same", "changed": b"new"}), tmp_path / "app-2", tmp_path / "app-1", workers=workers
+    )
+    assert (tmp_path / "app-2" / "same").stat().st_ino == (tmp_path / "app-1" / "same").stat().st_ino
+    assert (tmp_path / "app-2" / "changed").read_bytes() == b"new"
+    assert (tmp_path / "app-1" / "changed").read_bytes() == b"old"
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_incremental_extraction_stays_in_previous(tmp_path, workers):
+    # a symlink in the previous version must not make the extraction hardlink a file outside of it
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "secret").write_bytes(b"same")
+    previous = tmp_path / "app-1"
+    previous.mkdir()
+    (previous / "lib").symlink_to(outside)
+    extract_archive(_archive({"lib/secret": b"same"}), tmp_path / "app-2", previous, workers=workers)
+    assert (tmp_path / "app-2" / "lib" / "secret").read_bytes() == b"same"
+    assert (tmp_path / "app-2" / "lib" / "secret").stat().st_ino != (outside / "secret").stat().st_ino
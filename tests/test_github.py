@@ -0,0 +1,32 @@
+import io
+import json
+
+import pytest
+
+from aptator.source import github
+
+DOCUMENTS = [
+    [],
+    [1.5],
+    [1.5, -20e3, 300, 0],
+    [{"name": "v1.0.0", "tarball_url": "https://example.com/v1.0.0"}, "é€", None, True, [[]]],
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 4096])
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_iter_json_array(monkeypatch, chunk_size, document):
+    # elements (and multibyte characters) that straddle the reads must be decoded as a whole
+    monkeypatch.setattr(github, "CHUNK_SIZE", chunk_size)
+    text = json.dumps(document, ensure_ascii=False, indent=1)
+    raw = []
+    assert list(github._iter_json_array(io.BytesIO(text.encode()), raw)) == document
+    assert json.loads("".join(raw)) == document
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4096])
+@pytest.mark.parametrize("text", ["", "{}", "[1", "[1,", "[1.5 2]", "[1x]"])
+def test_iter_json_array_invalid(monkeypatch, chunk_size, text):
+    monkeypatch.setattr(github, "CHUNK_SIZE", chunk_size)
+    with pytest.raises(ValueError):
+        list(github._iter_json_array(io.BytesIO(text.encode()), []))
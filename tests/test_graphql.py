@@ -0,0 +1,60 @@
+import pytest
+
+from aptator.pipeline import resolve_release
+from aptator.source.graphql import resolve_latest
+
+
+def _variants(packages):
+    # prerelease packages are resolved from the list of releases instead of the latest release
+    return packages + [{**pkg, "prerelease": True} for pkg in packages if not pkg.get("use_tag")]
+
+
+def test_graphql_resolves_every_package(fake_github):
+    packages = _variants(fake_github.packages(fake_github.fixtures.deb.parent))
+    prefetched = resolve_latest(packages)
+    assert len(prefetched) == len(packages)
+
+
+@pytest.mark.parametrize("use_tag", [False, True])
+def test_graphql_and_rest_resolve_the_same_release(fake_github, use_tag):
+    packages = [
+        pkg
+        for pkg in _variants(fake_github.packages(fake_github.fixtures.deb.parent))
+        if pkg.get("use_tag", False) == use_tag
+    ]
+    assert packages
+    prefetched = resolve_latest(packages)
+    for pkg in packages:
+        _, rest, rest_version = resolve_release(pkg)
+        _, graphql, graphql_version = resolve_release(pkg, prefetched)
+        assert type(graphql) is type(rest)
+        assert graphql.data == rest.data
+        assert graphql_version == rest_version
+
+
+def test_latest_tag_is_the_latest_by_name(fake_github):
+    # the tag with the newest commit is not the latest by name, which is the one listed first by the REST API
+    pkg = next(pkg for pkg in fake_github.packages(fake_github.fixtures.deb.parent) if pkg.get("use_tag"))
+    assert resolve_release(pkg, resolve_latest([pkg]))[2] == "1.0.0"
+
+
+def test_malformed_results_fall_back_to_rest(fake_github, monkeypatch):
+    packages = [pkg for pkg in fake_github.packages(fake_github.fixtures.deb.parent) if not pkg.get("use_tag")][:3]
+    graphql = fake_github.graphql
+
+    def malformed(document):
+        result = graphql(document)
+        del result["data"]["r0"]["latestRelease"]["releaseAssets"]
+        result["data"]["r1"]["latestRelease"] = {"tag": "v1.0.0"}
+        return result
+
+    monkeypatch.setattr(fake_github, "graphql", malformed)
+    prefetched = resolve_latest(packages)
+    assert len(prefetched) == 1
+    for pkg in packages:
+        assert resolve_release(pkg, prefetched)[2] == "1.0.0"
+
+
+def test_malformed_response_falls_back_to_rest(fake_github, monkeypatch):
+    monkeypatch.setattr(fake_github, "graphql", lambda document: {"data": ["unexpected"]})
+    assert resolve_latest(fake_github.packages(fake_github.fixtures.deb.parent)) == {}
@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+from aptator import pipeline
+from aptator.report import report
+
+
+def _threads():
+    # threads that keep the process alive (the feeder and the download pool, not the fake server)
+    return {thread for thread in threading.enumerate() if not thread.daemon and thread is not threading.main_thread()}
+
+
+def _fail(items):
+    raise RuntimeError("database is locked")
+
+
+def test_install_errors_fail_the_batch(fake_github):
+    report.reset()
+    before = _threads()
+    packages = fake_github.packages(fake_github.fixtures.deb.parent)
+    pipeline.run_pipeline(packages, set(), download_jobs=2, install=_fail)
+    assert _threads() <= before
+    assert {report.status[pkg["name"]] for pkg in packages} == {"failed"}
+
+
+def test_interrupted_install_stops_the_pipeline(fake_github):
+    def interrupt(items):
+        raise KeyboardInterrupt
+
+    before = _threads()
+    with pytest.raises(KeyboardInterrupt):
+        pipeline.run_pipeline(
+            fake_github.packages(fake_github.fixtures.deb.parent), set(), download_jobs=2, install=interrupt
+        )
+    assert _threads() <= before
+
+
+def test_check_errors_are_raised(fake_github, monkeypatch):
+    def resolve_latest(packages):
+        raise RuntimeError("unexpected")
+
+    monkeypatch.setattr(pipeline, "resolve_latest", resolve_latest)
+    before = _threads()
+    with pytest.raises(RuntimeError, match="unexpected"):
+        pipeline.run_pipeline(fake_github.packages(fake_github.fixtures.deb.parent), set(), install=_fail)
+    assert _threads() <= before
@@ -0,0 +1,54 @@
+import pytest
+
+from aptator.plan import PLAN_VERSION, apply_plan, create_plan, load_plan, write_plan
+from aptator.report import report
+from aptator.state import get_installed_version
+
+
+@pytest.fixture
+def packages(fake_github, tmp_path):
+    """The archive packages (of releases and of tags), named after the test."""
+    packages = [pkg for pkg in fake_github.packages(tmp_path) if pkg["action"]["type"] == "extract-and-link"]
+    for pkg in packages:
+        pkg["name"] = f"planned-{tmp_path.name}-{pkg['name']}"
+    return packages
+
+
+def _apply(plan, packages):
+    report.reset()
+    apply_plan(plan, packages)
+    return [report.status.get(pkg["name"]) for pkg in packages]
+
+
+def test_plan_and_apply(packages, tmp_path):
+    path = tmp_path / "plan.json"
+    write_plan(create_plan(packages, set()), path)
+    plan = load_plan(path)
+    assert [(entry["installed_version"], entry["latest_version"], entry["update"]) for entry in plan["packages"]] == [
+        (None, "1.0.0", True)
+    ] * len(packages)
+
+    assert _apply(plan, packages) == ["updated"] * len(packages)
+    assert [get_installed_version(pkg["name"]) for pkg in packages] == ["1.0.0"] * len(packages)
+    for pkg in packages:
+        assert (tmp_path / pkg["repo"].split("/")[1]).is_symlink()
+
+    # the plan has been applied on this host; applying it again installs nothing
+    assert _apply(plan, packages) == ["up-to-date"] * len(packages)
+
+
+def test_stale_plans_are_rejected(packages, tmp_path):
+    plan = create_plan(packages, set())
+    # the configuration of the host changed since the plan has been created
+    released = next(pkg for pkg in packages if not pkg.get("use_tag"))
+    released["asset_pattern"] = r"\.zip$"
+    unconfigured = packages.pop()
+    assert _apply(plan, packages) == ["failed" if pkg is released else "updated" for pkg in packages]
+    assert report.status[unconfigured["name"]] == "failed"
+    assert get_installed_version(released["name"]) is None
+    assert get_installed_version(unconfigured["name"]) is None
+
+    path = tmp_path / "plan.json"
+    write_plan({**plan, "version": PLAN_VERSION + 1}, path)
+    with pytest.raises(ValueError, match="is not an aptator plan"):
+        load_plan(path)
@@ -0,0 +1,69 @@
+import io
+import shutil
+import subprocess
+import tarfile
+
+import pytest
+
+from aptator.privileged import FsPlan
+
+
+@pytest.fixture(autouse=True)
+def unprivileged(config):
+    # the helper runs without privileges; its operations only touch `tmp_path`
+    config(f'[paths]\nsudo = "{shutil.which("env")}"\n[extract]\nworkers = 2\n')
+
+
+def _archive(path, files: dict[str, bytes]):
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+def test_extract_and_swap_symlink(tmp_path):
+    archive = _archive(tmp_path / "app.tar.gz", {"app/bin/tool": b"v1"})
+    FsPlan().extract(tmp_path / "app-1", archive).symlink(tmp_path / "app-1", tmp_path / "app").execute()
+    assert (tmp_path / "app" / "bin" / "tool").read_bytes() == b"v1"
+
+    archive = _archive(tmp_path / "app.tar.gz", {"app/bin/tool": b"v2"})
+    with archive.open("rb") as f:
+        # the archive is streamed to the helper
+        FsPlan().extract(tmp_path / "app-2").symlink(tmp_path / "app-2", tmp_path / "app").execute(stdin=f)
+    assert (tmp_path / "app").readlink() == tmp_path / "app-2"
+    assert (tmp_path / "app" / "bin" / "tool").read_bytes() == b"v2"
+    assert (tmp_path / "app-1" / "bin" / "tool").read_bytes() == b"v1"
+
+
+def test_move_and_remove(tmp_path):
+    (tmp_path / "staged").mkdir()
+    (tmp_path / "staged" / "file").write_text("new")
+    (tmp_path / "target").mkdir()
+    (tmp_path / "target" / "old").write_text("old")
+    (tmp_path / "obsolete").mkdir()
+    (tmp_path / "link").symlink_to(tmp_path / "target")
+    plan = FsPlan().move(tmp_path / "staged", tmp_path / "target").remove(tmp_path / "obsolete")
+    plan.remove(tmp_path / "link").remove(tmp_path / "missing").execute()
+    assert not any((tmp_path / name).exists() for name in ("staged", "obsolete", "link"))
+    assert [path.name for path in (tmp_path / "target").iterdir()] == ["file"]
+
+
+def test_member_outside_of_the_destination_is_rejected(tmp_path):
+    archive = _archive(tmp_path / "evil.tar.gz", {"app/file": b"", "app/../../escaped": b"evil"})
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        FsPlan().extract(tmp_path / "out" / "app-1", archive).execute()
+    assert "outside" in e.value.stderr
+    assert not (tmp_path / "escaped").exists()
+    assert not (tmp_path / "out" / "app-1").exists()
+
+
+def test_failed_operation_aborts_the_plan(tmp_path):
+    (tmp_path / "keep").mkdir()
+    plan = FsPlan().move(tmp_path / "missing", tmp_path / "target").remove(tmp_path / "keep")
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        plan.execute()
+    assert "FileNotFoundError" in e.value.stderr
+    assert (tmp_path / "keep").is_dir()
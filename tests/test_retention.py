@@ -0,0 +1,57 @@
+import fake_github as fake_module
+import pytest
+
+from aptator.pipeline import run_pipeline
+from aptator.report import report
+from aptator.retention import rollback
+from aptator.state import get_held_version, get_installed_version
+
+
+@pytest.fixture
+def package(fake_github, tmp_path):
+    """An extract-and-link package that retains two versions, with an `extract_to` with a trailing slash."""
+    pkg = next(
+        pkg
+        for pkg in fake_github.packages(tmp_path)
+        if pkg["action"]["type"] == "extract-and-link" and not pkg.get("use_tag")
+    )
+    opt = tmp_path / "opt"
+    opt.mkdir()
+    pkg.update(name=f"retained-{tmp_path.name}", keep=2)
+    pkg["action"].update(extract_to=f"{opt}/", link_to=str(opt / "app"))
+    return pkg
+
+
+def _install(pkg, version, monkeypatch, force=()):
+    monkeypatch.setattr(fake_module, "VERSION", version)
+    report.reset()
+    run_pipeline([pkg], set(force))
+    return report.status[pkg["name"]]
+
+
+def test_keep_prunes_old_versions(package, tmp_path, monkeypatch):
+    for version in ("1.0.0", "1.1.0", "1.2.0"):
+        assert _install(package, version, monkeypatch) == "updated"
+    name = package["name"]
+    assert sorted(path.name for path in (tmp_path / "opt").iterdir()) == ["app", f"{name}-1.1.0", f"{name}-1.2.0"]
+    assert (tmp_path / "opt" / "app").readlink() == tmp_path / "opt" / f"{name}-1.2.0"
+
+
+def test_rollback_holds_the_version_until_forced(package, tmp_path, monkeypatch):
+    for version in ("1.0.0", "1.1.0"):
+        _install(package, version, monkeypatch)
+    name = package["name"]
+
+    assert rollback(package) == "1.0.0"
+    assert (tmp_path / "opt" / "app").readlink() == tmp_path / "opt" / f"{name}-1.0.0"
+    assert get_installed_version(name) == "1.0.0"
+    assert get_held_version(name) == "1.1.0"
+
+    # the held version is not installed again
+    assert _install(package, "1.1.0", monkeypatch) == "up-to-date"
+    assert get_installed_version(name) == "1.0.0"
+
+    assert _install(package, "1.1.0", monkeypatch, force=[name]) == "updated"
+    assert get_installed_version(name) == "1.1.0"
+    assert get_held_version(name) is None
+    assert (tmp_path / "opt" / "app").readlink() == tmp_path / "opt" / f"{name}-1.1.0"
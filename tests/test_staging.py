@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from aptator import staging
+from aptator.pipeline import run_pipeline
+from aptator.report import report
+
+
+@pytest.fixture
+def staging_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(staging, "STAGING_DIR", tmp_path / "staging")
+    monkeypatch.setattr(staging, "MANIFEST", tmp_path / "staging" / "manifest.json")
+    return tmp_path / "staging"
+
+
+def test_unreadable_manifest_is_empty(staging_dir, capsys):
+    staging_dir.mkdir()
+    staging.MANIFEST.write_text("{not json")
+    assert staging.load_manifest() == {}
+    assert "unreadable manifest" in capsys.readouterr().err
+
+
+def test_failed_discard_only_fails_its_package(fake_github, staging_dir, monkeypatch):
+    packages = [pkg for pkg in fake_github.packages(staging_dir) if pkg["action"]["type"] == "deb-install"][:2]
+    first, second = (pkg["name"] for pkg in packages)
+    previous = {"latest_version": "0.9.0", "artifact": None, "tree": None}
+    staging_dir.mkdir()
+    staging.MANIFEST.write_text(json.dumps({first: previous}))
+
+    def discard(entry):
+        raise OSError("helper failed")
+
+    monkeypatch.setattr(staging, "_discard", discard)
+    report.reset()
+    run_pipeline(packages, set(), install=staging.stage_updates)
+    assert report.status == {first: "failed", second: "staged"}
+    manifest = staging.load_manifest()
+    assert manifest[first] == previous
+    assert manifest[second]["latest_version"] == "1.0.0"
+    assert (staging_dir / second).is_dir()
@@ -0,0 +1,11 @@
+import subprocess
+import sys
+
+# imported by the commands that check or install packages, but not by every start of the CLI
+HEAVY_MODULES = ["http.client", "sqlite3", "ssl", "urllib.request"]
+
+
+def test_cli_import_does_not_load_heavy_modules():
+    code = f"import sys, aptator.cli; print(*sorted(set({HEAVY_MODULES!r}) & sys.modules.keys()))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.split() == []
@@ -0,0 +1,69 @@
+import os
+import threading
+
+import pytest
+
+from aptator import state
+from aptator.state import (
+    batch_writes,
+    get_installed_version,
+    get_last_checked,
+    record_install,
+    run_lock,
+    set_last_checked,
+)
+
+
+def test_readers_are_not_blocked_by_a_write_transaction(request):
+    name = request.node.name
+    set_last_checked(name, 1.0)
+    assert state._reader().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    with state.write_lock:
+        writer = state._writer()
+        writer.execute("BEGIN IMMEDIATE")
+        try:
+            writer.execute("UPDATE checks SET last_checked = 2.0 WHERE name = ?", (name,))
+            # the reader sees the last committed value instead of waiting for the writer
+            assert get_last_checked(name) == 1.0
+        finally:
+            writer.rollback()
+    assert get_last_checked(name) == 1.0
+
+
+def test_batched_writes_are_committed_at_the_end(request):
+    name = request.node.name
+    with batch_writes():
+        set_last_checked(name, 1.0)
+        with batch_writes():
+            set_last_checked(name, 2.0)
+        assert get_last_checked(name) is None
+        # installations are committed immediately
+        record_install(name, "1.0.0")
+        assert get_installed_version(name) == "1.0.0"
+    assert get_last_checked(name) == 2.0
+
+
+def test_batched_writes_are_committed_on_errors(request):
+    name = request.node.name
+    with pytest.raises(RuntimeError), batch_writes():
+        set_last_checked(name, 1.0)
+        raise RuntimeError
+    assert get_last_checked(name) == 1.0
+    assert not state._pending
+
+
+def test_run_lock_excludes_other_holders(capsys):
+    entered = threading.Event()
+
+    def other():
+        with run_lock():
+            entered.set()
+
+    with run_lock():
+        thread = threading.Thread(target=other)
+        thread.start()
+        assert not entered.wait(0.2)
+        assert state.db_path.with_suffix(".lock").read_text() == str(os.getpid())
+    thread.join(5)
+    assert entered.is_set()
+    assert f"Waiting for another aptator process (pid {os.getpid()})" in capsys.readouterr().err